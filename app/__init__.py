@@ -75,10 +75,15 @@ def create_app(config_class=Config):
     # Настраиваем логирование
     _setup_logging(app)
     
+    # Инициализируем очередь фоновых задач
+    from app.services.job_queue import init_job_queue
+    init_job_queue(app)
+    
     # Регистрируем blueprints
-    from app.routes import main, upload, download, scenarios, auth, history, logs, admin, glossary, prompts
+    from app.routes import main, upload, batch, download, scenarios, auth, history, logs, admin, glossary, prompts
     app.register_blueprint(main.bp)
     app.register_blueprint(upload.bp)
+    app.register_blueprint(batch.bp)
     app.register_blueprint(download.bp)
     app.register_blueprint(scenarios.bp)
     app.register_blueprint(auth.bp)
@@ -46,6 +46,35 @@ class Config:
     # Можно установить через переменную окружения OPENAI_PROXY
     OPENAI_PROXY = os.environ.get('OPENAI_PROXY', None)
     
+    # Фоновая обработка загрузок
+    # JOB_WORKERS - количество воркеров, одновременно выполняющих конвертацию и сценарий
+    # JOB_QUEUE_MAX_SIZE - максимальная длина очереди (0 - без ограничений)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_QUEUE_MAX_SIZE = int(os.environ.get('JOB_QUEUE_MAX_SIZE', 100))
+    
+    # Асинхронное выполнение запросов к ИИ (asyncio) вместо потока на каждый промпт
+    # Все запросы процесса выполняются в одном event loop, поэтому JOB_WORKERS можно увеличить
+    AI_ASYNC_EXECUTION = os.environ.get('AI_ASYNC_EXECUTION', 'false').lower() in ('true', '1', 'yes')
+    
+    # Поток статуса задачи (SSE) и long-polling
+    # STATUS_STREAM_MAX_SECONDS - длительность одного SSE соединения (затем браузер переподключается)
+    # STATUS_STREAM_KEEPALIVE_SECONDS - интервал keepalive-комментариев при отсутствии событий
+    # STATUS_STREAM_MAX_PER_WORKER - одновременных SSE потоков на процесс (каждый занимает поток
+    #   gunicorn); сверх лимита поток отклоняется с 503 и браузер переходит на long-polling
+    # STATUS_LONG_POLL_TIMEOUT - максимальное ожидание изменения статуса в long-polling запросе
+    STATUS_STREAM_MAX_SECONDS = int(os.environ.get('STATUS_STREAM_MAX_SECONDS', 300))
+    STATUS_STREAM_KEEPALIVE_SECONDS = int(os.environ.get('STATUS_STREAM_KEEPALIVE_SECONDS', 15))
+    STATUS_STREAM_MAX_PER_WORKER = int(os.environ.get('STATUS_STREAM_MAX_PER_WORKER', 8))
+    STATUS_LONG_POLL_TIMEOUT = int(os.environ.get('STATUS_LONG_POLL_TIMEOUT', 25))
+    
+    # Пакетная загрузка (/upload/batch: несколько файлов или ZIP архив)
+    # BATCH_MAX_FILES - максимальное число документов в пакете
+    # BATCH_CONCURRENCY - сколько документов пакета обрабатывается одновременно
+    # BATCH_MAX_UNCOMPRESSED_MB - допустимый суммарный размер документов пакета после распаковки ZIP
+    BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 30))
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 3))
+    BATCH_MAX_UNCOMPRESSED_MB = int(os.environ.get('BATCH_MAX_UNCOMPRESSED_MB', 200))
+    
     # Настройки Flask
     JSON_AS_ASCII = False
     JSONIFY_PRETTYPRINT_REGULAR = True
@@ -5,6 +5,7 @@ JayFlow API клиент
 """
 
 import os
+import sys
 import json
 from typing import Optional, Dict, Any
 from pathlib import Path
@@ -12,6 +13,11 @@ from datetime import datetime
 
 from app.core.ai.base import BaseAIClient
 
+# Добавляем путь к src для общего пула HTTP-соединений
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / 'src'))
+
+from http_pool import get_requests_session
+
 
 class JayFlowClient(BaseAIClient):
     """Клиент для работы с Jay Flow API"""
@@ -107,8 +113,10 @@ class JayFlowClient(BaseAIClient):
             if self.thread_id:
                 data['threadId'] = self.thread_id
             
+            # Общая сессия с пулом keep-alive соединений
+            session = get_requests_session('jayflow')
             if use_post:
-                response = requests.post(
+                response = session.post(
                     self.api_url,
                     json=data,
                     headers=headers,
@@ -116,7 +124,7 @@ class JayFlowClient(BaseAIClient):
                     verify=self.verify_ssl
                 )
             else:
-                response = requests.get(
+                response = session.get(
                     self.api_url,
                     params=data,
                     headers=headers,
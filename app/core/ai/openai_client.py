@@ -5,6 +5,7 @@ OpenAI API клиент
 """
 
 import os
+import sys
 import json
 import time
 from typing import Optional, Dict, Any
@@ -15,6 +16,11 @@ from datetime import datetime
 from app.core.ai.base import BaseAIClient
 from app.config import Config
 
+# Добавляем путь к src для общего пула HTTP-соединений
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / 'src'))
+
+from http_pool import get_openai_client
+
 
 class OpenAIClient(BaseAIClient):
     """Клиент для работы с OpenAI API"""
@@ -88,60 +94,27 @@ class OpenAIClient(BaseAIClient):
             }
         
         try:
-            # Настройка клиента OpenAI с поддержкой прокси
-            # Используем только переменные окружения - httpx подхватит их автоматически
-            old_http_proxy = None
-            old_https_proxy = None
-            
-            if self.proxy:
-                # Сохраняем старые значения
-                old_http_proxy = os.environ.get('HTTP_PROXY')
-                old_https_proxy = os.environ.get('HTTPS_PROXY')
-                
-                # Устанавливаем переменные окружения ДО создания клиента
-                # httpx (который использует openai) автоматически подхватит их
-                os.environ['HTTP_PROXY'] = self.proxy
-                os.environ['HTTPS_PROXY'] = self.proxy
-                # Также пробуем альтернативные переменные
-                os.environ['http_proxy'] = self.proxy
-                os.environ['https_proxy'] = self.proxy
-            
-            # Создаем клиент OpenAI
-            # Переменные окружения будут автоматически использованы httpx
-            client = openai.OpenAI(api_key=self.api_key)
+            # Общий клиент поверх пула keep-alive соединений (прокси задается на уровне пула)
+            client = get_openai_client(self.api_key, proxy=self.proxy)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
             # Сохраняем промпт для отладки
             self._save_debug_prompt(prompt, timestamp)
             
-            try:
-                # Увеличиваем таймаут для запроса через прокси
-                response = client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Ты эксперт по технической документации. Твоя задача - заполнить JSON шаблон данными из технического задания. Отвечай только валидным JSON без дополнительных комментариев."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    timeout=1200.0  # Таймаут 20 минут
-                )
-            finally:
-                # Восстанавливаем старые значения переменных окружения
-                if self.proxy:
-                    if old_http_proxy is not None:
-                        os.environ['HTTP_PROXY'] = old_http_proxy
-                    else:
-                        os.environ.pop('HTTP_PROXY', None)
-                    
-                    if old_https_proxy is not None:
-                        os.environ['HTTPS_PROXY'] = old_https_proxy
-                    else:
-                        os.environ.pop('HTTPS_PROXY', None)
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Ты эксперт по технической документации. Твоя задача - заполнить JSON шаблон данными из технического задания. Отвечай только валидным JSON без дополнительных комментариев."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                timeout=1200.0  # Таймаут 20 минут
+            )
             
             content = response.choices[0].message.content if response.choices else None
             
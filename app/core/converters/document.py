@@ -10,6 +10,12 @@ from pathlib import Path
 from typing import Optional
 import mimetypes
 
+# Извлечение DOCX/Excel и пул LibreOffice общие с конвертером src/
+sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent / 'src'))
+
+from docx_extract import extract_docx_text
+from excel_extract import extract_xls_text, extract_xlsx_text
+from office_pool import OfficeUnavailable, get_office_pool
 from app.core.converters.base import BaseConverter
 from app.utils.exceptions import DocumentConversionError
 
@@ -82,172 +88,18 @@ class DocumentConverter(BaseConverter):
         return "\n".join(text_content)
     
     def convert_docx(self, file_path: str) -> str:
-        """Конвертирует DOCX в текст с извлечением из всех элементов"""
-        try:
-            from docx import Document
-            from docx.oxml.text.paragraph import CT_P
-            from docx.oxml.table import CT_Tbl
-            from docx.oxml.text.run import CT_R
-        except ImportError:
-            raise ImportError("Для работы с DOCX установите: pip install python-docx")
+        """Конвертирует DOCX в текст: абзацы, таблицы и колонтитулы за один потоковый проход"""
+        import zipfile
+        from xml.etree.ElementTree import ParseError
         
         try:
-            doc = Document(file_path)
-        except Exception as e:
+            return extract_docx_text(file_path)
+        except (zipfile.BadZipFile, ParseError, ValueError) as e:
             raise RuntimeError(f"Не удалось открыть DOCX файл: {e}")
-        
-        text_content = []
-        
-        # Функция для извлечения текста из элемента (включая вложенные элементы)
-        def extract_text_from_element(element):
-            """Рекурсивно извлекает весь текст из элемента"""
-            text_parts = []
-            
-            # Если это параграф
-            if hasattr(element, 'text'):
-                if element.text and element.text.strip():
-                    text_parts.append(element.text.strip())
-            
-            # Извлекаем текст из всех дочерних элементов
-            if hasattr(element, '__iter__'):
-                for child in element:
-                    child_text = extract_text_from_element(child)
-                    if child_text:
-                        text_parts.append(child_text)
-            
-            # Для runs (фрагментов текста) извлекаем текст напрямую
-            if hasattr(element, 'runs'):
-                for run in element.runs:
-                    if run.text and run.text.strip():
-                        text_parts.append(run.text.strip())
-            
-            return ' '.join(text_parts) if text_parts else ''
-        
-        # Извлекаем текст из всех параграфов (включая заголовки и подзаголовки)
-        for paragraph in doc.paragraphs:
-            para_text = paragraph.text.strip()
-            if para_text:
-                text_content.append(para_text)
-            
-            # Дополнительно извлекаем текст из runs (на случай, если paragraph.text не работает)
-            if not para_text:
-                runs_text = []
-                for run in paragraph.runs:
-                    if run.text and run.text.strip():
-                        runs_text.append(run.text.strip())
-                if runs_text:
-                    text_content.append(' '.join(runs_text))
-        
-        # Извлекаем текст из таблиц (более детально)
-        for table in doc.tables:
-            text_content.append("\n--- Таблица ---\n")
-            for row_idx, row in enumerate(table.rows):
-                row_text = []
-                for cell in row.cells:
-                    # Извлекаем текст из всех параграфов ячейки
-                    cell_text_parts = []
-                    for para in cell.paragraphs:
-                        if para.text.strip():
-                            cell_text_parts.append(para.text.strip())
-                    # Если параграфы пустые, пробуем извлечь напрямую
-                    if not cell_text_parts:
-                        cell_text = cell.text.strip()
-                        if cell_text:
-                            cell_text_parts.append(cell_text)
-                    
-                    if cell_text_parts:
-                        row_text.append(' '.join(cell_text_parts))
-                    else:
-                        row_text.append("")
-                
-                if any(row_text):  # Добавляем строку, если есть хотя бы одна непустая ячейка
-                    text_content.append(" | ".join(row_text))
-            text_content.append("\n")
-        
-        # Извлекаем текст из заголовков и подвалов (headers/footers)
-        try:
-            for section in doc.sections:
-                # Заголовок
-                if section.header:
-                    header_texts = []
-                    for para in section.header.paragraphs:
-                        if para.text.strip():
-                            header_texts.append(para.text.strip())
-                    if header_texts:
-                        text_content.append(f"\n--- Заголовок ---\n")
-                        text_content.extend(header_texts)
-                        text_content.append("\n")
-                
-                # Подвал
-                if section.footer:
-                    footer_texts = []
-                    for para in section.footer.paragraphs:
-                        if para.text.strip():
-                            footer_texts.append(para.text.strip())
-                    if footer_texts:
-                        text_content.append(f"\n--- Подвал ---\n")
-                        text_content.extend(footer_texts)
-                        text_content.append("\n")
-        except Exception as e:
-            # Если не удалось извлечь заголовки/подвалы, продолжаем
-            pass
-        
-        # Извлекаем текст из всех элементов документа (fallback метод)
-        # Это может помочь, если текст находится в нестандартных местах
-        try:
-            # Получаем все XML элементы документа
-            body = doc.element.body
-            for element in body:
-                if isinstance(element, CT_P):
-                    # Это параграф - уже обработали выше
-                    continue
-                elif isinstance(element, CT_Tbl):
-                    # Это таблица - уже обработали выше
-                    continue
-                else:
-                    # Пробуем извлечь текст из других элементов
-                    element_text = extract_text_from_element(element)
-                    if element_text and element_text.strip():
-                        text_content.append(element_text.strip())
-        except Exception as e:
-            # Если не удалось, продолжаем без этого метода
-            pass
-        
-        result = "\n".join(text_content)
-        
-        # Если результат пустой, пробуем альтернативный метод
-        if not result.strip():
-            # Пробуем извлечь весь текст через XML
-            try:
-                import zipfile
-                import xml.etree.ElementTree as ET
-                
-                with zipfile.ZipFile(file_path, 'r') as zip_file:
-                    # Читаем основной документ
-                    if 'word/document.xml' in zip_file.namelist():
-                        xml_content = zip_file.read('word/document.xml')
-                        root = ET.fromstring(xml_content)
-                        
-                        # Находим все текстовые элементы
-                        namespace = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
-                        text_elements = root.findall('.//w:t', namespace)
-                        
-                        if text_elements:
-                            text_parts = []
-                            for elem in text_elements:
-                                if elem.text:
-                                    text_parts.append(elem.text)
-                            result = '\n'.join(text_parts)
-            except Exception as e:
-                pass
-        
-        return result
     
     def convert_doc(self, file_path: str) -> str:
         """Конвертирует DOC (старый формат Word) в текст"""
         import subprocess
-        import tempfile
-        from pathlib import Path
         
         # Пробуем использовать antiword (если установлен)
         try:
@@ -268,33 +120,13 @@ class DocumentConverter(BaseConverter):
         except Exception as e:
             print(f"⚠️  Antiword не сработал: {e}")
         
-        # Пробуем использовать LibreOffice (если установлен)
+        # Пробуем использовать LibreOffice (если установлен): постоянно запущенные процессы пула
         try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # Конвертируем DOC в TXT через LibreOffice
-                result = subprocess.run(
-                    [
-                        'libreoffice',
-                        '--headless',
-                        '--convert-to', 'txt',
-                        '--outdir', tmpdir,
-                        file_path
-                    ],
-                    capture_output=True,
-                    timeout=60
-                )
-                
-                if result.returncode == 0:
-                    # Ищем созданный txt файл
-                    input_path = Path(file_path)
-                    txt_file = Path(tmpdir) / f"{input_path.stem}.txt"
-                    if txt_file.exists():
-                        with open(txt_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            return f.read()
-        except FileNotFoundError:
+            return get_office_pool().convert_to_text(file_path)
+        except OfficeUnavailable:
             pass
         except subprocess.TimeoutExpired:
-            pass
+            print("⚠️  LibreOffice не сконвертировал файл за отведенное время")
         except Exception as e:
             print(f"⚠️  LibreOffice не сработал: {e}")
         
@@ -325,57 +157,23 @@ class DocumentConverter(BaseConverter):
         )
     
     def convert_xlsx(self, file_path: str) -> str:
-        """Конвертирует XLSX в текст"""
+        """Конвертирует XLSX в текст (потоково, по одному проходу на лист)"""
         try:
-            import pandas as pd
+            import openpyxl
         except ImportError:
-            raise ImportError("Для работы с Excel установите: pip install pandas openpyxl")
+            raise ImportError("Для работы с Excel установите: pip install openpyxl")
         
-        text_content = []
-        excel_file = pd.ExcelFile(file_path)
-        
-        for sheet_name in excel_file.sheet_names:
-            text_content.append(f"\n{'='*60}")
-            text_content.append(f"Лист: {sheet_name}")
-            text_content.append(f"{'='*60}\n")
-            
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            
-            # Заголовки
-            if not df.empty:
-                headers = df.columns.tolist()
-                text_content.append(" | ".join(str(h) for h in headers))
-                text_content.append("-" * 60)
-                
-                # Данные
-                for idx, row in df.iterrows():
-                    row_data = []
-                    for col in headers:
-                        value = row[col]
-                        if pd.notna(value):
-                            row_data.append(str(value))
-                        else:
-                            row_data.append("")
-                    text_content.append(" | ".join(row_data))
-            
-            text_content.append("\n")
-        
-        return "\n".join(text_content)
+        return extract_xlsx_text(file_path)
     
     def convert_xls(self, file_path: str) -> str:
         """Конвертирует XLS (старый формат Excel) в текст"""
-        try:
-            import pandas as pd
-        except ImportError:
-            raise ImportError("Для работы с Excel установите: pip install pandas xlrd")
-        
         # XLS требует xlrd
         try:
             import xlrd
         except ImportError:
             raise ImportError("Для работы с XLS установите: pip install xlrd")
         
-        return self.convert_xlsx(file_path)  # pandas может работать с XLS через xlrd
+        return extract_xls_text(file_path)
     
     def convert_txt(self, file_path: str) -> str:
         """Просто читает текстовый файл"""
@@ -128,6 +128,55 @@ def register_user():
     return render_template('admin/register.html')
 
 
+@bp.route('/api/runtime_stats')
+@admin_required
+def runtime_stats():
+    """Статистика времени выполнения: очередь задач и пулы HTTP-соединений"""
+    import sys
+    from pathlib import Path
+    from app.services.job_queue import get_job_queue
+    
+    src_path = Path(__file__).parent.parent.parent / 'src'
+    sys.path.insert(0, str(src_path))
+    from http_pool import get_pool_stats
+    from response_cache import get_response_cache
+    from conversion_cache import get_conversion_cache
+    from rate_limiter import get_rate_limiter
+    from retry_policy import get_retry_engine
+    
+    return jsonify({
+        'success': True,
+        'job_queue': get_job_queue().stats(),
+        'http_pool': get_pool_stats(),
+        'llm_cache': get_response_cache().stats(),
+        'conversion_cache': get_conversion_cache().stats(),
+        'rate_limiter': get_rate_limiter().stats(),
+        'retry': get_retry_engine().stats()
+    })
+
+
+@bp.route('/api/llm_cache/clear', methods=['POST'])
+@admin_required
+def clear_llm_cache():
+    """Очистка кэша ответов ИИ"""
+    import sys
+    from pathlib import Path
+    
+    src_path = Path(__file__).parent.parent.parent / 'src'
+    sys.path.insert(0, str(src_path))
+    from response_cache import get_response_cache
+    
+    removed = get_response_cache().clear()
+    log_activity(
+        user_id=current_user.id,
+        username=current_user.username,
+        ip_address=request.remote_addr,
+        action='llm_cache_clear',
+        details=f'Удалено записей кэша: {removed}'
+    )
+    return jsonify({'success': True, 'removed': removed})
+
+
 def log_activity(user_id=None, username=None, ip_address=None, action='', details='', task_id=None):
     """Вспомогательная функция для логирования активности"""
     try:
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Пакетная загрузка: несколько файлов или ZIP архив за один запрос
+
+Сценарий проверяется и шаблоны промптов читаются один раз на пакет (ScenarioPrompts),
+документы обрабатываются одной задачей очереди параллельно - не более BATCH_CONCURRENCY
+одновременно. У каждого документа свой task_id и статус, статус пакета (task_id = batch_id)
+агрегирует их прогресс и доступен через /api/status/<batch_id> (в том числе SSE и
+long-polling). По завершении собирается общий ZIP с результатами и сводкой.
+"""
+
+from flask import Blueprint, request, jsonify, current_app, send_file
+from flask_login import current_user, login_required
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+import csv
+import io
+import json
+import sys
+import uuid
+import zipfile
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Добавляем путь к src для импорта старых модулей
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root / 'src'))
+
+from scenario_manager import ScenarioManager
+from scenario_executor import ScenarioPrompts
+from processing_status import ProcessingStatus
+from app.models.document import Document
+from app.routes.upload import allowed_file, form_flag, make_safe_filename, process_upload_job, log_activity
+from app.services.job_queue import get_job_queue
+from app.utils.exceptions import JobQueueFullError
+
+bp = Blueprint('batch', __name__)
+
+# Как часто обновляется агрегированный статус пакета, сек
+BATCH_PROGRESS_INTERVAL = 1.0
+
+# Статусы документа, после которых он больше не меняется
+FINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+class BatchUploadError(Exception):
+    """Некорректный состав пакета (ответ 400)"""
+
+
+def _zip_entry_name(info: zipfile.ZipInfo) -> str:
+    """Имя файла в архиве (архивы из Windows хранят кириллицу в cp866 без флага UTF-8)"""
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('cp866')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+def _save_zip_documents(file, batch_items: list, skipped: list, max_files: int, max_bytes: int):
+    """Распаковывает документы из ZIP в папку загрузок (вложенные папки не сохраняются)"""
+    upload_folder = Path(current_app.config['UPLOAD_FOLDER'])
+    try:
+        archive = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        raise BatchUploadError(f'Поврежденный ZIP архив: {file.filename}')
+    
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or '__MACOSX' in info.filename:
+                continue
+            original_filename = _zip_entry_name(info)
+            if not original_filename or original_filename.startswith('.'):
+                continue
+            if not allowed_file(original_filename):
+                skipped.append(original_filename)
+                continue
+            if len(batch_items) >= max_files:
+                raise BatchUploadError(f'В пакете больше {max_files} документов')
+            
+            task_id = str(uuid.uuid4())
+            safe_filename = make_safe_filename(original_filename)
+            upload_path = upload_folder / f"{task_id}_{safe_filename}"
+            # Размер из заголовка архива может не совпадать с фактическим - считаем прочитанное
+            written = sum(item.get('size', 0) for item in batch_items)
+            with archive.open(info) as src, open(upload_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > max_bytes:
+                        dst.close()
+                        upload_path.unlink(missing_ok=True)
+                        raise BatchUploadError(
+                            f'Распакованные файлы больше {max_bytes // (1024 * 1024)} МБ'
+                        )
+                    dst.write(chunk)
+            
+            batch_items.append({
+                'task_id': task_id,
+                'upload_path': str(upload_path),
+                'safe_filename': safe_filename,
+                'original_filename': original_filename,
+                'size': upload_path.stat().st_size
+            })
+
+
+def _save_batch_files(files) -> tuple:
+    """
+    Сохраняет файлы пакета (ZIP архивы распаковываются)
+    
+    Returns:
+        (документы пакета, пропущенные файлы неподдерживаемых форматов)
+    """
+    max_files = current_app.config['BATCH_MAX_FILES']
+    max_bytes = current_app.config['BATCH_MAX_UNCOMPRESSED_MB'] * 1024 * 1024
+    upload_folder = Path(current_app.config['UPLOAD_FOLDER'])
+    batch_items, skipped = [], []
+    
+    try:
+        for file in files:
+            if not file or not file.filename:
+                continue
+            if file.filename.lower().endswith('.zip'):
+                _save_zip_documents(file, batch_items, skipped, max_files, max_bytes)
+                continue
+            if not allowed_file(file.filename):
+                skipped.append(file.filename)
+                continue
+            if len(batch_items) >= max_files:
+                raise BatchUploadError(f'В пакете больше {max_files} документов')
+            
+            task_id = str(uuid.uuid4())
+            safe_filename = make_safe_filename(file.filename)
+            upload_path = upload_folder / f"{task_id}_{safe_filename}"
+            file.save(str(upload_path))
+            batch_items.append({
+                'task_id': task_id,
+                'upload_path': str(upload_path),
+                'safe_filename': safe_filename,
+                'original_filename': file.filename,
+                'size': upload_path.stat().st_size
+            })
+    except Exception:
+        # Пакет не принят - удаляем уже сохраненные файлы
+        for item in batch_items:
+            Path(item['upload_path']).unlink(missing_ok=True)
+        raise
+    
+    return batch_items, skipped
+
+
+def _manifest_path(batch_id: str) -> Path:
+    return Path(current_app.config['RESULTS_FOLDER']) / f"{batch_id}_batch.json"
+
+
+def _write_manifest(batch_id: str, manifest: dict):
+    """Сводка пакета на диске: владелец и итог доступны и после очистки статусов"""
+    path = _manifest_path(batch_id)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(path)
+
+
+def _read_manifest(batch_id: str):
+    path = _manifest_path(batch_id)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _new_batch_id(requested: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    ID нового пакета: сгенерированный сервером или переданный клиентом UUID
+    
+    Переданный ID попадает в пути файлов и ключи статусов, поэтому принимается
+    только корректный UUID, еще не занятый другим пакетом или задачей.
+    
+    Returns:
+        (batch_id, None) или (None, текст ошибки)
+    """
+    if not requested:
+        return str(uuid.uuid4()), None
+    try:
+        batch_id = str(uuid.UUID(requested))
+    except (ValueError, AttributeError, TypeError):
+        return None, 'Некорректный batch_id: ожидается UUID'
+    if ProcessingStatus().get_status(batch_id) is not None or _manifest_path(batch_id).exists():
+        return None, 'batch_id уже используется'
+    return batch_id, None
+
+
+@bp.route('/upload/batch', methods=['POST'])
+@login_required
+def upload_batch():
+    """Загрузка пакета документов (поле files, допускаются ZIP архивы) и постановка в очередь"""
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not any(file.filename for file in files):
+        return jsonify({'error': 'Файлы не выбраны'}), 400
+    
+    current_app.logger.info(f"📥 Получен пакет из {len(files)} файлов от пользователя {current_user.username}")
+    
+    scenario_id = request.form.get('scenario_id', 'tokarny_default')
+    scenario = ScenarioManager().get_scenario(scenario_id)
+    if not scenario:
+        return jsonify({'error': f'Сценарий не найден: {scenario_id}'}), 400
+    ai_provider = request.form.get('ai_provider', 'openai').lower()
+    use_cache = form_flag('use_cache')
+    batch_id, error = _new_batch_id(request.form.get('batch_id'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        batch_items, skipped = _save_batch_files(files)
+    except BatchUploadError as e:
+        current_app.logger.warning(f"❌ Пакет отклонен: {e}")
+        return jsonify({'error': str(e)}), 400
+    
+    if not batch_items:
+        return jsonify({
+            'error': f'В пакете нет документов поддерживаемых форматов: {", ".join(sorted(current_app.config["ALLOWED_EXTENSIONS"]))}',
+            'skipped': skipped
+        }), 400
+    
+    items = [
+        {'task_id': item['task_id'], 'filename': item['original_filename'], 'status': 'pending', 'progress': 0}
+        for item in batch_items
+    ]
+    status_manager = ProcessingStatus()
+    for item in batch_items:
+        status_manager.create_status(item['task_id'])
+        status_manager.update_status(
+            item['task_id'],
+            user_id=current_user.id,
+            batch_id=batch_id,
+            stage='queued',
+            message='Документ в очереди пакета...'
+        )
+    status_manager.create_status(batch_id)
+    status_manager.update_status(
+        batch_id,
+        user_id=current_user.id,
+        batch=True,
+        items=items,
+        total_steps=len(items),
+        stage='queued',
+        message=f'Пакет из {len(items)} документов в очереди...'
+    )
+    _write_manifest(batch_id, {
+        'batch_id': batch_id,
+        'user_id': current_user.id,
+        'scenario_id': scenario_id,
+        'ai_provider': ai_provider,
+        'created_at': datetime.utcnow().isoformat(),
+        'items': items,
+        'skipped': skipped,
+        'bundle_file': None
+    })
+    
+    try:
+        position = get_job_queue().submit(
+            batch_id,
+            process_batch_job,
+            batch_id=batch_id,
+            batch_items=batch_items,
+            scenario_id=scenario_id,
+            scenario=scenario,
+            ai_provider=ai_provider,
+            user_id=current_user.id,
+            username=current_user.username,
+            ip_address=request.remote_addr,
+            use_cache=use_cache
+        )
+    except JobQueueFullError as e:
+        for task_id in [batch_id] + [item['task_id'] for item in batch_items]:
+            status_manager.update_status(task_id, status='error', message=str(e))
+        current_app.logger.warning(f"⚠️ {e}")
+        return jsonify({'error': str(e), 'stage': 'queue', 'batch_id': batch_id}), 503
+    
+    log_activity(
+        user_id=current_user.id,
+        username=current_user.username,
+        ip_address=request.remote_addr,
+        action='batch_upload_start',
+        details=f'Пакет из {len(items)} документов (пропущено: {len(skipped)})',
+        task_id=batch_id
+    )
+    
+    return jsonify({
+        'success': True,
+        'queued': True,
+        'message': f'Пакет из {len(items)} документов поставлен в очередь',
+        'batch_id': batch_id,
+        'task_id': batch_id,
+        'items': items,
+        'skipped': skipped,
+        'queue_position': position
+    }), 202
+
+
+def _aggregate_items(status_manager: ProcessingStatus, items: list) -> tuple:
+    """
+    Собирает статусы документов пакета
+    
+    Returns:
+        (обновленный список items, общий прогресс 0-100, число завершенных документов)
+    """
+    updated, total_progress, finished = [], 0, 0
+    for item in items:
+        item = dict(item)
+        status = status_manager.get_status(item['task_id'])
+        # Статус документа мог быть удален очисткой - остается последнее известное состояние
+        if status:
+            item['status'] = status.get('status', item['status'])
+            item['progress'] = 100 if item['status'] in FINAL_STATUSES else status.get('progress', 0)
+            item['stage'] = status.get('stage')
+        if item['status'] in FINAL_STATUSES:
+            finished += 1
+        total_progress += item['progress']
+        updated.append(item)
+    progress = int(total_progress / len(items)) if items else 100
+    return updated, progress, finished
+
+
+def _cancel_items(status_manager: ProcessingStatus, items: list, futures):
+    """Отменяет документы пакета: еще не начатые не запускаются, выполняющиеся прерываются"""
+    for future in futures:
+        future.cancel()
+    for item in items:
+        status = status_manager.get_status(item['task_id'])
+        if status and status.get('status') not in FINAL_STATUSES:
+            status_manager.cancel_task(item['task_id'])
+
+
+def _build_bundle(batch_id: str, items: list, user_id: int):
+    """
+    Собирает ZIP с результатами документов пакета и сводкой summary.csv
+    
+    Returns:
+        Имя файла архива в RESULTS_FOLDER или None, если результатов нет
+    """
+    results_folder = Path(current_app.config['RESULTS_FOLDER'])
+    documents = {
+        doc.task_id: doc
+        for doc in Document.query.filter(
+            Document.task_id.in_([item['task_id'] for item in items]),
+            Document.user_id == user_id
+        ).all()
+    }
+    
+    summary = io.StringIO()
+    writer = csv.writer(summary)
+    writer.writerow(['№', 'Файл', 'Статус', 'Результат Excel', 'Результат JSON', 'Ошибки'])
+    bundle_name = f"{batch_id}_batch_results.zip"
+    added = 0
+    with zipfile.ZipFile(results_folder / bundle_name, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for index, item in enumerate(items, start=1):
+            doc = documents.get(item['task_id'])
+            stem = f"{index:02d}_{Path(item['filename']).stem}"
+            names = {}
+            for kind, filename in (('excel', doc.excel_file if doc else None), ('json', doc.json_file if doc else None)):
+                if filename and (results_folder / filename).exists():
+                    names[kind] = f"{stem}{Path(filename).suffix}"
+                    bundle.write(results_folder / filename, names[kind])
+                    added += 1
+            writer.writerow([
+                index,
+                item['filename'],
+                doc.status if doc else item['status'],
+                names.get('excel', ''),
+                names.get('json', ''),
+                (doc.error_message or '') if doc else ''
+            ])
+        # BOM - чтобы Excel открыл кириллицу в CSV без мастера импорта
+        bundle.writestr('summary.csv', '\ufeff' + summary.getvalue())
+    
+    if not added:
+        (results_folder / bundle_name).unlink(missing_ok=True)
+        return None
+    return bundle_name
+
+
+def process_batch_job(batch_id: str, batch_items: list, scenario_id: str, scenario: dict, ai_provider: str,
+                      user_id: int, username: str, ip_address: str, use_cache: bool = True):
+    """
+    Фоновая обработка пакета: документы параллельно, агрегированный статус, общий архив
+    
+    Выполняется в воркере очереди внутри app_context; документы - в пуле из
+    BATCH_CONCURRENCY потоков, каждый в своем app_context.
+    """
+    app = current_app._get_current_object()
+    status_manager = ProcessingStatus()
+    items = [
+        {'task_id': item['task_id'], 'filename': item['original_filename'], 'status': 'pending', 'progress': 0}
+        for item in batch_items
+    ]
+    
+    if status_manager.is_cancelled(batch_id):
+        current_app.logger.info(f"[{batch_id}] ⛔ Пакет отменен до начала обработки")
+        _cancel_items(status_manager, items, [])
+        return
+    
+    concurrency = max(1, current_app.config['BATCH_CONCURRENCY'])
+    current_app.logger.info(f"[{batch_id}] 🚀 Обработка пакета: {len(batch_items)} документов, параллельно: {concurrency}")
+    status_manager.update_status(
+        batch_id,
+        status='processing',
+        stage='batch',
+        message=f'Обработка пакета: 0 из {len(items)} документов...'
+    )
+    
+    # Шаблоны промптов читаются один раз на весь пакет
+    prompts = ScenarioPrompts(scenario)
+    
+    def run_item(item: dict):
+        with app.app_context():
+            process_upload_job(
+                task_id=item['task_id'],
+                upload_path=item['upload_path'],
+                safe_filename=item['safe_filename'],
+                original_filename=item['original_filename'],
+                scenario_id=scenario_id,
+                scenario=scenario,
+                ai_provider=ai_provider,
+                user_id=user_id,
+                username=username,
+                ip_address=ip_address,
+                prompts=prompts,
+                use_cache=use_cache
+            )
+    
+    cancelled = False
+    last_snapshot = None
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'batch-{batch_id[:8]}') as pool:
+        pending = {pool.submit(run_item, item) for item in batch_items}
+        while True:
+            done, pending = wait(pending, timeout=BATCH_PROGRESS_INTERVAL)
+            for future in done:
+                if not future.cancelled() and future.exception():
+                    current_app.logger.error(f"[{batch_id}] ❌ Ошибка обработки документа пакета: {future.exception()}")
+            
+            if not cancelled and status_manager.is_cancelled(batch_id):
+                cancelled = True
+                current_app.logger.info(f"[{batch_id}] ⛔ Пакет отменен - останавливаем документы")
+                _cancel_items(status_manager, items, pending)
+            
+            items, progress, finished = _aggregate_items(status_manager, items)
+            snapshot = (progress, finished, [item['status'] for item in items])
+            if snapshot != last_snapshot:
+                last_snapshot = snapshot
+                fields = {
+                    'items': items,
+                    'progress': progress,
+                    'current_step': finished
+                }
+                if not cancelled:
+                    fields['message'] = f'Обработка пакета: {finished} из {len(items)} документов...'
+                status_manager.update_status(batch_id, **fields)
+            
+            if not pending:
+                break
+    
+    counts = {}
+    for item in items:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    completed = counts.get('completed', 0)
+    
+    bundle_file = None
+    try:
+        bundle_file = _build_bundle(batch_id, items, user_id)
+    except Exception as e:
+        current_app.logger.error(f"[{batch_id}] ❌ Ошибка сборки архива результатов: {e}", exc_info=True)
+    
+    manifest = _read_manifest(batch_id)
+    manifest.update({'items': items, 'counts': counts, 'bundle_file': bundle_file})
+    _write_manifest(batch_id, manifest)
+    
+    message = (
+        f'Пакет обработан: успешно {completed} из {len(items)}'
+        + (f', ошибок: {counts["error"]}' if counts.get('error') else '')
+        + (f', отменено: {counts["cancelled"]}' if counts.get('cancelled') else '')
+    )
+    fields = {
+        'items': items,
+        'counts': counts,
+        'current_step': len(items),
+        'progress': 100,
+        'bundle_file': bundle_file,
+        'bundle_url': f'/api/batch/{batch_id}/download' if bundle_file else None
+    }
+    if not cancelled:
+        # Пакет считается успешным, если обработан хотя бы один документ
+        fields.update(status='completed' if completed else 'error', message=message)
+    status_manager.update_status(batch_id, **fields)
+    current_app.logger.info(f"[{batch_id}] ✅ {message}")
+    
+    log_activity(
+        user_id=user_id,
+        username=username,
+        ip_address=ip_address,
+        action='batch_upload_cancelled' if cancelled else 'batch_upload_completed',
+        details=message,
+        task_id=batch_id
+    )
+
+
+@bp.route('/api/batch/<batch_id>', methods=['GET'])
+@login_required
+def api_batch_status(batch_id):
+    """API: Статус пакета с состоянием каждого документа"""
+    status = ProcessingStatus().get_status(batch_id)
+    if not status or not status.get('batch'):
+        # Статус уже очищен - отдаем итог из сводки пакета
+        status = _read_manifest(batch_id)
+        if not status:
+            return jsonify({'error': 'Пакет не найден'}), 404
+    if status.get('user_id') != current_user.id:
+        return jsonify({'error': 'У вас нет прав на просмотр этого пакета'}), 403
+    return jsonify(status)
+
+
+@bp.route('/api/batch/<batch_id>/download', methods=['GET'])
+@login_required
+def api_batch_download(batch_id):
+    """API: Скачивание архива результатов пакета (только для владельца)"""
+    manifest = _read_manifest(batch_id)
+    if not manifest:
+        return jsonify({'error': 'Пакет не найден'}), 404
+    if manifest.get('user_id') != current_user.id:
+        current_app.logger.warning(f"⚠️ Попытка скачать чужой пакет {batch_id} пользователем {current_user.username}")
+        return jsonify({'error': 'У вас нет прав на скачивание этого пакета'}), 403
+    
+    bundle_file = manifest.get('bundle_file')
+    bundle_path = Path(current_app.config['RESULTS_FOLDER']) / bundle_file if bundle_file else None
+    if not bundle_path or not bundle_path.exists():
+        return jsonify({'error': 'Архив результатов еще не готов'}), 404
+    
+    return send_file(
+        str(bundle_path),
+        as_attachment=True,
+        download_name=f"batch_{batch_id[:8]}_results.zip",
+        mimetype='application/zip'
+    )
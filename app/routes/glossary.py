@@ -7,9 +7,16 @@ from flask import Blueprint, request, jsonify, render_template
 from flask_login import login_required, current_user
 from pathlib import Path
 import json
+import sys
 from app.config import Config
 from app.models.db import db
 
+# Добавляем путь к src для импорта старых модулей
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root / 'src'))
+
+from glossary_artifact import artifact_path, save_glossary_artifact
+
 
 def normalize_glossary(obj):
     """Нормализует глоссарий: пустые массивы и пустые строки -> null"""
@@ -204,6 +211,26 @@ def save_glossary():
                     'error': f'Ошибка сохранения файла: {str(e)}'
                 }), 500
         
+        # Компилируем артефакт глоссария: обработчики подхватят новую версию без перезапуска
+        glossary_version = None
+        try:
+            glossary_version = save_glossary_artifact(glossary_file).version
+        except Exception as e:
+            # Без артефакта обработчики скомпилируют глоссарий из glossary.json сами
+            print(f"⚠️  Ошибка компиляции глоссария: {e}")
+        else:
+            # Права на артефакт - как на glossary.json (его перезаписывают и другие процессы)
+            compiled_file = artifact_path(glossary_file)
+            try:
+                os.chown(compiled_file, aimanager_uid, aimanager_gid)
+                os.chmod(compiled_file, 0o664)
+            except (OSError, NameError):
+                try:
+                    subprocess.run(['chown', 'aimanager:aimanager', str(compiled_file)], check=False, timeout=5)
+                    subprocess.run(['chmod', '664', str(compiled_file)], check=False, timeout=5)
+                except (subprocess.SubprocessError, FileNotFoundError):
+                    pass
+        
         # Логируем действие
         try:
             from app.routes.upload import log_activity
@@ -220,7 +247,8 @@ def save_glossary():
         
         return jsonify({
             'success': True,
-            'message': 'Глоссарий успешно сохранен'
+            'message': 'Глоссарий успешно сохранен',
+            'version': glossary_version
         })
     except json.JSONDecodeError as e:
         return jsonify({'error': f'Неверный формат JSON: {str(e)}'}), 400
@@ -3,11 +3,14 @@
 Маршруты для загрузки и обработки файлов
 """
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
 from pathlib import Path
 import sys
+import json
+import threading
+import time
 import uuid
 import re
 from datetime import datetime
@@ -20,9 +23,12 @@ from document_converter import DocumentConverter
 from scenario_manager import ScenarioManager
 from scenario_executor import ScenarioExecutor
 from processing_status import ProcessingStatus
+from async_runner import run_coroutine
 from app.models.db import db
 from app.models.document import Document
 from app.models.activity_log import ActivityLog
+from app.services.job_queue import get_job_queue
+from app.utils.exceptions import JobQueueFullError
 
 bp = Blueprint('upload', __name__)
 
@@ -33,10 +39,18 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def form_flag(name: str, default: bool = True) -> bool:
+    """Логический флаг из формы запроса ('false', '0', 'no', 'off' - выключен)"""
+    value = request.form.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('false', '0', 'no', 'off', '')
+
+
 @bp.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    """Обработка загрузки, конвертации и заполнения ТЗ через ИИ"""
+    """Загрузка файла и постановка задачи обработки в очередь"""
     # Логируем начало обработки
     log_activity(
         user_id=current_user.id,
@@ -66,6 +80,8 @@ def upload_file():
             'error': f'Неподдерживаемый формат. Разрешены: {", ".join(ALLOWED_EXTENSIONS)}'
         }), 400
     
+    task_id = None
+    status_manager = None
     try:
         # Получаем task_id из запроса (генерируется на клиенте) или создаем новый
         task_id = request.form.get('task_id')
@@ -76,261 +92,336 @@ def upload_file():
             current_app.logger.info(f"📋 Создан новый Task ID: {task_id}")
         
         status_manager = ProcessingStatus()
-        status = status_manager.create_status(task_id)
+        status_manager.create_status(task_id)
         # Сохраняем user_id в статусе для проверки прав доступа
         status_manager.update_status(task_id, user_id=current_user.id)
         current_app.logger.info(f"✅ Статус создан для task_id: {task_id} (пользователь: {current_user.username})")
         
+        # Проверяем сценарий до постановки в очередь, чтобы сразу вернуть ошибку
+        scenario_id = request.form.get('scenario_id', 'tokarny_default')
+        scenario = ScenarioManager().get_scenario(scenario_id)
+        if not scenario:
+            status_manager.update_status(task_id, status='error', message=f'Сценарий не найден: {scenario_id}')
+            return jsonify({
+                'error': f'Сценарий не найден: {scenario_id}',
+                'task_id': task_id
+            }), 400
+        
+        ai_provider = request.form.get('ai_provider', 'openai').lower()
+        # use_cache=false - не брать ответы ИИ из кэша (повторная обработка того же документа)
+        use_cache = form_flag('use_cache')
+        
         # Шаг 1: Сохраняем загруженный файл
         # Используем task_id для уникальности имен файлов при параллельной обработке
         current_app.logger.info("📁 Шаг 1: Сохранение файла...")
         status_manager.update_status(task_id, stage='file_upload', message='Сохранение файла...')
-        # Применяем secure_filename для безопасного имени, но сохраняем оригинальное для отображения
-        safe_filename = secure_filename(original_filename)
-        # Если secure_filename удалил все (кириллица), используем оригинальное имя с заменой небезопасных символов
-        if not safe_filename or safe_filename == original_filename.rsplit('.', 1)[-1]:
-            # Создаем безопасное имя вручную: заменяем пробелы и небезопасные символы
-            name_part = original_filename.rsplit('.', 1)[0] if '.' in original_filename else original_filename
-            ext_part = original_filename.rsplit('.', 1)[-1] if '.' in original_filename else ''
-            # Заменяем небезопасные символы на подчеркивания, но сохраняем кириллицу
-            safe_name = re.sub(r'[^\w\s\-_\.]', '_', name_part)
-            safe_name = re.sub(r'\s+', '_', safe_name)
-            safe_filename = f"{safe_name}.{ext_part}" if ext_part else safe_name
-        # Добавляем task_id для уникальности при параллельной обработке
+        safe_filename = make_safe_filename(original_filename)
         filename = f"{task_id}_{safe_filename}"
         upload_path = Path(current_app.config['UPLOAD_FOLDER']) / filename
         file.save(str(upload_path))
         current_app.logger.info(f"✅ Файл сохранен: {upload_path}")
         
-        try:
-        
-            # Шаг 2: Конвертируем документ в текст
-            current_app.logger.info("🔄 Шаг 2: Конвертация документа...")
-            status_manager.update_status(task_id, stage='conversion', message='Конвертация документа в текст...')
-            converter = DocumentConverter()
-            # Используем task_id для уникальности имен конвертированных файлов
-            # Используем safe_filename для имени конвертированного файла
-            converted_filename = f"{task_id}_{Path(safe_filename).stem}_converted.txt"
-            converted_path = converter.convert(
-                str(upload_path),
-                str(Path(current_app.config['OUTPUT_FOLDER']) / converted_filename)
-            )
-            current_app.logger.info(f"✅ Документ сконвертирован: {converted_path}")
-            
-            # Читаем сконвертированный текст
-            with open(converted_path, 'r', encoding='utf-8') as f:
-                converted_text = f.read()
-            
-            status_manager.update_status(
-                task_id,
-                message=f'Документ сконвертирован ({len(converted_text):,} символов)',
-                metrics={'converted_text_size': len(converted_text)}
-            )
-            
-            # Шаг 3: Получаем сценарий
-            scenario_id = request.form.get('scenario_id', 'tokarny_default')
-            scenario_manager = ScenarioManager()
-            scenario = scenario_manager.get_scenario(scenario_id)
-            
-            if not scenario:
-                status_manager.update_status(task_id, status='error', message=f'Сценарий не найден: {scenario_id}')
-                return jsonify({
-                    'error': f'Сценарий не найден: {scenario_id}',
-                    'task_id': task_id
-                }), 400
-            
-            # Шаг 4: Выполняем сценарий
-            # Получаем выбор AI из запроса
-            ai_provider = request.form.get('ai_provider', 'openai').lower()
-            
-            # Засекаем время начала обработки
-            processing_start_time = datetime.utcnow()
-            
-            current_app.logger.info(f"[{task_id}] 🚀 Начало выполнения сценария '{scenario_id}' (AI: {ai_provider})")
-            results_folder = str(Path(current_app.config['RESULTS_FOLDER']))
-            executor = ScenarioExecutor(
-                scenario, 
-                status_manager=status_manager, 
-                task_id=task_id,
-                results_folder=results_folder
-            )
-            # Используем task_id в output_prefix для уникальности при параллельной обработке
-            output_prefix = f"{task_id}_{Path(safe_filename).stem}"
-            result = executor.execute(
-                converted_text,
-                ai_provider=ai_provider,
-                output_prefix=output_prefix
-            )
-            
-            # Вычисляем время обработки
-            processing_end_time = datetime.utcnow()
-            processing_time = (processing_end_time - processing_start_time).total_seconds()
-            
-            current_app.logger.info(f"[{task_id}] ✅ Сценарий выполнен (success: {result['success']}, ошибок: {len(result['errors'])})")
-            
-            # Получаем финальный статус с метриками
-            final_status = status_manager.get_status(task_id)
-            metrics = final_status.get('metrics', {}) if final_status else {}
-            
-            # Основной результат (JSON + Excel)
-            main_result = result['results'].get('main', {}) if result['success'] else {}
-            json_file = main_result.get('json_file')
-            excel_file = main_result.get('excel_file')
-            
-            # Сохраняем документ в базу данных
-            doc = Document(
-                user_id=current_user.id,
-                task_id=task_id,
-                original_filename=original_filename,
-                scenario_id=scenario_id,
-                ai_provider=ai_provider,
-                json_file=json_file,
-                excel_file=excel_file,
-                json_size=main_result.get('json_size', 0),
-                excel_size=main_result.get('excel_size', 0),
-                prompt_size=metrics.get('prompt_size', 0),
-                tokens_used=metrics.get('tokens_used', 0),
-                processing_time=processing_time,
-                status='completed' if result['success'] else 'error',
-                error_message='; '.join(result['errors']) if result['errors'] else None,
-                completed_at=processing_end_time if result['success'] else None
-            )
-            
-            try:
-                db.session.add(doc)
-                db.session.commit()
-                current_app.logger.info(f"[{task_id}] ✅ Документ сохранен в БД (ID: {doc.id})")
-            except Exception as e:
-                db.session.rollback()
-                current_app.logger.error(f"[{task_id}] ❌ Ошибка сохранения в БД: {e}")
-            
-            if not result['success']:
-                status_manager.update_status(
-                    task_id,
-                    status='error',
-                    message=f'Ошибки: {"; ".join(result["errors"])}'
-                )
-                
-                # Логируем ошибку
-                log_activity(
-                    user_id=current_user.id,
-                    username=current_user.username,
-                    ip_address=request.remote_addr,
-                    action='upload_error',
-                    details=f'Ошибка обработки: {"; ".join(result["errors"])}',
-                    task_id=task_id
-                )
-                
-                return jsonify({
-                    'error': f'Ошибка выполнения сценария: {"; ".join(result["errors"])}',
-                    'stage': 'ai_processing',
-                    'task_id': task_id
-                }), 500
-            
-            # Формируем ответ с результатами
-            response_data = {
-                'success': True,
-                'message': 'ТЗ успешно обработано',
-                'task_id': task_id,
-                'document_id': doc.id,
-                'metrics': metrics,
-                'results': {}
-            }
-            
-            # Основной результат (JSON + Excel)
-            sheets_added = []
-            if 'main' in result['results']:
-                response_data['results']['main'] = {
-                    'json_file': main_result['json_file'],
-                    'json_size': main_result['json_size'],
-                    'json_url': f'/download_result/{main_result["json_file"]}',
-                    'excel_file': main_result.get('excel_file'),
-                    'excel_size': main_result.get('excel_size', 0),
-                    'excel_url': f'/download_result/{main_result["excel_file"]}' if main_result.get('excel_file') else None,
-                    'sheets': [],  # Список добавленных листов
-                    'usage': main_result.get('usage', {})
-                }
-            
-            # Дополнительные результаты (CSV → Excel листы)
-            sheet_names_map = {
-                'instrument_tooling': 'Инструмент+Оснастка',
-                'services': 'Услуги',
-                'spare_parts': 'ЗИП'
-            }
-            
-            for result_type in ['instrument_tooling', 'services', 'spare_parts']:
-                if result_type in result['results']:
-                    sheet_result = result['results'][result_type]
-                    if sheet_result.get('sheet_added'):
-                        sheets_added.append(sheet_result['sheet_name'])
-                        # Добавляем информацию о листе в основной результат
-                        if 'main' in response_data['results']:
-                            response_data['results']['main']['sheets'].append(sheet_result['sheet_name'])
-            
-            # Обновляем статус на "completed" перед возвратом ответа
-            status_manager.update_status(
-                task_id,
-                status='completed',
-                progress=100,
-                message='Обработка завершена успешно'
-            )
-            
-            # Очищаем старые статусы (старше 10 минут)
-            status_manager.cleanup_old_statuses(max_age_minutes=10)
-            
-            # Логируем успешное завершение
-            log_activity(
-                user_id=current_user.id,
-                username=current_user.username,
-                ip_address=request.remote_addr,
-                action='upload_completed',
-                details=f'Обработка завершена успешно: {original_filename}',
-                task_id=task_id
-            )
-            
-            return jsonify(response_data)
+        # Шаг 2: Ставим конвертацию и сценарий в очередь фоновой обработки
+        position = get_job_queue().submit(
+            task_id,
+            process_upload_job,
+            task_id=task_id,
+            upload_path=str(upload_path),
+            safe_filename=safe_filename,
+            original_filename=original_filename,
+            scenario_id=scenario_id,
+            scenario=scenario,
+            ai_provider=ai_provider,
+            user_id=current_user.id,
+            username=current_user.username,
+            ip_address=request.remote_addr,
+            use_cache=use_cache
+        )
+        status_manager.update_status(
+            task_id,
+            stage='queued',
+            message=f'Задача в очереди на обработку (позиция: {position})...'
+        )
         
-        except ValueError as e:
-            if 'task_id' in locals():
-                status_manager.update_status(task_id, status='error', message=str(e))
-            return jsonify({
-                'error': str(e),
-                'stage': 'ai_setup',
-                'task_id': task_id if 'task_id' in locals() else None
-            }), 500
-        except ImportError as e:
-            if 'task_id' in locals():
-                status_manager.update_status(task_id, status='error', message=str(e))
-            return jsonify({
-                'error': str(e),
-                'stage': 'ai_setup',
-                'task_id': task_id if 'task_id' in locals() else None
-            }), 500
-        except Exception as e:
-            if 'task_id' in locals():
-                status_manager.update_status(task_id, status='error', message=str(e))
-            return jsonify({
-                'error': f'Ошибка обработки ИИ: {str(e)}',
-                'stage': 'ai_processing',
-                'task_id': task_id if 'task_id' in locals() else None
-        }), 500
+        return jsonify({
+            'success': True,
+            'queued': True,
+            'message': 'Файл загружен, задача поставлена в очередь',
+            'task_id': task_id,
+            'queue_position': position
+        }), 202
     
+    except JobQueueFullError as e:
+        if task_id and status_manager:
+            status_manager.update_status(task_id, status='error', message=str(e))
+        current_app.logger.warning(f"⚠️ {e}")
+        return jsonify({
+            'error': str(e),
+            'stage': 'queue',
+            'task_id': task_id
+        }), 503
     except Exception as e:
-        # Пытаемся получить task_id если он был создан
-        task_id = None
-        if 'task_id' in locals():
-            task_id = locals()['task_id']
-            if task_id and 'status_manager' in locals():
-                status_manager.update_status(task_id, status='error', message=str(e))
+        if task_id and status_manager:
+            status_manager.update_status(task_id, status='error', message=str(e))
         
         current_app.logger.error(f"Ошибка обработки: {e}", exc_info=True)
         return jsonify({
             'error': f'Ошибка обработки: {str(e)}',
-            'stage': 'conversion',
+            'stage': 'file_upload',
             'task_id': task_id
         }), 500
 
 
+def make_safe_filename(original_filename: str) -> str:
+    """Безопасное имя файла с сохранением кириллицы"""
+    # Применяем secure_filename для безопасного имени, но сохраняем оригинальное для отображения
+    safe_filename = secure_filename(original_filename)
+    # Если secure_filename удалил все (кириллица), используем оригинальное имя с заменой небезопасных символов
+    if not safe_filename or safe_filename == original_filename.rsplit('.', 1)[-1]:
+        # Создаем безопасное имя вручную: заменяем пробелы и небезопасные символы
+        name_part = original_filename.rsplit('.', 1)[0] if '.' in original_filename else original_filename
+        ext_part = original_filename.rsplit('.', 1)[-1] if '.' in original_filename else ''
+        # Заменяем небезопасные символы на подчеркивания, но сохраняем кириллицу
+        safe_name = re.sub(r'[^\w\s\-_\.]', '_', name_part)
+        safe_name = re.sub(r'\s+', '_', safe_name)
+        safe_filename = f"{safe_name}.{ext_part}" if ext_part else safe_name
+    return safe_filename
+
+
+def process_upload_job(task_id: str, upload_path: str, safe_filename: str, original_filename: str,
+                       scenario_id: str, scenario: dict, ai_provider: str,
+                       user_id: int, username: str, ip_address: str, prompts=None, use_cache: bool = True):
+    """
+    Фоновая обработка загруженного файла: конвертация, сценарий, запись в БД
+    
+    Выполняется в воркере очереди внутри app_context.
+    prompts - загруженные шаблоны промптов сценария (ScenarioPrompts, общие для пакета)
+    use_cache - брать ответы ИИ из кэша (False - все промпты отправляются заново)
+    """
+    status_manager = ProcessingStatus()
+    
+    if status_manager.is_cancelled(task_id):
+        current_app.logger.info(f"[{task_id}] ⛔ Задача отменена до начала обработки")
+        return
+    
+    try:
+        # Конвертируем документ в текст
+        current_app.logger.info(f"[{task_id}] 🔄 Конвертация документа...")
+        status_manager.update_status(task_id, stage='conversion', message='Конвертация документа в текст...')
+        converter = DocumentConverter()
+        # Используем task_id для уникальности имен конвертированных файлов
+        converted_filename = f"{task_id}_{Path(safe_filename).stem}_converted.txt"
+        converted_path = converter.convert(
+            upload_path,
+            str(Path(current_app.config['OUTPUT_FOLDER']) / converted_filename)
+        )
+        current_app.logger.info(f"[{task_id}] ✅ Документ сконвертирован: {converted_path}")
+        
+        with open(converted_path, 'r', encoding='utf-8') as f:
+            converted_text = f.read()
+        
+        status_manager.update_status(
+            task_id,
+            message=f'Документ сконвертирован ({len(converted_text):,} символов)',
+            metrics={'converted_text_size': len(converted_text)}
+        )
+    except Exception as e:
+        current_app.logger.error(f"[{task_id}] ❌ Ошибка конвертации: {e}", exc_info=True)
+        status_manager.update_status(task_id, status='error', stage='conversion', message=f'Ошибка конвертации: {e}')
+        log_activity(
+            user_id=user_id,
+            username=username,
+            ip_address=ip_address,
+            action='upload_error',
+            details=f'Ошибка конвертации: {e}',
+            task_id=task_id
+        )
+        return
+    
+    # Засекаем время начала обработки
+    processing_start_time = datetime.utcnow()
+    
+    try:
+        current_app.logger.info(f"[{task_id}] 🚀 Начало выполнения сценария '{scenario_id}' (AI: {ai_provider})")
+        executor = ScenarioExecutor(
+            scenario,
+            status_manager=status_manager,
+            task_id=task_id,
+            results_folder=str(Path(current_app.config['RESULTS_FOLDER'])),
+            # Финальный статус выставляем сами - после записи документа в БД
+            finalize_status=False,
+            prompts=prompts
+        )
+        # Используем task_id в output_prefix для уникальности при параллельной обработке
+        output_prefix = f"{task_id}_{Path(safe_filename).stem}"
+        if current_app.config.get('AI_ASYNC_EXECUTION'):
+            # Промпты выполняются корутинами в общем event loop процесса
+            result = run_coroutine(executor.execute_async(
+                converted_text,
+                ai_provider=ai_provider,
+                output_prefix=output_prefix,
+                use_cache=use_cache
+            ))
+        else:
+            result = executor.execute(
+                converted_text,
+                ai_provider=ai_provider,
+                output_prefix=output_prefix,
+                use_cache=use_cache
+            )
+    except Exception as e:
+        current_app.logger.error(f"[{task_id}] ❌ Ошибка выполнения сценария: {e}", exc_info=True)
+        result = {'success': False, 'results': {}, 'errors': [f'Ошибка обработки ИИ: {str(e)}']}
+    
+    # Вычисляем время обработки
+    processing_end_time = datetime.utcnow()
+    processing_time = (processing_end_time - processing_start_time).total_seconds()
+    
+    current_app.logger.info(f"[{task_id}] ✅ Сценарий выполнен (success: {result['success']}, ошибок: {len(result['errors'])})")
+    
+    # Получаем финальный статус с метриками
+    final_status = status_manager.get_status(task_id)
+    metrics = final_status.get('metrics', {}) if final_status else {}
+    cancelled = bool(final_status) and final_status.get('status') == 'cancelled'
+    
+    # Основной результат (JSON + Excel)
+    main_result = result['results'].get('main', {}) if result['success'] else {}
+    
+    if cancelled:
+        doc_status = 'cancelled'
+    else:
+        doc_status = 'completed' if result['success'] else 'error'
+    
+    # Сохраняем документ в базу данных
+    doc = Document(
+        user_id=user_id,
+        task_id=task_id,
+        original_filename=original_filename,
+        scenario_id=scenario_id,
+        ai_provider=ai_provider,
+        json_file=main_result.get('json_file'),
+        excel_file=main_result.get('excel_file'),
+        json_size=main_result.get('json_size', 0),
+        excel_size=main_result.get('excel_size', 0),
+        prompt_size=metrics.get('prompt_size', 0),
+        tokens_used=metrics.get('tokens_used', 0),
+        processing_time=processing_time,
+        status=doc_status,
+        error_message='; '.join(result['errors']) if result['errors'] else None,
+        completed_at=processing_end_time if result['success'] else None
+    )
+    
+    try:
+        db.session.add(doc)
+        db.session.commit()
+        current_app.logger.info(f"[{task_id}] ✅ Документ сохранен в БД (ID: {doc.id})")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"[{task_id}] ❌ Ошибка сохранения в БД: {e}")
+    
+    if cancelled:
+        return
+    
+    if not result['success']:
+        status_manager.update_status(
+            task_id,
+            status='error',
+            progress=100,
+            message=f'Ошибки: {"; ".join(result["errors"])}'
+        )
+        log_activity(
+            user_id=user_id,
+            username=username,
+            ip_address=ip_address,
+            action='upload_error',
+            details=f'Ошибка обработки: {"; ".join(result["errors"])}',
+            task_id=task_id
+        )
+        return
+    
+    # Статус "completed" выставляем после записи в БД,
+    # чтобы /api/status сразу вернул данные документа
+    warnings = result.get('warnings') or []
+    status_manager.update_status(
+        task_id,
+        status='completed',
+        progress=100,
+        message=f'Обработка завершена (предупреждений: {len(warnings)})' if warnings else 'Обработка завершена успешно',
+        warnings=warnings
+    )
+    
+    # Очищаем старые статусы (старше 10 минут)
+    status_manager.cleanup_old_statuses(max_age_minutes=10)
+    
+    log_activity(
+        user_id=user_id,
+        username=username,
+        ip_address=ip_address,
+        action='upload_completed',
+        details=f'Обработка завершена успешно: {original_filename}',
+        task_id=task_id
+    )
+
+
+# Статусы, после которых обновлений задачи больше не будет
+FINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def _attach_document(status, task_id, user_id):
+    """Добавляет в завершенный статус данные документа из БД"""
+    if status.get('status') != 'completed':
+        return status
+    doc = Document.query.filter_by(task_id=task_id, user_id=user_id).first()
+    if doc:
+        status['document'] = {
+            'id': doc.id,
+            'json_file': doc.json_file,
+            'excel_file': doc.excel_file,
+            'json_url': f'/download_result/{doc.json_file}' if doc.json_file else None,
+            'excel_url': f'/download_result/{doc.excel_file}' if doc.excel_file else None,
+            'json_size': doc.json_size,
+            'excel_size': doc.excel_size
+        }
+    return status
+
+
+def _status_access_error(status):
+    """Ответ с ошибкой, если статуса нет или задача принадлежит другому пользователю"""
+    if not status:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if status.get('user_id') and status.get('user_id') != current_user.id:
+        return jsonify({'error': 'У вас нет прав на просмотр этой задачи'}), 403
+    return None
+
+
+# Открытые SSE потоки статуса в этом процессе (ограничение STATUS_STREAM_MAX_PER_WORKER)
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def _acquire_stream_slot(limit):
+    """Занимает место для SSE потока; False - лимит процесса исчерпан"""
+    global _open_streams
+    with _open_streams_lock:
+        if _open_streams >= limit:
+            return False
+        _open_streams += 1
+        return True
+
+
+def _release_stream_slot():
+    global _open_streams
+    with _open_streams_lock:
+        _open_streams -= 1
+
+
+def _parse_event_id(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
 @bp.route('/api/status/<task_id>', methods=['GET'])
 @login_required
 def api_get_status(task_id):
@@ -342,20 +433,103 @@ def api_get_status(task_id):
         return jsonify({'error': 'Задача не найдена'}), 404
     
     # Если обработка завершена, добавляем данные документа из БД
-    if status.get('status') == 'completed':
-        doc = Document.query.filter_by(task_id=task_id, user_id=current_user.id).first()
-        if doc:
-            status['document'] = {
-                'id': doc.id,
-                'json_file': doc.json_file,
-                'excel_file': doc.excel_file,
-                'json_url': f'/download_result/{doc.json_file}' if doc.json_file else None,
-                'excel_url': f'/download_result/{doc.excel_file}' if doc.excel_file else None,
-                'json_size': doc.json_size,
-                'excel_size': doc.excel_size
-            }
-    
-    return jsonify(status)
+    return jsonify(_attach_document(status, task_id, current_user.id))
+
+
+@bp.route('/api/status/<task_id>/events', methods=['GET'])
+@login_required
+def api_status_events(task_id):
+    """
+    API: Поток статуса задачи (Server-Sent Events)
+    
+    Каждое изменение статуса - событие 'status' с id = event_id. После обрыва EventSource
+    переподключается с заголовком Last-Event-ID, и пропущенные события досылаются из журнала
+    задачи. Поток закрывается после финального статуса или через STATUS_STREAM_MAX_SECONDS
+    (клиент переподключится сам).
+    
+    Каждый поток занимает поток gunicorn, поэтому их число на процесс ограничено
+    STATUS_STREAM_MAX_PER_WORKER: сверх лимита ответ 503, и клиент переходит на /poll.
+    """
+    status_manager = ProcessingStatus()
+    error = _status_access_error(status_manager.get_status(task_id))
+    if error:
+        return error
+    
+    if not _acquire_stream_slot(current_app.config['STATUS_STREAM_MAX_PER_WORKER']):
+        response = jsonify({'error': 'Слишком много потоков статуса, используйте /poll'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    last_event_id = _parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    user_id = current_user.id
+    max_seconds = current_app.config['STATUS_STREAM_MAX_SECONDS']
+    keepalive_seconds = current_app.config['STATUS_STREAM_KEEPALIVE_SECONDS']
+    
+    def generate():
+        nonlocal last_event_id
+        deadline = time.monotonic() + max_seconds
+        yield 'retry: 3000\n\n'
+        while True:
+            events = status_manager.get_events(task_id, last_event_id)
+            for event in events:
+                last_event_id = event['event_id']
+                _attach_document(event, task_id, user_id)
+                yield f"id: {last_event_id}\nevent: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if events and events[-1].get('status') in FINAL_STATUSES:
+                return
+            if not events and status_manager.get_status(task_id) is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not status_manager.wait_for_update(task_id, last_event_id, min(keepalive_seconds, remaining)):
+                # Комментарий SSE не дает прокси закрыть простаивающее соединение
+                yield ': keepalive\n\n'
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # nginx: не буферизовать поток
+        }
+    )
+    # Место освобождается при закрытии ответа - и после завершения потока, и при обрыве клиентом
+    response.call_on_close(_release_stream_slot)
+    return response
+
+
+@bp.route('/api/status/<task_id>/poll', methods=['GET'])
+@login_required
+def api_status_poll(task_id):
+    """
+    API: Long-polling статуса (запасной вариант для SSE)
+    
+    Отвечает, как только появится событие новее since, или по таймауту - текущим статусом.
+    """
+    status_manager = ProcessingStatus()
+    status = status_manager.get_status(task_id)
+    error = _status_access_error(status)
+    if error:
+        return error
+    
+    since = _parse_event_id(request.args.get('since'))
+    max_timeout = current_app.config['STATUS_LONG_POLL_TIMEOUT']
+    try:
+        timeout = min(max(float(request.args.get('timeout', max_timeout)), 0.0), max_timeout)
+    except ValueError:
+        timeout = max_timeout
+    
+    if status.get('event_id', 0) <= since and status.get('status') not in FINAL_STATUSES:
+        status_manager.wait_for_update(task_id, since, timeout)
+        status = status_manager.get_status(task_id)
+        if not status:
+            return jsonify({'error': 'Задача не найдена'}), 404
+    
+    return jsonify(_attach_document(status, task_id, current_user.id))
 
 
 @bp.route('/api/status/<task_id>/cancel', methods=['POST'])
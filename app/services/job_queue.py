@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Очередь фоновых задач с пулом воркеров
+HTTP-запрос только ставит задачу в очередь, а конвертация и вызовы ИИ
+выполняются ограниченным числом рабочих потоков
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app
+
+from app.utils.exceptions import JobQueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Задача в очереди"""
+
+    def __init__(self, task_id: str, func: Callable, args: tuple, kwargs: dict):
+        self.task_id = task_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+
+
+class JobQueue:
+    """Очередь задач с фиксированным пулом рабочих потоков"""
+
+    def __init__(self, app, max_workers: int = 2, max_queue_size: int = 0):
+        """
+        Args:
+            app: Flask приложение (задачи выполняются в его app_context)
+            max_workers: Количество рабочих потоков
+            max_queue_size: Максимальный размер очереди (0 - без ограничений)
+        """
+        self.app = app
+        self.max_workers = max(1, max_workers)
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=max_queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._running: Dict[str, Job] = {}
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0
+        }
+
+    def _ensure_started(self):
+        """Запускает рабочие потоки при первой задаче (безопасно для fork в gunicorn)"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    name=f'job-worker-{i + 1}',
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+            logger.info(f"🚀 Запущен пул воркеров: {self.max_workers}")
+
+    def submit(self, task_id: str, func: Callable, *args, **kwargs) -> int:
+        """
+        Ставит задачу в очередь
+
+        Args:
+            task_id: ID задачи
+            func: Функция для выполнения в воркере
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Позиция задачи в очереди
+
+        Raises:
+            JobQueueFullError: Если очередь переполнена
+        """
+        self._ensure_started()
+        job = Job(task_id, func, args, kwargs)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise JobQueueFullError('Очередь обработки переполнена. Попробуйте позже.')
+
+        with self._lock:
+            self._stats['submitted'] += 1
+
+        position = self._queue.qsize()
+        logger.info(f"[{task_id}] 📥 Задача поставлена в очередь (позиция: {position})")
+        return position
+
+    def _worker_loop(self):
+        """Основной цикл рабочего потока"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+
+            job.started_at = time.time()
+            with self._lock:
+                self._running[job.task_id] = job
+
+            logger.info(f"[{job.task_id}] ▶️ Задача взята в работу "
+                        f"(ожидание в очереди: {job.started_at - job.queued_at:.1f} сек)")
+            try:
+                with self.app.app_context():
+                    job.func(*job.args, **job.kwargs)
+                with self._lock:
+                    self._stats['completed'] += 1
+            except Exception as e:
+                logger.error(f"[{job.task_id}] ❌ Необработанная ошибка в задаче: {e}", exc_info=True)
+                with self._lock:
+                    self._stats['failed'] += 1
+            finally:
+                with self._lock:
+                    self._running.pop(job.task_id, None)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику очереди"""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queued': self._queue.qsize(),
+                'running': len(self._running),
+                **self._stats
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Останавливает рабочие потоки после выполнения текущих задач"""
+        with self._lock:
+            workers = list(self._workers)
+            self._workers = []
+        for _ in workers:
+            self._queue.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+def init_job_queue(app) -> JobQueue:
+    """Создает очередь задач и регистрирует ее в приложении"""
+    job_queue = JobQueue(
+        app,
+        max_workers=app.config.get('JOB_WORKERS', 2),
+        max_queue_size=app.config.get('JOB_QUEUE_MAX_SIZE', 0)
+    )
+    app.extensions['job_queue'] = job_queue
+    return job_queue
+
+
+def get_job_queue() -> JobQueue:
+    """Возвращает очередь задач текущего приложения"""
+    return current_app.extensions['job_queue']
@@ -33,3 +33,8 @@ class FileNotFoundError(AIManagerException):
     """Файл не найден"""
     pass
 
+
+
+class JobQueueFullError(AIManagerException):
+    """Очередь фоновых задач переполнена"""
+    pass
@@ -3,22 +3,19 @@
 Простой скрипт для конвертации документов
 Использование: python convert_document.py <файл>
 
-Для использования активируйте виртуальное окружение:
-  source venv/bin/activate
+Зависимости: pip install -r requirements.txt (рекомендуется виртуальное окружение venv)
+Каталог целиком (с продолжением после остановки): python process_directory.py <каталог>
 """
 
 import sys
 import os
 from pathlib import Path
 
-# Проверка виртуального окружения
+# Проверка виртуального окружения: достаточно активного окружения или установленных зависимостей
 venv_path = Path(__file__).parent / "venv"
-if not venv_path.exists():
-    print("⚠️  Виртуальное окружение не найдено!")
-    print("   Создайте его: python3 -m venv venv")
-    print("   Активируйте: source venv/bin/activate")
-    print("   Установите зависимости: pip install -r requirements.txt")
-    sys.exit(1)
+if not venv_path.exists() and sys.prefix == sys.base_prefix:
+    print("⚠️  Виртуальное окружение не найдено - используются пакеты системного Python")
+    print("   Если не хватает зависимостей: pip install -r requirements.txt")
 
 # Добавляем src в путь
 sys.path.insert(0, str(Path(__file__).parent / "src"))
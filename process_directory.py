@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Пакетная обработка каталога документов без веб-интерфейса
+
+Обходит каталог, конвертирует документы в пуле процессов и выполняет сценарий
+(вызовы ИИ) с ограничением числа одновременно обрабатываемых документов.
+Состояние каждого документа пишется в журнал manifest.jsonl в каталоге результатов:
+повторный запуск с теми же аргументами пропускает готовые документы и продолжает
+с места остановки (уже сконвертированные документы повторно не конвертируются).
+
+Использование:
+  python process_directory.py <каталог> [-o каталог_результатов] [--scenario tokarny_default]
+
+Результаты:
+  <результаты>/converted/    - тексты документов
+  <результаты>/results/      - JSON и Excel по каждому документу
+  <результаты>/manifest.jsonl - журнал состояния (для продолжения)
+  <результаты>/summary.json  - итоги и пропускная способность последнего запуска
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROJECT_ROOT = Path(__file__).parent
+sys.path.insert(0, str(PROJECT_ROOT / "src"))
+
+from document_converter import DocumentConverter
+from scenario_manager import ScenarioManager
+from scenario_executor import ScenarioExecutor, ScenarioPrompts
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = set(DocumentConverter.SUPPORTED_FORMATS)
+
+
+class SourceDocument:
+    """Документ каталога: путь, подпись для проверки изменений и имена выходных файлов"""
+
+    def __init__(self, path: Path, root: Path, output_dir: Path):
+        self.path = path
+        self.rel = path.relative_to(root).as_posix()
+        stat = path.stat()
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        # Хэш относительного пути исключает совпадение имен из разных подкаталогов
+        safe_stem = re.sub(r'[^\w\-]+', '_', path.stem).strip('_') or 'document'
+        self.prefix = f"{safe_stem[:80]}_{hashlib.sha1(self.rel.encode('utf-8')).hexdigest()[:8]}"
+        self.converted_path = output_dir / 'converted' / f"{self.prefix}.txt"
+
+    def signature(self) -> Dict:
+        return {'size': self.size, 'mtime_ns': self.mtime_ns}
+
+
+class Manifest:
+    """
+    Журнал состояния документов (JSON Lines, только дозапись)
+
+    Каждая строка - событие документа; актуально последнее событие по относительному пути.
+    Оборванная при аварийной остановке последняя строка пропускается при чтении.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.states: Dict[str, Dict] = {}
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.states[entry['rel']] = entry
+
+    def state(self, doc: SourceDocument) -> Optional[Dict]:
+        """Последнее состояние документа (None - документ новый или изменился)"""
+        entry = self.states.get(doc.rel)
+        if not entry or entry.get('size') != doc.size or entry.get('mtime_ns') != doc.mtime_ns:
+            return None
+        return entry
+
+    def record(self, doc: SourceDocument, status: str, **fields):
+        entry = {
+            'rel': doc.rel,
+            **doc.signature(),
+            'status': status,
+            'at': datetime.now().isoformat(timespec='seconds'),
+            **fields
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.states[doc.rel] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _init_conversion_worker():
+    # Ctrl+C обрабатывает основной процесс: иначе прерванные конвертации попали бы в журнал как ошибки
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def convert_worker(input_path: str, output_path: str) -> Dict:
+    """Конвертация в дочернем процессе (вывод конвертера подавляется)"""
+    started = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        DocumentConverter().convert(input_path, output_path)
+    return {
+        'convert_seconds': round(time.time() - started, 2),
+        'text_size': Path(output_path).stat().st_size
+    }
+
+
+def _usage_tokens(results: Dict) -> int:
+    """Сумма токенов по всем промптам результата сценария"""
+    total = 0
+    for result in results.values():
+        usage = result.get('usage') if isinstance(result, dict) else None
+        if usage:
+            total += usage.get('total_tokens', 0) or 0
+    return total
+
+
+class DirectoryProcessor:
+    """Конвертация в пуле процессов и вызовы ИИ в пуле потоков с общим журналом"""
+
+    def __init__(self, args):
+        self.args = args
+        self.input_dir = Path(args.input_dir).resolve()
+        self.output_dir = Path(args.output).resolve() if args.output else (
+            PROJECT_ROOT / 'storage' / 'batch' / self.input_dir.name
+        )
+        self.results_dir = self.output_dir / 'results'
+        (self.output_dir / 'converted').mkdir(parents=True, exist_ok=True)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = Manifest(self.output_dir / 'manifest.jsonl')
+
+        self.scenario = ScenarioManager().get_scenario(args.scenario)
+        if not self.scenario:
+            raise ValueError(f"Сценарий не найден: {args.scenario}")
+        # Шаблоны промптов читаются один раз на весь запуск
+        self.prompts = ScenarioPrompts(self.scenario)
+
+        self._lock = threading.Lock()
+        self._active: List[ScenarioExecutor] = []
+        self._interrupted = threading.Event()
+        self.counters = {'completed': 0, 'errors': 0, 'converted': 0, 'skipped': 0}
+        self.convert_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.tokens = 0
+
+    def discover(self) -> List[SourceDocument]:
+        pattern = '**/*' if self.args.recursive else '*'
+        paths = sorted(
+            p for p in self.input_dir.glob(pattern)
+            if p.is_file() and p.suffix.lower() in SUPPORTED_EXTENSIONS and not p.name.startswith(('.', '~$'))
+        )
+        docs = [SourceDocument(p, self.input_dir, self.output_dir) for p in paths]
+        return docs[:self.args.limit] if self.args.limit else docs
+
+    def plan(self, docs: List[SourceDocument]):
+        """Делит документы на требующие конвертации и готовые к вызову ИИ"""
+        to_convert, to_process = [], []
+        for doc in docs:
+            state = self.manifest.state(doc)
+            status = state.get('status') if state else None
+            if status == 'completed' or (status == 'error' and not self.args.retry_failed):
+                self.counters['skipped'] += 1
+            elif status == 'converted' and doc.converted_path.exists():
+                to_process.append(doc)
+            elif status == 'error' and state.get('stage') == 'llm' and doc.converted_path.exists():
+                to_process.append(doc)
+            else:
+                to_convert.append(doc)
+        return to_convert, to_process
+
+    def process_llm(self, doc: SourceDocument):
+        """Выполняет сценарий для сконвертированного документа"""
+        if self._interrupted.is_set():
+            return
+        with open(doc.converted_path, 'r', encoding='utf-8') as f:
+            converted_text = f.read()
+
+        executor = ScenarioExecutor(
+            self.scenario,
+            task_id=doc.prefix,
+            results_folder=str(self.results_dir),
+            prompts=self.prompts
+        )
+        with self._lock:
+            self._active.append(executor)
+        started = time.time()
+        try:
+            result = executor.execute(converted_text, ai_provider=self.args.provider, output_prefix=doc.prefix,
+                                      use_cache=self.args.use_cache)
+        except Exception as e:
+            result = {'success': False, 'results': {}, 'errors': [f'Ошибка обработки ИИ: {e}']}
+        finally:
+            with self._lock:
+                self._active.remove(executor)
+        elapsed = time.time() - started
+
+        # Прерванный документ остается в состоянии converted - следующий запуск его повторит
+        if executor.cancel_token.cancelled:
+            return
+
+        tokens = _usage_tokens(result['results'])
+        main = result['results'].get('main') or {}
+        with self._lock:
+            self.llm_seconds += elapsed
+            self.tokens += tokens
+            self.counters['completed' if result['success'] else 'errors'] += 1
+        if result['success']:
+            self.manifest.record(
+                doc, 'completed',
+                json_file=main.get('json_file'),
+                excel_file=main.get('excel_file'),
+                llm_seconds=round(elapsed, 1),
+                tokens=tokens
+            )
+            print(f"✅ {doc.rel} ({elapsed:.0f} сек, токенов: {tokens:,})")
+        else:
+            self.manifest.record(doc, 'error', stage='llm', errors=result['errors'], llm_seconds=round(elapsed, 1))
+            print(f"❌ {doc.rel}: {'; '.join(result['errors'])[:300]}")
+
+    def run(self) -> Dict:
+        docs = self.discover()
+        to_convert, to_process = self.plan(docs)
+        print(f"📂 Документов: {len(docs)} (готово ранее: {self.counters['skipped']}, "
+              f"к конвертации: {len(to_convert)}, к обработке ИИ: {0 if self.args.convert_only else len(to_process) + len(to_convert)})")
+        print(f"📁 Результаты: {self.output_dir}")
+
+        started = time.time()
+        conversion_pool = ProcessPoolExecutor(
+            max_workers=self.args.conversion_workers,
+            initializer=_init_conversion_worker
+        )
+        llm_pool = ThreadPoolExecutor(max_workers=self.args.llm_concurrency, thread_name_prefix='llm')
+        llm_futures = []
+        try:
+            if not self.args.convert_only:
+                llm_futures = [llm_pool.submit(self.process_llm, doc) for doc in to_process]
+
+            conversions = {
+                conversion_pool.submit(convert_worker, str(doc.path), str(doc.converted_path)): doc
+                for doc in to_convert
+            }
+            for future in as_completed(conversions):
+                doc = conversions[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    self.counters['errors'] += 1
+                    self.manifest.record(doc, 'error', stage='conversion', errors=[str(e)])
+                    print(f"❌ {doc.rel}: ошибка конвертации: {e}")
+                    continue
+                self.counters['converted'] += 1
+                self.convert_seconds += info['convert_seconds']
+                self.manifest.record(doc, 'converted', **info)
+                if not self.args.convert_only:
+                    # Документ уходит в ИИ сразу, не дожидаясь конвертации остальных
+                    llm_futures.append(llm_pool.submit(self.process_llm, doc))
+
+            for future in as_completed(llm_futures):
+                future.result()
+        except KeyboardInterrupt:
+            print("\n⛔ Прерывание: останавливаем обработку, состояние сохранено в manifest.jsonl")
+            self._interrupted.set()
+            with self._lock:
+                for executor in self._active:
+                    executor.cancel_token.cancel()
+            conversion_pool.shutdown(wait=False, cancel_futures=True)
+            llm_pool.shutdown(wait=False, cancel_futures=True)
+        finally:
+            conversion_pool.shutdown(wait=True)
+            llm_pool.shutdown(wait=True)
+
+        return self.write_summary(len(docs), time.time() - started)
+
+    def write_summary(self, total: int, elapsed: float) -> Dict:
+        processed = self.counters['completed'] + self.counters['errors']
+        if self.args.convert_only:
+            processed = self.counters['converted']
+        summary = {
+            'input_dir': str(self.input_dir),
+            'scenario': self.args.scenario,
+            'provider': self.args.provider,
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'interrupted': self._interrupted.is_set(),
+            'documents_total': total,
+            **self.counters,
+            'elapsed_seconds': round(elapsed, 1),
+            'documents_per_hour': round(processed / elapsed * 3600, 1) if elapsed > 0 else 0,
+            'conversion_seconds_total': round(self.convert_seconds, 1),
+            'conversion_seconds_avg': round(self.convert_seconds / self.counters['converted'], 2)
+            if self.counters['converted'] else 0,
+            'llm_seconds_avg': round(self.llm_seconds / processed, 1) if processed else 0,
+            'tokens_total': self.tokens,
+            'conversion_workers': self.args.conversion_workers,
+            'llm_concurrency': self.args.llm_concurrency
+        }
+        with open(self.output_dir / 'summary.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        print(f"\n📊 Итого за {elapsed / 60:.1f} мин: успешно {self.counters['completed']}, "
+              f"ошибок {self.counters['errors']}, пропущено (готово ранее) {self.counters['skipped']}")
+        print(f"⚡ Пропускная способность: {summary['documents_per_hour']} док/ч, "
+              f"конвертация в среднем {summary['conversion_seconds_avg']} сек, "
+              f"ИИ в среднем {summary['llm_seconds_avg']} сек, токенов: {self.tokens:,}")
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Пакетная обработка каталога ТЗ (конвертация + сценарий ИИ) с продолжением после остановки',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Примеры использования:
+  python process_directory.py archive/2023
+  python process_directory.py archive/2023 -o storage/batch/2023 --llm-concurrency 8
+  python process_directory.py archive/2023 --retry-failed      # повторить документы с ошибками
+  python process_directory.py archive/2023 --convert-only      # только конвертация
+        """
+    )
+    parser.add_argument('input_dir', help='Каталог с документами')
+    parser.add_argument('-o', '--output', help='Каталог результатов (по умолчанию storage/batch/<имя каталога>)')
+    parser.add_argument('--scenario', default='tokarny_default', help='ID сценария (по умолчанию tokarny_default)')
+    parser.add_argument('--provider', default='openai', choices=['openai', 'jayflow'], help='Провайдер ИИ')
+    parser.add_argument('--conversion-workers', type=int, default=os.cpu_count() or 2,
+                        help='Число процессов конвертации (по умолчанию - число CPU)')
+    parser.add_argument('--llm-concurrency', type=int, default=4,
+                        help='Сколько документов одновременно обрабатывается ИИ (по умолчанию 4)')
+    parser.add_argument('--no-recursive', dest='recursive', action='store_false', help='Не обходить подкаталоги')
+    parser.add_argument('--retry-failed', action='store_true', help='Повторить документы, завершившиеся ошибкой')
+    parser.add_argument('--convert-only', action='store_true', help='Только конвертация, без вызовов ИИ')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Не брать ответы ИИ из кэша (все промпты отправляются заново)')
+    parser.add_argument('--limit', type=int, default=0, help='Обработать не больше N документов')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Подробный лог сценария')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+    if not Path(args.input_dir).is_dir():
+        print(f"❌ Каталог не найден: {args.input_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        summary = DirectoryProcessor(args).run()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(130 if summary['interrupted'] else (1 if summary['errors'] else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Сравнение потокового извлечения DOCX (src/docx_extract.py) с прежним многопроходным
+алгоритмом на python-docx: время и пиковая память (tracemalloc).
+
+Использование:
+    python scripts/benchmark_docx.py                      # сгенерированный документ
+    python scripts/benchmark_docx.py --paragraphs 50000 --tables 500
+    python scripts/benchmark_docx.py file1.docx file2.docx
+
+Если python-docx не установлен, измеряется только потоковый вариант.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from docx_extract import extract_docx_text
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+def _paragraph(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def generate_docx(path: Path, paragraphs: int, tables: int, rows: int = 20, cols: int = 5) -> None:
+    """Синтетический DOCX: абзацы ТЗ с таблицами характеристик между ними"""
+    every = max(1, paragraphs // max(tables, 1))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        with archive.open('word/document.xml', 'w') as stream:
+            stream.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         f'<w:document xmlns:w="{W}"><w:body>'.encode('utf-8'))
+            table_count = 0
+            for index in range(paragraphs):
+                parts = [_paragraph(f"{index + 1}. Станок должен обеспечивать точность позиционирования "
+                                    f"не хуже 0,0{index % 9 + 1} мм по оси X")]
+                if tables and index % every == every - 1 and table_count < tables:
+                    table_count += 1
+                    parts.append('<w:tbl>')
+                    for row in range(rows):
+                        cells = ''.join(f'<w:tc>{_paragraph(f"Параметр {row + 1}.{col + 1}: {row * col} кВт")}</w:tc>'
+                                        for col in range(cols))
+                        parts.append(f'<w:tr>{cells}</w:tr>')
+                    parts.append('</w:tbl>')
+                stream.write(''.join(parts).encode('utf-8'))
+            stream.write(b'<w:sectPr/></w:body></w:document>')
+
+
+def legacy_convert_docx(file_path: str) -> str:
+    """Прежний алгоритм: абзацы, затем все таблицы, затем колонтитулы (отдельные проходы python-docx)"""
+    from docx import Document
+
+    doc = Document(file_path)
+    text_content = []
+    for paragraph in doc.paragraphs:
+        para_text = paragraph.text.strip()
+        if para_text:
+            text_content.append(para_text)
+        else:
+            runs_text = [run.text.strip() for run in paragraph.runs if run.text and run.text.strip()]
+            if runs_text:
+                text_content.append(' '.join(runs_text))
+    for table in doc.tables:
+        text_content.append("\n--- Таблица ---\n")
+        for row in table.rows:
+            row_text = []
+            for cell in row.cells:
+                parts = [para.text.strip() for para in cell.paragraphs if para.text.strip()]
+                row_text.append(' '.join(parts))
+            if any(row_text):
+                text_content.append(" | ".join(row_text))
+        text_content.append("\n")
+    for section in doc.sections:
+        for title, part in (('Заголовок', section.header), ('Подвал', section.footer)):
+            texts = [para.text.strip() for para in part.paragraphs if para.text.strip()]
+            if texts:
+                text_content.append(f"\n--- {title} ---\n")
+                text_content.extend(texts)
+                text_content.append("\n")
+    return "\n".join(text_content)
+
+
+def measure(func, file_path: str):
+    """(секунды, пиковая память МБ, длина текста)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    text = func(file_path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк извлечения текста из DOCX')
+    parser.add_argument('files', nargs='*', help='DOCX файлы (по умолчанию - сгенерированный документ)')
+    parser.add_argument('--paragraphs', type=int, default=20000, help='Абзацев в сгенерированном документе')
+    parser.add_argument('--tables', type=int, default=200, help='Таблиц в сгенерированном документе')
+    args = parser.parse_args()
+
+    try:
+        import docx  # noqa: F401
+        implementations = [('python-docx (прежний)', legacy_convert_docx)]
+    except ImportError:
+        print("⚠️  python-docx не установлен - измеряется только потоковый вариант")
+        implementations = []
+    implementations.append(('iterparse (потоковый)', extract_docx_text))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files
+        if not files:
+            generated = Path(tmp_dir) / 'generated.docx'
+            generate_docx(generated, args.paragraphs, args.tables)
+            print(f"📄 Сгенерирован документ: {args.paragraphs} абзацев, {args.tables} таблиц, "
+                  f"{generated.stat().st_size / 1024:.0f} КБ в архиве")
+            files = [str(generated)]
+
+        for file_path in files:
+            print(f"\n{Path(file_path).name}")
+            for name, func in implementations:
+                elapsed, peak_mb, length = measure(func, file_path)
+                print(f"  {name:<24} {elapsed:8.2f} сек  {peak_mb:8.1f} МБ  {length:>10} символов")
+
+
+if __name__ == '__main__':
+    main()
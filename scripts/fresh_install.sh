@@ -43,19 +43,30 @@ else
 fi
 
 echo ""
-echo "🐍 Шаг 5: Создание виртуального окружения и установка зависимостей..."
-remote_exec "su - ${APP_USER} -c 'cd ${APP_DIR} && python3 -m venv venv && source venv/bin/activate && pip install --upgrade pip && pip install -r requirements.txt && pip install gunicorn'"
+echo "📦 Шаг 5: Установка LibreOffice и модуля uno..."
+# python3-uno ставится для системного python3 - пул LibreOffice (src/office_pool.py) использует его через venv
+remote_exec "DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends libreoffice-writer python3-uno antiword"
 
 echo ""
-echo "📁 Шаг 6: Создание необходимых директорий..."
+echo "🐍 Шаг 6: Создание виртуального окружения и установка зависимостей..."
+# --system-site-packages: модуль uno из python3-uno доступен в venv (пакеты venv при этом в приоритете)
+remote_exec "su - ${APP_USER} -c 'cd ${APP_DIR} && python3 -m venv --system-site-packages venv && source venv/bin/activate && pip install --upgrade pip && pip install -r requirements.txt && pip install gunicorn'"
+if remote_exec "su - ${APP_USER} -c '${APP_DIR}/venv/bin/python -c \"import uno\"'"; then
+    echo "   ✅ Модуль uno доступен: конвертация .doc через постоянные процессы LibreOffice"
+else
+    echo "   ⚠️  Модуль uno недоступен в venv: LibreOffice будет запускаться на каждый файл"
+fi
+
+echo ""
+echo "📁 Шаг 7: Создание необходимых директорий..."
 remote_exec "su - ${APP_USER} -c 'cd ${APP_DIR} && mkdir -p storage/{uploads,converted,results,debug} logs'"
 
 echo ""
-echo "🔍 Шаг 7: Проверка файлов данных..."
+echo "🔍 Шаг 8: Проверка файлов данных..."
 remote_exec "su - ${APP_USER} -c 'cd ${APP_DIR} && ls -la data/Промпт.txt data/TZ.json data/glossary.json'"
 
 echo ""
-echo "⚙️  Шаг 8: Создание systemd сервиса..."
+echo "⚙️  Шаг 9: Создание systemd сервиса..."
 # Создаем systemd unit файл напрямую на сервере
 remote_exec "cat > /tmp/ai-manager.service << 'SERVICEEOF'
 [Unit]
@@ -69,6 +80,8 @@ WorkingDirectory=${APP_DIR}
 Environment=\"PATH=${APP_DIR}/venv/bin\"
 ExecStart=${APP_DIR}/venv/bin/gunicorn \\
     --workers 3 \\
+    --worker-class gthread \\
+    --threads 16 \\
     --bind 127.0.0.1:5000 \\
     --timeout 300 \\
     run:app
@@ -84,7 +97,7 @@ systemctl daemon-reload
 systemctl enable ${SERVICE_NAME}"
 
 echo ""
-echo "🌐 Шаг 9: Настройка Nginx..."
+echo "🌐 Шаг 10: Настройка Nginx..."
 # Создаем конфигурацию Nginx напрямую на сервере
 remote_exec "cat > /tmp/ai-manager-nginx << 'NGINXEOF'
 server {
@@ -120,7 +133,7 @@ rm -f /etc/nginx/sites-enabled/default
 nginx -t && systemctl reload nginx"
 
 echo ""
-echo "▶️  Шаг 10: Запуск сервиса..."
+echo "▶️  Шаг 11: Запуск сервиса..."
 remote_exec "systemctl start ${SERVICE_NAME}"
 sleep 3
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Отчет о локальном извлечении параметров по глоссарию (prefill): какие параметры
+заполняются без ИИ, за какое время и сколько токенов основного промпта экономится.
+
+Использование:
+    python scripts/glossary_prefill_report.py документ1.pdf документ2.txt ...
+    python scripts/glossary_prefill_report.py --scenario tokarny_default -v storage/converted/*.txt
+
+Файлы .txt считаются уже сконвертированным текстом, остальные конвертируются DocumentConverter.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / 'src'))
+sys.path.insert(0, str(project_root / 'scripts'))
+
+from glossary_prefill import get_matcher, prefill_parameters
+from prompt_builder import get_compiled_prompt
+from tz_compact import count_tokens, iter_parameters
+from tz_relevance_report import read_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параметры, извлекаемые локально по глоссарию')
+    parser.add_argument('files', nargs='+', help='Документы или сконвертированные .txt')
+    parser.add_argument('--scenario', default='tokarny_default', help='ID сценария (data/scenarios/<id>.json)')
+    parser.add_argument('--encoding', choices=['json', 'compact'], default=None,
+                        help='Представление шаблона (по умолчанию - из сценария)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Показать заполненные параметры')
+    args = parser.parse_args()
+
+    with open(project_root / 'data' / 'scenarios' / f"{args.scenario}.json", 'r', encoding='utf-8') as f:
+        main_config = json.load(f)['prompts']['main']
+    compiled = get_compiled_prompt(
+        str(project_root / main_config['file']),
+        str(project_root / main_config['tz_template']),
+        str(project_root / main_config['glossary']),
+        tz_encoding=args.encoding or main_config.get('tz_encoding', 'json')
+    )
+
+    started = time.perf_counter()
+    matcher = get_matcher(compiled.tz_json, compiled.glossary_synonyms, compiled.glossary_version)
+    print(f"🔧 Глоссарий скомпилирован за {(time.perf_counter() - started) * 1000:.0f} мс, "
+          f"числовых параметров: {len(matcher.value_patterns)} из {sum(1 for _ in iter_parameters(compiled.tz_json))}\n")
+
+    print(f"{'Документ':<40} {'Заполнено':>10} {'Время, мс':>10} {'Токенов':>9} {'Экономия':>9}")
+    for name in args.files:
+        path = Path(name)
+        text = read_text(path)
+        started = time.perf_counter()
+        prefill = prefill_parameters(text, compiled.tz_json, compiled.glossary_synonyms, matcher)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        full_tokens, method = count_tokens(compiled.render(text))
+        rest_tokens, _ = count_tokens(compiled.render(text, prefill.tz_json)) if prefill.values else (full_tokens, method)
+        saved = 1 - rest_tokens / full_tokens if full_tokens else 0
+        print(f"{path.name[:40]:<40} {len(prefill.values):>10} {elapsed:>10.1f} {rest_tokens:>9,} {saved:>8.0%}")
+        if args.verbose:
+            for parameter_path, fields in prefill.values.items():
+                print(f"    + {' > '.join(parameter_path)} = {fields['значение']} ({fields['источник']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Отчет об отборе секций шаблона TZ.json по документам (tz_pruning): сколько секций
+остается в основном промпте и сколько токенов экономится на каждом документе.
+
+Использование:
+    python scripts/tz_relevance_report.py документ1.pdf документ2.txt ...
+    python scripts/tz_relevance_report.py --scenario tokarny_default --encoding compact storage/converted/*.txt
+
+Файлы .txt считаются уже сконвертированным текстом, остальные конвертируются DocumentConverter.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / 'src'))
+
+from document_converter import DocumentConverter
+from prompt_builder import get_compiled_prompt
+from tz_compact import count_tokens
+from tz_relevance import prune_template
+
+
+def read_text(path: Path) -> str:
+    if path.suffix.lower() == '.txt':
+        return path.read_text(encoding='utf-8', errors='ignore')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = Path(tmp_dir) / 'converted.txt'
+        DocumentConverter().convert(str(path), str(output))
+        return output.read_text(encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Экономия токенов от отбора секций шаблона ТЗ')
+    parser.add_argument('files', nargs='+', help='Документы или сконвертированные .txt')
+    parser.add_argument('--scenario', default='tokarny_default', help='ID сценария (data/scenarios/<id>.json)')
+    parser.add_argument('--encoding', choices=['json', 'compact'], default=None,
+                        help='Представление шаблона (по умолчанию - из сценария)')
+    parser.add_argument('--min-score', type=float, default=None, help='Порог оценки секции (TZ_PRUNING_MIN_SCORE)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Показать отброшенные секции')
+    args = parser.parse_args()
+
+    with open(project_root / 'data' / 'scenarios' / f"{args.scenario}.json", 'r', encoding='utf-8') as f:
+        main_config = json.load(f)['prompts']['main']
+    compiled = get_compiled_prompt(
+        str(project_root / main_config['file']),
+        str(project_root / main_config['tz_template']),
+        str(project_root / main_config['glossary']),
+        tz_encoding=args.encoding or main_config.get('tz_encoding', 'json')
+    )
+
+    print(f"{'Документ':<40} {'Секций':>9} {'Токенов (полный)':>17} {'Токенов (отбор)':>16} {'Экономия':>9}")
+    total_full = total_pruned = 0
+    for name in args.files:
+        path = Path(name)
+        text = read_text(path)
+        selection = prune_template(text, compiled.tz_json, compiled.glossary, args.min_score)
+        full_tokens, method = count_tokens(compiled.render(text))
+        pruned_tokens, _ = count_tokens(compiled.render(text, selection.tz_json))
+        total_full += full_tokens
+        total_pruned += pruned_tokens
+
+        sections = f"{len(selection.kept)}/{len(selection.kept) + len(selection.dropped)}"
+        saved = 1 - pruned_tokens / full_tokens if full_tokens else 0
+        print(f"{path.name[:40]:<40} {sections:>9} {full_tokens:>17,} {pruned_tokens:>16,} {saved:>8.0%}")
+        if args.verbose:
+            for section in selection.dropped:
+                print(f"    - {' > '.join(section)} ({selection.scores[section]:.2f})")
+
+    if total_full:
+        print(f"\nИтого: {total_full:,} → {total_pruned:,} токенов ({1 - total_pruned / total_full:.0%} экономии), "
+              f"токены: {method}")
+
+
+if __name__ == '__main__':
+    main()
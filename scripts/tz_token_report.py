@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Отчет о размере шаблона TZ.json в основном промпте: JSON с отступами (текущий
+вариант), минифицированный JSON и компактный список параметров (tz_encoding=compact).
+
+Использование:
+    python scripts/tz_token_report.py [путь к TZ.json]
+
+Токены считаются через tiktoken, если он установлен, иначе оцениваются как ~4 символа на токен.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / 'src'))
+
+from tz_compact import iter_parameters, token_report
+
+
+def main():
+    tz_path = Path(sys.argv[1]) if len(sys.argv) > 1 else project_root / 'data' / 'TZ.json'
+    with open(tz_path, 'r', encoding='utf-8') as f:
+        tz_json = json.load(f)
+
+    report = token_report(tz_json)
+    base_tokens = report['json']['tokens'] or 1
+    parameters = sum(1 for _ in iter_parameters(tz_json))
+
+    print(f"📄 {tz_path.name}: {parameters} параметров, токены: {report['json']['method']}\n")
+    print(f"{'Представление':<16} {'Символов':>10} {'Токенов':>10} {'Доля':>8}")
+    for name, row in report.items():
+        print(f"{name:<16} {row['chars']:>10,} {row['tokens']:>10,} {row['tokens'] / base_tokens:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
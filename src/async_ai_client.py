@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Асинхронные AI клиенты (asyncio)
+
+Повторяют интерфейс OpenAIClient и JayFlowClient, но process_prompt/process_prompt_text
+являются корутинами: запрос в ожидании ответа не занимает поток ОС, поэтому один
+event loop может одновременно вести десятки промптов разных документов.
+Разбор ответов, отладочные файлы и тексты ошибок общие с синхронными клиентами.
+
+Блокирующие операции синхронных клиентов (чтение и запись кэша ответов, отладочные
+файлы, учет лимита скорости в SQLite, обновление статуса из callback прогресса)
+выполняются через asyncio.to_thread: один event loop обслуживает все документы
+процесса, и медленный диск или занятая блокировка SQLite не должны его останавливать.
+"""
+
+import asyncio
+import json
+import logging
+import ssl
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from ai_client import OpenAIClient, JayFlowClient
+from rate_limiter import RateLimitTimeout
+from http_pool import get_async_openai_client, get_async_httpx_client
+from llm_stream import ProgressCallback, StreamProgress, StreamStalled, astream_chat_completion
+from cancellation import cancel_task_on
+
+logger = logging.getLogger(__name__)
+
+
+def _offload_progress(on_progress: Optional[ProgressCallback]) -> Optional[ProgressCallback]:
+    """
+    Callback прогресса, выполняемый в пуле потоков, а не в event loop
+
+    Callback обновляет статус задачи (SQLite/диск); вызов не ждет завершения -
+    StreamProgress и так ограничивает частоту обновлений.
+    """
+    if on_progress is None:
+        return None
+    loop = asyncio.get_running_loop()
+
+    def report(tokens: int):
+        future = loop.run_in_executor(None, on_progress, tokens)
+        future.add_done_callback(_log_progress_error)
+
+    return report
+
+
+def _log_progress_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"⚠️  Ошибка обновления прогресса: {future.exception()}")
+
+
+class _AsyncPromptMixin:
+    """Общие циклы повторов для асинхронных клиентов"""
+
+    async def _make_request_async(self, prompt: str, save_prompt: bool = True, timestamp: str = None,
+                                  on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def _cancellable_request(self, prompt: str, save_prompt: bool = True, timestamp: str = None,
+                                   on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        _make_request_async, прерываемый токеном отмены задачи
+
+        Отмена токена отменяет корутину запроса: ожидание лимита скорости или ответа
+        прекращается сразу, HTTP поток закрывается и соединение возвращается в пул.
+        """
+        if self._cancel_requested():
+            return self._cancelled_result()
+        try:
+            with cancel_task_on(self.cancel_token):
+                return await self._make_request_async(prompt, save_prompt=save_prompt, timestamp=timestamp,
+                                                       on_progress=on_progress)
+        except asyncio.CancelledError:
+            if not self._cancel_requested():
+                raise
+            logger.info("⛔ Задача отменена - запрос к ИИ прерван")
+            return self._cancelled_result()
+
+    def _json_error_message(self, debug_file: str) -> str:
+        """Текст ошибки, если из ответа не удалось извлечь JSON"""
+        return (
+            f'Не удалось извлечь валидный JSON из ответа ИИ\n\n'
+            f'📁 Ответ ИИ сохранен для отладки: {debug_file}\n'
+            f'Проверьте файл, чтобы увидеть, что вернула модель.'
+        )
+
+    async def process_prompt(self, prompt: str, max_retries: Optional[int] = None, use_cache: bool = True,
+                             on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает промпт и возвращает заполненный JSON (асинхронно)
+
+        Args:
+            prompt: Промпт для отправки
+            max_retries: Ограничение числа повторов (None - по политике класса ошибки, см. retry_policy)
+            use_cache: Использовать кэш ответов (False - всегда отправлять запрос в ИИ)
+            on_progress: Callback прогресса: число полученных токенов ответа
+
+        Returns:
+            Словарь того же формата, что и OpenAIClient.process_prompt
+        """
+        logger.info(f"🔄 Начало асинхронной обработки промпта (длина: {len(prompt):,} символов, max_retries: {max_retries})")
+
+        # Идентичный промпт уже обрабатывался - берем ответ из кэша
+        cached = await asyncio.to_thread(self._cached_response, prompt, use_cache)
+        if cached:
+            json_data = self.extract_json(cached['content'])
+            if json_data:
+                return {
+                    'success': True,
+                    'json': json_data,
+                    'raw_response': cached['content'],
+                    'usage': self._cached_usage(cached.get('usage')),
+                    'error': None,
+                    'cached': True
+                }
+
+        attempt = 0
+        while True:
+            if attempt > 0:
+                logger.info(f"🔄 Повторная попытка {attempt}")
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            response = await self._cancellable_request(prompt, save_prompt=(attempt == 0), timestamp=timestamp,
+                                                       on_progress=on_progress)
+
+            if not response['success']:
+                error_type = response.get('error_type', 'unknown')
+                error_msg = response.get('error', 'Неизвестная ошибка')
+                logger.warning(f"⚠️  Ошибка запроса (попытка {attempt + 1}, тип: {error_type}): {error_msg[:200]}")
+
+                wait_time = self._retry_delay(response, attempt, max_retries)
+                if wait_time is not None:
+                    logger.info(f"⏳ Ожидание {wait_time} секунд перед повтором...")
+                    await self._retry_sleep_async(wait_time)
+                    attempt += 1
+                    continue
+                return {
+                    'success': False,
+                    'json': None,
+                    'raw_response': None,
+                    'usage': None,
+                    'error': error_msg
+                }
+
+            content = response['content']
+            json_data = self.extract_json(content)
+
+            if json_data:
+                logger.info(f"✅ JSON успешно извлечен (размер: {len(json.dumps(json_data)):,} символов)")
+                await asyncio.to_thread(self._store_response, prompt, content, response.get('usage'), use_cache)
+                return {
+                    'success': True,
+                    'json': json_data,
+                    'raw_response': content,
+                    'usage': response.get('usage'),
+                    'error': None
+                }
+
+            logger.warning(f"⚠️  Не удалось извлечь JSON из ответа (попытка {attempt + 1})")
+            debug_file = await asyncio.to_thread(self._save_debug_response, content, prompt, timestamp)
+            wait_time = self._retry_delay({'error_type': 'invalid_json'}, attempt, max_retries)
+            if wait_time is not None:
+                await self._retry_sleep_async(wait_time)
+                attempt += 1
+                continue
+            return {
+                'success': False,
+                'json': None,
+                'raw_response': content,
+                'usage': response.get('usage'),
+                'error': self._json_error_message(debug_file)
+            }
+
+    async def process_prompt_text(self, prompt: str, max_retries: Optional[int] = None, use_cache: bool = True,
+                                  on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает промпт и возвращает текст (асинхронно)
+
+        Args:
+            prompt: Промпт для отправки
+            max_retries: Ограничение числа повторов (None - по политике класса ошибки, см. retry_policy)
+            use_cache: Использовать кэш ответов (False - всегда отправлять запрос в ИИ)
+            on_progress: Callback прогресса: число полученных токенов ответа
+
+        Returns:
+            Словарь того же формата, что и OpenAIClient.process_prompt_text
+        """
+        logger.info(f"🔄 Начало асинхронной обработки текстового промпта (длина: {len(prompt):,} символов)")
+
+        # Идентичный промпт уже обрабатывался - берем ответ из кэша
+        cached = await asyncio.to_thread(self._cached_response, prompt, use_cache)
+        if cached:
+            return {
+                'success': True,
+                'text': cached['content'],
+                'raw_response': cached['content'],
+                'usage': self._cached_usage(cached.get('usage')),
+                'error': None,
+                'cached': True
+            }
+
+        attempt = 0
+        while True:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            response = await self._cancellable_request(prompt, save_prompt=(attempt == 0), timestamp=timestamp,
+                                                       on_progress=on_progress)
+
+            if not response['success']:
+                error_msg = response.get('error', 'Неизвестная ошибка')
+                logger.warning(f"⚠️  Ошибка запроса (попытка {attempt + 1}, "
+                               f"тип: {response.get('error_type', 'unknown')}): {error_msg[:200]}")
+
+                wait_time = self._retry_delay(response, attempt, max_retries)
+                if wait_time is not None:
+                    await self._retry_sleep_async(wait_time)
+                    attempt += 1
+                    continue
+                return {
+                    'success': False,
+                    'text': None,
+                    'raw_response': None,
+                    'usage': None,
+                    'error': error_msg
+                }
+
+            content = response['content']
+            logger.info(f"✅ Получен текстовый ответ: {len(content):,} символов")
+            await asyncio.to_thread(self._store_response, prompt, content, response.get('usage'), use_cache)
+            return {
+                'success': True,
+                'text': content,
+                'raw_response': content,
+                'usage': response.get('usage'),
+                'error': None
+            }
+
+
+class AsyncOpenAIClient(_AsyncPromptMixin, OpenAIClient):
+    """Асинхронный клиент OpenAI API на базе openai.AsyncOpenAI"""
+
+    async def _make_request_async(self, prompt: str, save_prompt: bool = True, timestamp: str = None,
+                                  on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Отправляет запрос в OpenAI API, не блокируя event loop
+
+        Returns:
+            Ответ от API (формат как у OpenAIClient._make_request)
+        """
+        try:
+            import openai  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "Библиотека openai не установлена. Установите:\n"
+                "  pip install openai"
+            )
+
+        client = get_async_openai_client(self.api_key, proxy=self.proxy)
+        timestamp = await asyncio.to_thread(self._prepare_request, prompt, save_prompt, timestamp)
+
+        try:
+            estimated_tokens = await self._acquire_capacity_async(prompt)
+        except RateLimitTimeout as e:
+            return self._rate_limit_timeout_result(e)
+
+        try:
+            logger.info(f"🚀 Асинхронный запрос в OpenAI API (модель: {self.model}, промпт: {len(prompt):,} символов)")
+            start_time = time.time()
+
+            if self._streaming_enabled():
+                response = await astream_chat_completion(
+                    client,
+                    StreamProgress(_offload_progress(on_progress)),
+                    self._stream_idle_timeout(),
+                    first_token_timeout=self._stream_first_token_timeout(),
+                    model=self.model,
+                    messages=self._build_messages(prompt)
+                )
+            else:
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_messages(prompt)
+                )
+
+            logger.info(f"✅ Получен ответ от OpenAI API за {time.time() - start_time:.2f} секунд")
+            result = await asyncio.to_thread(self._parse_response, response, prompt, timestamp)
+            await asyncio.to_thread(self._settle_capacity, estimated_tokens, result.get('usage'))
+            return result
+
+        except asyncio.CancelledError:
+            raise
+        except StreamStalled as e:
+            await asyncio.to_thread(self._save_debug_response, f"Поток ответа завис: {e}", prompt, timestamp)
+            return self._stalled_result(e)
+        except Exception as e:
+            result = self._error_result(e, prompt)
+            await asyncio.to_thread(self._learn_rate_limit, result)
+            return result
+
+
+class AsyncJayFlowClient(_AsyncPromptMixin, JayFlowClient):
+    """Асинхронный клиент Jay Flow API на базе httpx.AsyncClient"""
+
+    def _json_error_message(self, debug_file: str) -> str:
+        return (
+            'Не удалось извлечь валидный JSON из ответа Jay Flow API.\n\n'
+            'Возможные причины:\n'
+            '1. Агент не вернул JSON в ответе\n'
+            '2. Включите JSON-режим в настройках агента Jay Flow\n'
+            '3. Проверьте промпт - он должен явно запрашивать JSON\n\n'
+            f'📁 Полный ответ сохранен для отладки: {debug_file}'
+        )
+
+    @staticmethod
+    def _is_ssl_error(error: Exception) -> bool:
+        """httpx сообщает об ошибках SSL как ConnectError с ssl.SSLError в причине"""
+        cause = error.__cause__ or error.__context__
+        return isinstance(cause, ssl.SSLError) or 'SSL' in str(error) or 'CERTIFICATE' in str(error)
+
+    async def _send_async(self, use_post: bool, params: Dict[str, Any], data: Dict[str, Any],
+                          headers: Dict[str, str], verify_ssl: bool):
+        """Отправляет один HTTP запрос к Jay Flow API через общий httpx.AsyncClient"""
+        client = get_async_httpx_client('jayflow', verify=verify_ssl)
+        return await client.request(
+            'POST' if use_post else 'GET',
+            self.api_url,
+            params=params,
+            json=data,
+            headers=headers if headers else None,
+            timeout=300  # 5 минут таймаут
+        )
+
+    async def _make_request_async(self, prompt: str, save_prompt: bool = True, timestamp: str = None,
+                                  on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Отправляет запрос в Jay Flow API, не блокируя event loop
+
+        Returns:
+            Ответ от API (формат как у JayFlowClient._make_request)
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError(
+                "Библиотека httpx не установлена. Установите:\n"
+                "  pip install httpx"
+            )
+
+        timestamp = await asyncio.to_thread(self._prepare_request, prompt, save_prompt, timestamp)
+        use_post, params, data, headers = self._build_request(prompt)
+
+        try:
+            estimated_tokens = await self._acquire_capacity_async(prompt)
+        except RateLimitTimeout as e:
+            return self._rate_limit_timeout_result(e)
+
+        try:
+            # Повторы выполняет process_prompt по политикам retry_policy;
+            # здесь только однократный переход на запрос без проверки SSL - как в синхронном клиенте
+            try:
+                response = await self._send_async(use_post, params, data, headers, self.verify_ssl)
+            except httpx.ConnectError as conn_error:
+                if not (self._is_ssl_error(conn_error) and self.verify_ssl):
+                    raise
+                logger.warning("⚠️  SSL ошибка при подключении к Jay Flow API. Пробую без проверки SSL сертификата...")
+                response = await self._send_async(use_post, params, data, headers, False)
+
+            response.raise_for_status()
+            result = await asyncio.to_thread(self._parse_result, response.json(), prompt, timestamp)
+            await asyncio.to_thread(self._settle_capacity, estimated_tokens, result.get('usage'))
+            return await asyncio.to_thread(self._report_progress, result, on_progress)
+
+        except asyncio.CancelledError:
+            raise
+        except httpx.ConnectError as e:
+            if self._is_ssl_error(e):
+                return await asyncio.to_thread(self._ssl_error_result, str(e), prompt, timestamp)
+            return await asyncio.to_thread(self._connection_error_result, str(e), prompt, timestamp)
+        except httpx.TimeoutException as e:
+            return await asyncio.to_thread(self._timeout_result, str(e), prompt, timestamp)
+        except httpx.HTTPStatusError as e:
+            return await asyncio.to_thread(self._http_error_result, e.response.status_code, e.response.headers,
+                                           str(e), prompt, timestamp)
+        except httpx.HTTPError as e:
+            return await asyncio.to_thread(self._request_error_result, str(e), prompt, timestamp)
+        except Exception as e:
+            return await asyncio.to_thread(self._unknown_error_result, str(e), prompt, timestamp)
+
+
+def create_async_client(ai_provider: str = 'openai', model: Optional[str] = None):
+    """
+    Создает асинхронный AI клиент по имени провайдера
+
+    Args:
+        ai_provider: 'openai' или 'jayflow'
+        model: Модель OpenAI (опционально)
+    """
+    if ai_provider == 'jayflow':
+        return AsyncJayFlowClient()
+    if model:
+        return AsyncOpenAIClient(model=model)
+    return AsyncOpenAIClient()
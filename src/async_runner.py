@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Общий фоновый event loop процесса
+
+Корутины из синхронного кода (воркеры очереди, CLI) выполняются в одном
+event loop, работающем в отдельном потоке. Все асинхронные запросы к ИИ
+процесса мультиплексируются в нем и используют общий пул соединений.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_pid: Optional[int] = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает общий event loop, запуская его поток при первом обращении"""
+    global _loop, _thread, _pid
+    with _lock:
+        # После fork поток loop родительского процесса не существует
+        if _loop is not None and _pid == os.getpid() and _thread.is_alive():
+            return _loop
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name='async-runner', daemon=True)
+        thread.start()
+        _loop, _thread, _pid = loop, thread, os.getpid()
+        logger.info("🔁 Запущен общий event loop для асинхронных запросов к ИИ")
+        return _loop
+
+
+def submit_coroutine(coro: Coroutine) -> concurrent.futures.Future:
+    """
+    Планирует корутину в общем event loop
+
+    Returns:
+        concurrent.futures.Future с результатом корутины
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Выполняет корутину в общем event loop и ждет результат в текущем потоке
+
+    Args:
+        coro: Корутина
+        timeout: Максимальное время ожидания, сек (None - без ограничения)
+    """
+    return submit_coroutine(coro).result(timeout)
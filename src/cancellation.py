@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Кооперативная отмена задач
+
+CancellationToken создается исполнителем сценария на время обработки задачи и
+передается AI клиентам (атрибут cancel_token). Отмена из веб-интерфейса выставляет
+status='cancelled' в ProcessingStatus; наблюдатель (watch_cancellation) замечает это
+и отменяет токен, а клиенты по сигналу токена сразу закрывают сокет HTTP запроса
+(http_pool.abort_on_cancel, регистрируется до отправки) и поток ответа
+(асинхронные - отменяют корутину запроса), прерывают ожидание лимита скорости и
+паузы между повторами. Поток воркера и соединение с провайдером освобождаются,
+не дожидаясь ответа ИИ.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Как часто наблюдатель проверяет статус задачи, сек
+WATCH_INTERVAL_SECONDS = 1.0
+
+
+class TaskCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class CancellationToken:
+    """Флаг отмены с callback'ами, вызываемыми в момент отмены"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Отменяет токен и вызывает зарегистрированные callback'и (один раз)"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def register(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Регистрирует callback отмены (если токен уже отменен - вызывает сразу)
+
+        Returns:
+            Функция, снимающая регистрацию
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        self._run(callback)
+        return lambda: None
+
+    def _unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @staticmethod
+    def _run(callback: Callable[[], None]):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"⚠️  Ошибка обработчика отмены: {e}")
+
+    def wait(self, timeout: float) -> bool:
+        """Ждет отмену не дольше timeout. Возвращает True, если токен отменен"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled('Задача отменена пользователем')
+
+
+def watch_cancellation(token: CancellationToken, is_cancelled: Callable[[], bool],
+                       interval: float = WATCH_INTERVAL_SECONDS) -> Callable[[], None]:
+    """
+    Запускает поток, который отменяет токен, когда is_cancelled() вернет True
+
+    Returns:
+        Функция остановки наблюдателя
+    """
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                if is_cancelled():
+                    logger.info("⛔ Получен сигнал отмены задачи - прерываем запросы к ИИ")
+                    token.cancel()
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️  Ошибка проверки отмены задачи: {e}")
+
+    threading.Thread(target=run, name='cancellation-watch', daemon=True).start()
+    return stopped.set
+
+
+@contextmanager
+def cancel_task_on(token: Optional[CancellationToken]):
+    """
+    Внутри корутины: при отмене токена отменяет текущую asyncio задачу
+
+    CancelledError, вызванный токеном, вызывающий код отличает по token.cancelled.
+    """
+    if token is None:
+        yield
+        return
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    active = True
+
+    def cancel():
+        # Выполняется в потоке event loop, поэтому не гонится с выходом из блока
+        if active:
+            task.cancel()
+
+    unregister = token.register(lambda: loop.call_soon_threadsafe(cancel))
+    try:
+        yield
+    finally:
+        active = False
+        unregister()
+
+
+class CancellationMixin:
+    """Отмена запросов AI клиентов по токену задачи"""
+
+    # Токен отмены задачи, выставляется исполнителем сценария
+    cancel_token: Optional[CancellationToken] = None
+
+    def _cancel_requested(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+    def _cancelled_result(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': 'Задача отменена пользователем',
+            'error_type': 'cancelled'
+        }
+
+    def _retry_sleep(self, seconds: float):
+        """Пауза перед повтором, прерываемая отменой задачи"""
+        if self.cancel_token is None:
+            time.sleep(seconds)
+        else:
+            self.cancel_token.wait(seconds)
+
+    async def _retry_sleep_async(self, seconds: float):
+        """Асинхронная пауза перед повтором, прерываемая отменой задачи"""
+        token = self.cancel_token
+        try:
+            with cancel_task_on(token):
+                await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            if token is None or not token.cancelled:
+                raise
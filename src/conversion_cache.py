@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Кэш сконвертированного текста документов
+
+Ключ - SHA-256 содержимого загруженного файла, его формат и версия конвертера,
+поэтому повторная загрузка тех же байтов (под другим task_id или при повторной
+обработке) не запускает конвертацию заново, в том числе медленный путь
+antiword/LibreOffice для .doc. Изменение конвертера (DocumentConverter.CONVERTER_VERSION)
+делает старые записи недоступными, они вытесняются по лимиту размера.
+
+Настройки через переменные окружения:
+    CONVERSION_CACHE_ENABLED - включить кэш (true/false, по умолчанию true)
+    CONVERSION_CACHE_DIR - папка кэша (по умолчанию storage/cache/converted)
+    CONVERSION_CACHE_MAX_MB - максимальный размер кэша в МБ (по умолчанию 256)
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionCache(DiskCache):
+    """Ограниченный по размеру LRU-кэш текста документов"""
+
+    name = 'Кэш конвертации'
+
+    def __init__(self, cache_dir: str, max_size_bytes: int = 256 * 1024 * 1024, enabled: bool = True):
+        super().__init__(cache_dir, max_size_bytes, suffix='.txt', enabled=enabled)
+
+    @staticmethod
+    def make_key(file_hash: str, file_format: str, converter_version: str) -> str:
+        """
+        Формирует ключ кэша
+
+        Args:
+            file_hash: SHA-256 содержимого файла
+            file_format: Расширение файла ('.pdf', '.docx', ...)
+            converter_version: Версия конвертера
+
+        Returns:
+            SHA-256 в hex
+        """
+        payload = f"{file_hash}|{file_format}|{converter_version}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_text(self, key: str) -> Optional[str]:
+        """Сконвертированный текст или None"""
+        if not self.enabled:
+            return None
+        data = self.read_bytes(key)
+        if data is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data.decode('utf-8')
+
+    def set_text(self, key: str, text: str) -> None:
+        """Сохраняет сконвертированный текст"""
+        if self.enabled:
+            self.write_bytes(key, text.encode('utf-8'))
+
+
+_cache: Optional[ConversionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_conversion_cache() -> ConversionCache:
+    """Возвращает кэш конвертации процесса (настройки из переменных окружения)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            project_root = Path(__file__).parent.parent
+            _cache = ConversionCache(
+                cache_dir=os.environ.get('CONVERSION_CACHE_DIR') or str(project_root / 'storage' / 'cache' / 'converted'),
+                max_size_bytes=int(float(os.environ.get('CONVERSION_CACHE_MAX_MB', 256)) * 1024 * 1024),
+                enabled=os.environ.get('CONVERSION_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+            )
+        return _cache
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Базовый дисковый кэш с ограничением размера
+
+Записи хранятся файлами <cache_dir>/<первые 2 символа ключа>/<ключ><suffix>,
+пишутся атомарно (tmp + os.replace), поэтому кэш можно разделять между процессами.
+При превышении лимита удаляются давно не использованные записи (LRU по mtime,
+который обновляется при каждом чтении).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def sha256_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 содержимого файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Ограниченный по размеру LRU-кэш файлов на диске"""
+
+    # Имя кэша для логов
+    name = 'кэш'
+
+    def __init__(self, cache_dir: str, max_size_bytes: int, suffix: str = '.bin', enabled: bool = True):
+        """
+        Args:
+            cache_dir: Папка для файлов кэша
+            max_size_bytes: Максимальный суммарный размер записей
+            suffix: Расширение файлов записей
+            enabled: Включен ли кэш
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.suffix = suffix
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._size_bytes: Optional[int] = None
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    def read_bytes(self, key: str) -> Optional[bytes]:
+        """Содержимое записи или None (промах считается вызывающим кодом через _count)"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # Обновляем время обращения для LRU
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def write_bytes(self, key: str, data: bytes) -> bool:
+        """Атомарно записывает запись и при необходимости освобождает место"""
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️  Не удалось записать в {self.name}: {e}")
+            return False
+
+        self._count('stores')
+        with self._lock:
+            if self._size_bytes is not None:
+                self._size_bytes += len(data)
+            need_eviction = self._size_bytes is None or self._size_bytes > self.max_size_bytes
+        if need_eviction:
+            self.evict()
+        return True
+
+    def remove(self, key: str):
+        """Удаляет запись"""
+        path = self._path(key)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            if self._size_bytes is not None:
+                self._size_bytes = max(0, self._size_bytes - size)
+
+    def evict(self) -> int:
+        """
+        Пересчитывает размер кэша и удаляет давно не использованные записи,
+        пока размер не станет меньше 90% лимита
+
+        Returns:
+            Количество удаленных записей
+        """
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob(f'*/*{self.suffix}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        removed = 0
+        if total > self.max_size_bytes:
+            target = int(self.max_size_bytes * 0.9)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            if removed:
+                logger.info(f"🧹 {self.name}: удалено {removed} записей (размер: {total / 1024 / 1024:.1f} МБ)")
+
+        with self._lock:
+            self._size_bytes = total
+            self._stats['evictions'] += removed
+        return removed
+
+    def clear(self) -> int:
+        """Удаляет все записи кэша"""
+        removed = 0
+        for path in self.cache_dir.glob(f'*/*{self.suffix}'):
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._size_bytes = 0
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий/промахов (в пределах процесса) и размер кэша"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'enabled': self.enabled,
+                **self._stats,
+                'hit_ratio': round(self._stats['hits'] / lookups, 3) if lookups else 0.0,
+                'size_bytes': self._size_bytes,
+                'max_size_bytes': self.max_size_bytes
+            }
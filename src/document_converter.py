@@ -10,6 +10,15 @@ from pathlib import Path
 from typing import Optional
 import mimetypes
 
+sys.path.insert(0, str(Path(__file__).parent))
+
+from conversion_cache import get_conversion_cache
+from disk_cache import sha256_file
+from pdf_extract import extract_pdf_text
+from docx_extract import extract_docx_text
+from excel_extract import extract_xls_text, extract_xlsx_text
+from office_pool import OfficeUnavailable, get_office_pool
+
 
 class DocumentConverter:
     """Конвертирует документы различных форматов в текстовый файл"""
@@ -23,6 +32,13 @@ class DocumentConverter:
         '.txt': 'Text'
     }
     
+    # Версия конвертера для ключа кэша конвертации:
+    # увеличить при любом изменении, влияющем на получаемый текст
+    # 2 - пометки о страницах PDF, не извлеченных за PDF_PAGE_TIMEOUT
+    # 3 - DOCX: таблицы на своих местах в тексте, колонтитулы
+    # 4 - Excel: пустые строки пропускаются, целые числа без ".0", ограничение строк листа
+    CONVERTER_VERSION = '4'
+    
     def __init__(self):
         self.detected_format = None
         
@@ -58,59 +74,21 @@ class DocumentConverter:
     def convert_pdf(self, file_path: str) -> str:
         """Конвертирует PDF в текст"""
         try:
-            import PyPDF2
+            import PyPDF2  # noqa: F401
         except ImportError:
             raise ImportError("Для работы с PDF установите: pip install PyPDF2")
         
-        text_content = []
-        
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                if text.strip():
-                    text_content.append(f"--- Страница {page_num + 1} ---\n")
-                    text_content.append(text)
-                    text_content.append("\n")
-        
-        return "\n".join(text_content)
+        # Большие PDF извлекаются по диапазонам страниц в пуле процессов (см. pdf_extract)
+        return extract_pdf_text(file_path)
     
     def convert_docx(self, file_path: str) -> str:
         """Конвертирует DOCX в текст"""
-        try:
-            from docx import Document
-        except ImportError:
-            raise ImportError("Для работы с DOCX установите: pip install python-docx")
-        
-        doc = Document(file_path)
-        text_content = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_content.append(paragraph.text)
-        
-        # Извлекаем текст из таблиц
-        for table in doc.tables:
-            text_content.append("\n--- Таблица ---\n")
-            for row in table.rows:
-                row_text = []
-                for cell in row.cells:
-                    if cell.text.strip():
-                        row_text.append(cell.text.strip())
-                if row_text:
-                    text_content.append(" | ".join(row_text))
-            text_content.append("\n")
-        
-        return "\n".join(text_content)
+        # Один потоковый проход по XML: абзацы и таблицы в порядке документа (см. docx_extract)
+        return extract_docx_text(file_path)
     
     def convert_doc(self, file_path: str) -> str:
         """Конвертирует DOC (старый формат Word) в текст"""
         import subprocess
-        import tempfile
-        from pathlib import Path
         
         # Пробуем использовать antiword (если установлен)
         try:
@@ -131,33 +109,13 @@ class DocumentConverter:
         except Exception as e:
             print(f"⚠️  Antiword не сработал: {e}")
         
-        # Пробуем использовать LibreOffice (если установлен)
+        # Пробуем использовать LibreOffice (если установлен): постоянно запущенные процессы пула
         try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # Конвертируем DOC в TXT через LibreOffice
-                result = subprocess.run(
-                    [
-                        'libreoffice',
-                        '--headless',
-                        '--convert-to', 'txt',
-                        '--outdir', tmpdir,
-                        file_path
-                    ],
-                    capture_output=True,
-                    timeout=60
-                )
-                
-                if result.returncode == 0:
-                    # Ищем созданный txt файл
-                    input_path = Path(file_path)
-                    txt_file = Path(tmpdir) / f"{input_path.stem}.txt"
-                    if txt_file.exists():
-                        with open(txt_file, 'r', encoding='utf-8', errors='ignore') as f:
-                            return f.read()
-        except FileNotFoundError:
+            return get_office_pool().convert_to_text(file_path)
+        except OfficeUnavailable:
             pass
         except subprocess.TimeoutExpired:
-            pass
+            print("⚠️  LibreOffice не сконвертировал файл за отведенное время")
         except Exception as e:
             print(f"⚠️  LibreOffice не сработал: {e}")
         
@@ -188,70 +146,53 @@ class DocumentConverter:
         )
     
     def convert_xlsx(self, file_path: str) -> str:
-        """Конвертирует XLSX в текст"""
+        """Конвертирует XLSX в текст (потоково, по одному проходу на лист)"""
         try:
-            import pandas as pd
+            import openpyxl
         except ImportError:
-            raise ImportError("Для работы с Excel установите: pip install pandas openpyxl")
+            raise ImportError("Для работы с Excel установите: pip install openpyxl")
         
-        text_content = []
-        excel_file = pd.ExcelFile(file_path)
-        
-        for sheet_name in excel_file.sheet_names:
-            text_content.append(f"\n{'='*60}")
-            text_content.append(f"Лист: {sheet_name}")
-            text_content.append(f"{'='*60}\n")
-            
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            
-            # Заголовки
-            if not df.empty:
-                headers = df.columns.tolist()
-                text_content.append(" | ".join(str(h) for h in headers))
-                text_content.append("-" * 60)
-                
-                # Данные
-                for idx, row in df.iterrows():
-                    row_data = []
-                    for col in headers:
-                        value = row[col]
-                        if pd.notna(value):
-                            row_data.append(str(value))
-                        else:
-                            row_data.append("")
-                    text_content.append(" | ".join(row_data))
-            
-            text_content.append("\n")
-        
-        return "\n".join(text_content)
+        return extract_xlsx_text(file_path)
     
     def convert_xls(self, file_path: str) -> str:
         """Конвертирует XLS (старый формат Excel) в текст"""
-        try:
-            import pandas as pd
-        except ImportError:
-            raise ImportError("Для работы с Excel установите: pip install pandas xlrd")
-        
         # XLS требует xlrd
         try:
             import xlrd
         except ImportError:
             raise ImportError("Для работы с XLS установите: pip install xlrd")
         
-        return self.convert_xlsx(file_path)  # pandas может работать с XLS через xlrd
+        return extract_xls_text(file_path)
     
     def convert_txt(self, file_path: str) -> str:
         """Просто читает текстовый файл"""
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
     
-    def convert(self, input_file: str, output_file: Optional[str] = None) -> str:
+    def _convert_text(self, file_path: str, ext: str) -> str:
+        """Конвертирует файл в текст методом для его формата"""
+        if ext == '.pdf':
+            return self.convert_pdf(file_path)
+        elif ext == '.docx':
+            return self.convert_docx(file_path)
+        elif ext == '.doc':
+            return self.convert_doc(file_path)
+        elif ext == '.xlsx':
+            return self.convert_xlsx(file_path)
+        elif ext == '.xls':
+            return self.convert_xls(file_path)
+        elif ext == '.txt':
+            return self.convert_txt(file_path)
+        raise ValueError(f"Неподдерживаемый формат: {ext}")
+    
+    def convert(self, input_file: str, output_file: Optional[str] = None, use_cache: bool = True) -> str:
         """
         Конвертирует документ в текстовый файл
         
         Args:
             input_file: Путь к входному файлу
             output_file: Путь к выходному файлу (если None, создается автоматически)
+            use_cache: Брать текст из кэша конвертации, если тот же файл уже конвертировался
         
         Returns:
             Путь к созданному текстовому файлу
@@ -264,22 +205,24 @@ class DocumentConverter:
         
         # Выбираем метод конвертации
         ext = self.detected_format
-        
-        if ext == '.pdf':
-            text = self.convert_pdf(str(input_path))
-        elif ext == '.docx':
-            text = self.convert_docx(str(input_path))
-        elif ext == '.doc':
-            text = self.convert_doc(str(input_path))
-        elif ext == '.xlsx':
-            text = self.convert_xlsx(str(input_path))
-        elif ext == '.xls':
-            text = self.convert_xls(str(input_path))
-        elif ext == '.txt':
-            text = self.convert_txt(str(input_path))
-        else:
+        if ext not in self.SUPPORTED_FORMATS:
             raise ValueError(f"Неподдерживаемый формат: {ext}")
         
+        # Те же байты уже конвертировались этой версией конвертера - берем текст из кэша
+        cache = get_conversion_cache() if use_cache else None
+        cache_key = None
+        text = None
+        if cache is not None and cache.enabled:
+            cache_key = cache.make_key(sha256_file(str(input_path)), ext, self.CONVERTER_VERSION)
+            text = cache.get_text(cache_key)
+            if text is not None:
+                print("💾 Текст взят из кэша конвертации")
+        
+        if text is None:
+            text = self._convert_text(str(input_path), ext)
+            if cache_key:
+                cache.set_text(cache_key, text)
+        
         # Определяем имя выходного файла
         if output_file is None:
             output_path = input_path.parent / f"{input_path.stem}_converted.txt"
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Потоковое извлечение текста из DOCX
+
+Один проход iterparse по word/document.xml: абзацы и строки таблиц выдаются в порядке
+документа (таблица остается рядом со своим заголовком), разобранные элементы сразу
+освобождаются, поэтому память не растет с размером документа. Колонтитулы
+(word/header*.xml, word/footer*.xml) добавляются в конце тем же способом.
+Объекты python-docx не создаются.
+"""
+
+import re
+import zipfile
+from typing import Iterator, List
+from xml.etree.ElementTree import iterparse
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_NS = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+
+P, T, TAB, BR, CR = W_NS + 'p', W_NS + 't', W_NS + 'tab', W_NS + 'br', W_NS + 'cr'
+TBL, TR, TC, BODY = W_NS + 'tbl', W_NS + 'tr', W_NS + 'tc', W_NS + 'body'
+# Запасное содержимое (дублирует mc:Choice, например надписи для старых версий Word)
+FALLBACK = MC_NS + 'Fallback'
+
+TABLE_MARKER = "\n--- Таблица ---\n"
+
+
+class _Table:
+    """Состояние разбираемой таблицы: текущая строка и текущая ячейка"""
+
+    def __init__(self):
+        self.row: List[str] = []
+        self.cell: List[str] = []
+
+
+def iter_part_lines(stream) -> Iterator[str]:
+    """
+    Строки текста одной XML части DOCX в порядке документа
+
+    Абзац вне таблицы - одна строка; таблица - маркер TABLE_MARKER, строки
+    "ячейка | ячейка" (пустые строки таблицы пропускаются) и пустая строка после таблицы.
+    """
+    paragraphs: List[List[str]] = []
+    tables: List[_Table] = []
+    skip_depth = 0
+    body = None
+
+    for event, elem in iterparse(stream, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if skip_depth or tag == FALLBACK:
+                skip_depth += 1
+            elif tag == P:
+                paragraphs.append([])
+            elif tag == TBL:
+                if not tables:
+                    yield TABLE_MARKER
+                tables.append(_Table())
+            elif tag == BODY:
+                body = elem
+            continue
+
+        if skip_depth:
+            skip_depth -= 1
+            if tag == FALLBACK:
+                elem.clear()
+            continue
+
+        if tag == T:
+            if paragraphs and elem.text:
+                paragraphs[-1].append(elem.text)
+        elif tag in (TAB, BR, CR):
+            if paragraphs:
+                paragraphs[-1].append('\t' if tag == TAB else '\n')
+        elif tag == P:
+            text = ''.join(paragraphs.pop()).strip() if paragraphs else ''
+            if text:
+                if tables:
+                    tables[-1].cell.append(text)
+                else:
+                    yield text
+            elem.clear()
+        elif tag == TC and tables:
+            table = tables[-1]
+            table.row.append(' '.join(table.cell))
+            table.cell = []
+            elem.clear()
+        elif tag == TR and tables:
+            table = tables[-1]
+            if any(table.row):
+                row_text = " | ".join(table.row)
+                if len(tables) > 1:
+                    # Вложенная таблица - часть текста ячейки внешней таблицы
+                    tables[-2].cell.append(row_text)
+                else:
+                    yield row_text
+            table.row = []
+            elem.clear()
+        elif tag == TBL and tables:
+            tables.pop()
+            if not tables:
+                yield "\n"
+            elem.clear()
+
+        # Разобранные элементы верхнего уровня больше не нужны
+        if body is not None and not paragraphs and not tables and tag in (P, TBL):
+            body.clear()
+
+
+def _part_names(names: List[str], kind: str) -> List[str]:
+    """word/header1.xml, word/header2.xml, ... в порядке номеров"""
+    pattern = re.compile(rf'^word/{kind}(\d*)\.xml$')
+    found = [(int(m.group(1) or 0), name) for name in names for m in [pattern.match(name)] if m]
+    return [name for _, name in sorted(found)]
+
+
+def iter_docx_lines(file_path: str, include_headers: bool = True) -> Iterator[str]:
+    """Строки текста DOCX: основной документ, затем колонтитулы (без повторов)"""
+    with zipfile.ZipFile(file_path) as archive:
+        names = archive.namelist()
+        if 'word/document.xml' not in names:
+            raise ValueError(f"Файл не является документом DOCX: {file_path}")
+        with archive.open('word/document.xml') as stream:
+            yield from iter_part_lines(stream)
+
+        if not include_headers:
+            return
+        for kind, title in (('header', 'Заголовок'), ('footer', 'Подвал')):
+            seen = set()
+            lines: List[str] = []
+            for name in _part_names(names, kind):
+                with archive.open(name) as stream:
+                    part = [line for line in iter_part_lines(stream) if line.strip()]
+                key = '\n'.join(part)
+                if part and key not in seen:
+                    seen.add(key)
+                    lines.extend(part)
+            if lines:
+                yield f"\n--- {title} ---\n"
+                yield from lines
+                yield "\n"
+
+
+def extract_docx_text(file_path: str, include_headers: bool = True) -> str:
+    """Текст DOCX одной строкой (строки разделены переводом строки)"""
+    return "\n".join(iter_docx_lines(file_path, include_headers))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Потоковое извлечение текста из XLSX/XLS
+
+Каждый лист читается один раз строка за строкой: XLSX - openpyxl в режиме read_only
+(лист не загружается в память целиком), XLS - xlrd. Строка собирается одним join,
+пустые строки и хвостовые пустые ячейки пропускаются, число строк и столбцов
+листа ограничено. Формат вывода прежний: заголовок листа, первая строка как
+заголовки столбцов, разделитель, строки "значение | значение".
+
+Настройки через переменные окружения:
+    EXCEL_MAX_ROWS - максимум строк с данными на лист (по умолчанию 5000)
+    EXCEL_MAX_COLS - максимум столбцов (по умолчанию 50)
+    EXCEL_EMPTY_ROWS_STOP - после стольких пустых строк подряд лист считается
+        законченным (по умолчанию 1000; форматирование часто "растягивает" лист
+        до миллиона пустых строк)
+"""
+
+import logging
+import os
+from datetime import date, datetime, time
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SHEET_SEPARATOR = '=' * 60
+HEADER_SEPARATOR = '-' * 60
+
+
+def _settings() -> Tuple[int, int, int]:
+    max_rows = int(os.environ.get('EXCEL_MAX_ROWS', 5000))
+    max_cols = int(os.environ.get('EXCEL_MAX_COLS', 50))
+    empty_rows_stop = int(os.environ.get('EXCEL_EMPTY_ROWS_STOP', 1000))
+    return max_rows, max_cols, empty_rows_stop
+
+
+def _cell_text(value) -> str:
+    """Текст ячейки: целые числа без ".0", даты без нулевого времени, одна строка"""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else str(value)
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == time(0) else value.isoformat(sep=' ')
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return ' '.join(str(value).split())
+
+
+def _row_cells(values: Sequence, max_cols: int) -> List[str]:
+    """Ячейки строки без хвостовых пустых"""
+    cells = [_cell_text(value) for value in values[:max_cols]]
+    while cells and not cells[-1]:
+        cells.pop()
+    return cells
+
+
+def iter_sheet_lines(sheet_name: str, rows: Iterable[Sequence]) -> Iterator[str]:
+    """Строки текста листа из последовательности строк значений"""
+    max_rows, max_cols, empty_rows_stop = _settings()
+
+    yield f"\n{SHEET_SEPARATOR}"
+    yield f"Лист: {sheet_name}"
+    yield f"{SHEET_SEPARATOR}\n"
+
+    header_written = False
+    written = 0
+    empty_run = 0
+    for values in rows:
+        cells = _row_cells(values, max_cols)
+        if not cells:
+            empty_run += 1
+            if empty_run >= empty_rows_stop:
+                break
+            continue
+        empty_run = 0
+
+        if not header_written:
+            yield " | ".join(cells)
+            yield HEADER_SEPARATOR
+            header_written = True
+            continue
+
+        if written >= max_rows:
+            logger.warning(f"⚠️  Excel: лист '{sheet_name}' обрезан до {max_rows} строк")
+            yield f"[Лист обрезан до {max_rows} строк, EXCEL_MAX_ROWS]"
+            break
+        yield " | ".join(cells)
+        written += 1
+
+    yield "\n"
+
+
+def iter_xlsx_lines(file_path: str) -> Iterator[str]:
+    """Строки текста всех листов XLSX (openpyxl, read_only)"""
+    from openpyxl import load_workbook
+
+    _, max_cols, _ = _settings()
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            # Листы диаграмм не имеют ячеек
+            if not hasattr(sheet, 'iter_rows'):
+                continue
+            yield from iter_sheet_lines(sheet.title, sheet.iter_rows(max_col=max_cols, values_only=True))
+    finally:
+        workbook.close()
+
+
+def _xls_rows(sheet, datemode: int) -> Iterator[List]:
+    """Строки листа XLS со значениями дат, преобразованными в datetime"""
+    import xlrd
+
+    _, max_cols, _ = _settings()
+    for row_index in range(sheet.nrows):
+        values = []
+        for cell in sheet.row_slice(row_index, 0, min(sheet.ncols, max_cols)):
+            if cell.ctype == xlrd.XL_CELL_DATE:
+                try:
+                    values.append(xlrd.xldate_as_datetime(cell.value, datemode))
+                    continue
+                except (ValueError, OverflowError):
+                    pass
+            elif cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                values.append(None)
+                continue
+            values.append(cell.value)
+        yield values
+
+
+def iter_xls_lines(file_path: str) -> Iterator[str]:
+    """Строки текста всех листов XLS (xlrd, листы загружаются по одному)"""
+    import xlrd
+
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        for sheet_index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_index)
+            yield from iter_sheet_lines(sheet.name, _xls_rows(sheet, workbook.datemode))
+            workbook.unload_sheet(sheet_index)
+    finally:
+        workbook.release_resources()
+
+
+def extract_xlsx_text(file_path: str) -> str:
+    return "\n".join(iter_xlsx_lines(file_path))
+
+
+def extract_xls_text(file_path: str) -> str:
+    return "\n".join(iter_xls_lines(file_path))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Скомпилированный глоссарий: артефакт, общий для всех процессов обработки
+
+При сохранении глоссария (/glossary/api/save) рядом с glossary.json пишется
+glossary.compiled.json:
+    tree - глоссарий только с параметрами, у которых есть match (то, что идет в промпт);
+    fragment - tree, уже сериализованный для промпта;
+    version - SHA-256 фрагмента (первые 16 символов): меняется только при изменении
+        того, что видит ИИ, и входит в ключи кэшей, зависящих от глоссария;
+    synonyms - плоский индекс {"Раздел > Подраздел > Параметр": [синонимы match]},
+        по нему строится автомат локального извлечения параметров (glossary_prefill);
+    source_hash - SHA-256 исходного glossary.json, по которому собран артефакт.
+
+Процессы загружают артефакт один раз и проверяют только (mtime, размер) файлов;
+при изменении перечитывают его и подменяют, если изменилась version. Если артефакта
+нет или он собран по другой версии glossary.json (файл изменен вручную), глоссарий
+компилируется из исходного файла.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Версия формата артефакта: увеличить, если меняется его состав
+ARTIFACT_FORMAT_VERSION = 1
+ARTIFACT_SUFFIX = '.compiled.json'
+SYNONYM_PATH_SEPARATOR = ' > '
+
+
+def _is_parameter(value: dict) -> bool:
+    return 'match' in value or 'unit' in value
+
+
+def filter_glossary(glossary: dict) -> dict:
+    """
+    Фильтрует глоссарий, оставляя только параметры с match != null
+
+    Args:
+        glossary: Полный глоссарий
+
+    Returns:
+        Оптимизированный глоссарий (только параметры с match)
+    """
+    if not isinstance(glossary, dict):
+        return {}
+
+    filtered = {}
+    for key, value in glossary.items():
+        if not isinstance(value, dict):
+            continue
+        if _is_parameter(value):
+            # Параметр: оставляем только если match не null и не пустой список
+            if value.get('match') not in (None, []):
+                filtered[key] = value
+        else:
+            # Секция: добавляем, только если в ней остались параметры
+            section = filter_glossary(value)
+            if section:
+                filtered[key] = section
+    return filtered
+
+
+def flatten_synonyms(tree: dict) -> Dict[str, List[str]]:
+    """Плоский индекс синонимов: {"Раздел > Подраздел > Параметр": [синонимы match]}"""
+    index = {}
+
+    def walk(node: dict, path: Tuple[str, ...]):
+        for key, value in node.items():
+            if not isinstance(value, dict):
+                continue
+            if _is_parameter(value):
+                index[SYNONYM_PATH_SEPARATOR.join(path + (key,))] = [
+                    synonym for synonym in value.get('match') or [] if isinstance(synonym, str)
+                ]
+            else:
+                walk(value, path + (key,))
+
+    walk(tree, ())
+    return index
+
+
+class GlossaryArtifact:
+    """Скомпилированный глоссарий (неизменяемый, общий для потоков)"""
+
+    def __init__(self, tree: dict, fragment: str, version: str, synonyms: Dict[str, List[str]],
+                 source_hash: Optional[str] = None):
+        self.tree = tree
+        self.fragment = fragment
+        self.version = version
+        self.synonyms = synonyms
+        self.source_hash = source_hash
+
+    def to_dict(self) -> dict:
+        return {
+            'format': ARTIFACT_FORMAT_VERSION,
+            'version': self.version,
+            'source_hash': self.source_hash,
+            'tree': self.tree,
+            'fragment': self.fragment,
+            'synonyms': self.synonyms,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'GlossaryArtifact':
+        return cls(data['tree'], data['fragment'], data['version'], data['synonyms'], data.get('source_hash'))
+
+
+def compile_glossary(glossary: dict, source_hash: Optional[str] = None) -> GlossaryArtifact:
+    """Компилирует глоссарий: фильтрация, сериализация фрагмента промпта, хэш и индекс синонимов"""
+    tree = filter_glossary(glossary)
+    fragment = json.dumps(tree, ensure_ascii=False, indent=2)
+    version = hashlib.sha256(fragment.encode('utf-8')).hexdigest()[:16]
+    return GlossaryArtifact(tree, fragment, version, flatten_synonyms(tree), source_hash)
+
+
+def artifact_path(glossary_file) -> Path:
+    """Путь артефакта рядом с глоссарием: glossary.json -> glossary.compiled.json"""
+    glossary_file = Path(glossary_file)
+    return glossary_file.with_name(glossary_file.stem + ARTIFACT_SUFFIX)
+
+
+def _read_source(glossary_file: Path) -> Tuple[bytes, str]:
+    """(содержимое glossary.json, SHA-256 содержимого)"""
+    if not glossary_file.exists():
+        raise FileNotFoundError(
+            f"Файл glossary.json не найден: {glossary_file}\n"
+            f"Создайте файл glossary.json, запустив конвертер Excel → JSON"
+        )
+    content = glossary_file.read_bytes()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+def _parse_source(content: bytes, glossary_file: Path) -> dict:
+    text = content.decode('utf-8').strip()
+    if not text:
+        raise ValueError(f"Файл glossary.json пустой или содержит только пробелы: {glossary_file}")
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(
+            f"Ошибка парсинга JSON в файле glossary.json: {str(e)}\n"
+            f"Файл: {glossary_file}\n"
+            f"Первые 200 символов: {text[:200]}"
+        )
+
+
+def _read_artifact(path: Path) -> Optional[GlossaryArtifact]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != ARTIFACT_FORMAT_VERSION:
+            return None
+        return GlossaryArtifact.from_dict(data)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"⚠️  Артефакт глоссария не прочитан ({path.name}): {e}")
+        return None
+
+
+def save_glossary_artifact(glossary_file) -> GlossaryArtifact:
+    """
+    Компилирует glossary.json и атомарно записывает артефакт рядом с ним
+
+    Returns:
+        Записанный GlossaryArtifact
+    """
+    glossary_file = Path(glossary_file)
+    content, source_hash = _read_source(glossary_file)
+    artifact = compile_glossary(_parse_source(content, glossary_file), source_hash)
+
+    path = artifact_path(glossary_file)
+    fd, tmp_path = tempfile.mkstemp(prefix=path.name, suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(artifact.to_dict(), f, ensure_ascii=False)
+        os.chmod(tmp_path, 0o664)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    logger.info(f"📘 Глоссарий скомпилирован: версия {artifact.version}, "
+                f"параметров с синонимами: {len(artifact.synonyms)}")
+    return artifact
+
+
+# Загруженные артефакты процесса: {путь glossary.json: (подписи файлов, артефакт)}
+_loaded: Dict[str, Tuple[tuple, GlossaryArtifact]] = {}
+_loaded_lock = threading.Lock()
+
+
+def _signature(path: Path) -> Tuple[int, int]:
+    """(mtime_ns, размер) - меняется при любой перезаписи файла"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (0, -1)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_glossary_artifact(glossary_file) -> GlossaryArtifact:
+    """
+    Скомпилированный глоссарий для glossary.json (загружается один раз на процесс)
+
+    Пока файлы не менялись, возвращается тот же объект; после сохранения глоссария
+    объект подменяется, только если изменилась версия.
+    """
+    glossary_file = Path(glossary_file)
+    path = artifact_path(glossary_file)
+    signature = (_signature(glossary_file), _signature(path))
+    key = str(glossary_file)
+
+    with _loaded_lock:
+        cached = _loaded.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        content, source_hash = _read_source(glossary_file)
+        artifact = _read_artifact(path)
+        if artifact is None or artifact.source_hash != source_hash:
+            # Артефакта нет или glossary.json изменен в обход сохранения в веб-интерфейсе
+            artifact = compile_glossary(_parse_source(content, glossary_file), source_hash)
+
+        if cached is not None and cached[1].version == artifact.version:
+            artifact = cached[1]
+        elif cached is not None:
+            logger.info(f"📘 Глоссарий обновлен: версия {cached[1].version} → {artifact.version}")
+        _loaded[key] = (signature, artifact)
+        return artifact
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Локальное извлечение числовых параметров по глоссарию до запроса к ИИ
+
+Названия параметров шаблона TZ.json и синонимы match из скомпилированного глоссария
+(плоский индекс synonyms, см. glossary_artifact) компилируются
+в один автомат Ахо-Корасик над последовательностями терминов (слова в нижнем
+регистре, обрезанные до 5 символов, без предлогов; "макс." и "максимальный" -
+один термин). Текст документа проходится построчно за один проход автомата.
+После найденного названия в той же строке ищется число с единицей измерения
+параметра ("24 м/мин", "не менее 500 мм", "от 3500 до 5000 об/мин") или единица
+перед значением, как в строке таблицы ("Ход по оси X, мм | 600").
+
+Параметр заполняется ("уверенность": "высокая"), только если:
+    - у параметра есть единица измерения и рядом с названием найдено ровно одно
+      значение с этой единицей;
+    - название или синоним однозначно указывает на один параметр шаблона;
+    - у параметра без синонимов в глоссарии (совпадение только по общему названию,
+      например "Максимальная частота вращения шпинделя") название его подраздела
+      шаблона встречается в той же строке или в CONTEXT_LINES строках перед ней -
+      иначе неясно, к какому узлу станка относится значение;
+    - все упоминания параметра в документе дают одно и то же значение.
+Остальные параметры (и все текстовые) отправляются в ИИ, заполненные - нет.
+
+Включается в сценарии: "prompts": {"main": {"prefill": true, ...}}
+"""
+
+import copy
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from glossary_artifact import SYNONYM_PATH_SEPARATOR
+from tz_compact import UNIT_FIELD, iter_parameters
+
+STEM_LENGTH = 5
+# Окно после названия, в котором ищется значение, символов
+VALUE_WINDOW = 80
+# Строк перед совпадением, в которых ищется название подраздела параметра без синонимов
+CONTEXT_LINES = 20
+PREFILL_COMMENT = 'Извлечено по глоссарию'
+
+TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+STOP_WORDS = {
+    'по', 'на', 'до', 'от', 'из', 'для', 'при', 'или', 'не', 'без', 'под', 'над', 'за', 'во',
+    'со', 'то', 'как', 'что', 'это', 'его', 'ее', 'их', 'так', 'же', 'шт', 'мм',
+}
+# Сокращения в названиях шаблона и полные слова в документах
+ABBREVIATIONS = {'макс': 'макси', 'мин': 'миним', 'кол': 'колич', 'колво': 'колич'}
+# Кириллические буквы осей, похожие на латинские ("по оси Х")
+AXIS_LETTERS = {'х': 'x', 'у': 'y', 'с': 'c', 'в': 'b', 'а': 'a', 'е': 'e'}
+
+# Написания единиц в документах (сравнение без учета регистра)
+UNIT_ALIASES = {
+    'мм': ('мм',),
+    'м/мин': ('м/мин',),
+    'об/мин': ('об/мин', 'мин-1', 'мин⁻¹', 'rpm'),
+    '°': ('°', 'град', 'градусов', 'градуса'),
+    'шт.': ('шт', 'позиций', 'позиции', 'инструментов'),
+    'шт': ('шт', 'позиций', 'позиции', 'инструментов'),
+    'кВт': ('квт',),
+    'кВА': ('ква',),
+    'Бар': ('бар',),
+    'Нм': ('нм', 'н·м', 'н*м', 'н.м'),
+    'кг': ('кг',),
+    'л': ('л', 'литров'),
+}
+
+NUMBER = r'\d+(?:[.,]\d+)?'
+QUALIFIER = r'не\s+менее|не\s+более|не\s+ниже|не\s+выше|до|от|≥|≤|>=|<=|>|<'
+QUALIFIER_WORDS = {'≥': 'не менее', '>=': 'не менее', '>': 'более', '≤': 'не более', '<=': 'не более', '<': 'менее'}
+
+Path = Tuple[str, ...]
+
+
+def tokens(text: str) -> List[Tuple[str, int, int]]:
+    """(термин, начало, конец) для слов строки"""
+    result = []
+    for match in TOKEN_RE.finditer(text.lower().replace('ё', 'е')):
+        word = match.group()
+        if len(word) == 1:
+            word = AXIS_LETTERS.get(word, word)
+            if not ('a' <= word <= 'z' or word.isdigit()):
+                continue
+        elif word in STOP_WORDS:
+            continue
+        word = ABBREVIATIONS.get(word, word)[:STEM_LENGTH]
+        result.append((word, match.start(), match.end()))
+    return result
+
+
+class PhraseMatcher:
+    """Автомат Ахо-Корасик над последовательностями терминов"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Для состояния: (длина фразы, ключи) фраз, заканчивающихся в нем (с учетом суффиксов)
+        self.output: List[List[Tuple[int, frozenset]]] = [[]]
+        self._keys: Dict[Tuple[int, int], set] = {}
+
+    def add(self, phrase: List[str], key) -> None:
+        state = 0
+        for term in phrase:
+            if term not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][term] = len(self.goto) - 1
+            state = self.goto[state][term]
+        self._keys.setdefault((state, len(phrase)), set()).add(key)
+
+    def build(self) -> 'PhraseMatcher':
+        for (state, length), keys in self._keys.items():
+            self.output[state].append((length, frozenset(keys)))
+
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for term, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and term not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(term, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+        return self
+
+    def find(self, terms: List[str]) -> List[Tuple[int, int, frozenset]]:
+        """
+        Непересекающиеся совпадения (первый термин, последний термин + 1, ключи)
+
+        Из пересекающихся совпадений выбирается самое раннее, из начинающихся
+        одинаково - самое длинное.
+        """
+        matches = []
+        state = 0
+        for position, term in enumerate(terms):
+            while state and term not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(term, 0)
+            for length, keys in self.output[state]:
+                matches.append((position + 1 - length, position + 1, keys))
+
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        for match in matches:
+            if not selected or match[0] >= selected[-1][1]:
+                selected.append(match)
+        return selected
+
+
+def _unit_pattern(unit: str) -> Optional[str]:
+    aliases = UNIT_ALIASES.get(unit) or (unit.lower().rstrip('.'),)
+    aliases = [alias for alias in aliases if alias]
+    if not aliases:
+        return None
+    return '(?:' + '|'.join(re.escape(alias) for alias in sorted(aliases, key=len, reverse=True)) + r')(?![\wа-я/])'
+
+
+class ParameterMatcher:
+    """Скомпилированные названия и синонимы параметров шаблона с единицами измерения"""
+
+    def __init__(self, tz_json: Dict, synonyms: Optional[Dict[str, List[str]]] = None):
+        self.matcher = PhraseMatcher()
+        self.value_patterns: Dict[Path, List[re.Pattern]] = {}
+        # Термины подраздела, которые должны быть рядом с совпадением (параметры без синонимов)
+        self.context_terms: Dict[Path, frozenset] = {}
+        synonyms = synonyms or {}
+
+        for path, parameter in iter_parameters(tz_json):
+            unit = parameter.get(UNIT_FIELD)
+            unit_re = _unit_pattern(unit) if unit else None
+            if not unit_re:
+                continue
+            value = rf'(?:(?P<q>{QUALIFIER})\s*)?(?P<a>{NUMBER})(?:\s*(?:-|–|—|\.\.\.|…|до)\s*(?P<b>{NUMBER}))?'
+            self.value_patterns[path] = [
+                # "600 мм", "не менее 500 мм", "от 3500 до 5000 об/мин"
+                re.compile(rf'^[^\d]*?(?<![\w.,]){value}\s*{unit_re}', re.IGNORECASE),
+                # "..., мм | 600" - единица в названии строки таблицы
+                re.compile(rf'^[\s,:(]*{unit_re}[)\s]*[|:–—-]?[\s|]*{value}(?![\d.,]*\s*[^\W\d_])', re.IGNORECASE),
+            ]
+            for phrase in self._phrases(path, synonyms):
+                terms = [term for term, _, _ in tokens(phrase)]
+                if terms:
+                    self.matcher.add(terms, path)
+            if not synonyms.get(SYNONYM_PATH_SEPARATOR.join(path)) and len(path) > 1:
+                self.context_terms[path] = frozenset(term for term, _, _ in tokens(path[-2]))
+        self.matcher.build()
+
+    @staticmethod
+    def _phrases(path: Path, synonyms: Dict[str, List[str]]) -> Iterable[str]:
+        yield path[-1]
+        yield from synonyms.get(SYNONYM_PATH_SEPARATOR.join(path), [])
+
+    def _value(self, path: Path, tail: str) -> Optional[str]:
+        """Значение с единицей параметра в начале хвоста строки (None - нет или несколько)"""
+        for pattern in self.value_patterns[path]:
+            match = pattern.search(tail)
+            if not match:
+                continue
+            if pattern.search(tail[match.end():]):
+                return None
+            first, second = match.group('a'), match.group('b')
+            if second:
+                return f"от {first} до {second}"
+            qualifier = match.group('q')
+            if qualifier:
+                qualifier = ' '.join(qualifier.lower().split())
+                return f"{QUALIFIER_WORDS.get(qualifier, qualifier)} {first}"
+            return first
+        return None
+
+    def scan(self, converted_text: str) -> Dict[Path, List[Tuple[str, int, str]]]:
+        """Найденные значения: {путь параметра: [(значение, номер строки, строка)]}"""
+        found: Dict[Path, List[Tuple[str, int, str]]] = {}
+        # Термины текущей и предыдущих CONTEXT_LINES строк
+        recent = deque(maxlen=CONTEXT_LINES + 1)
+        for number, line in enumerate(converted_text.splitlines(), 1):
+            line_tokens = tokens(line)
+            recent.append({term for term, _, _ in line_tokens})
+            if not line_tokens:
+                continue
+            matches = self.matcher.find([term for term, _, _ in line_tokens])
+            context = None
+            for index, (_, end, keys) in enumerate(matches):
+                if len(keys) != 1:
+                    continue
+                path = next(iter(keys))
+                required = self.context_terms.get(path)
+                if required:
+                    context = context if context is not None else set().union(*recent)
+                    if not required <= context:
+                        continue
+                start = line_tokens[end - 1][2]
+                stop = line_tokens[matches[index + 1][0]][1] if index + 1 < len(matches) else len(line)
+                value = self._value(path, line[start:min(stop, start + VALUE_WINDOW)])
+                if value is not None:
+                    found.setdefault(path, []).append((value, number, line.strip()))
+        return found
+
+
+class PrefillResult:
+    """Результат локального извлечения для документа"""
+
+    def __init__(self, values: Dict[Path, Dict], tz_json: Dict):
+        self.values = values
+        # Шаблон без заполненных параметров - то, что отправляется в ИИ
+        self.tz_json = tz_json
+
+    @property
+    def complete(self) -> bool:
+        return not self.tz_json
+
+
+_matchers: List[Tuple[Dict, Optional[Dict[str, List[str]]], Optional[str], ParameterMatcher]] = []
+_matchers_lock = threading.Lock()
+MATCHERS_CACHED = 4
+
+
+def get_matcher(tz_json: Dict, synonyms: Optional[Dict[str, List[str]]] = None,
+                glossary_version: Optional[str] = None) -> ParameterMatcher:
+    """
+    ParameterMatcher для шаблона и индекса синонимов глоссария (компилируется один раз на процесс)
+
+    Шаблон берется из скомпилированного промпта, который сам пересобирается при изменении
+    файлов, поэтому сверяется по идентичности; синонимы - по версии артефакта
+    (glossary_artifact), если она передана, иначе тоже по идентичности.
+    """
+    with _matchers_lock:
+        for cached_tz, cached_synonyms, cached_version, matcher in _matchers:
+            if cached_tz is tz_json and (cached_synonyms is synonyms
+                                         or (glossary_version and cached_version == glossary_version)):
+                return matcher
+        matcher = ParameterMatcher(tz_json, synonyms)
+        _matchers.insert(0, (tz_json, synonyms, glossary_version, matcher))
+        del _matchers[MATCHERS_CACHED:]
+        return matcher
+
+
+def remove_parameters(tz_json: Dict, paths: Iterable[Path]) -> Dict:
+    """Копия шаблона без указанных параметров (пустые секции удаляются)"""
+    result = copy.deepcopy(tz_json)
+    for path in paths:
+        nodes = [result]
+        for key in path[:-1]:
+            nodes.append(nodes[-1][key])
+        nodes[-1].pop(path[-1], None)
+        for depth in range(len(path) - 1, 0, -1):
+            if nodes[depth]:
+                break
+            nodes[depth - 1].pop(path[depth - 1])
+    return result
+
+
+def prefill_parameters(converted_text: str, tz_json: Dict, synonyms: Optional[Dict[str, List[str]]] = None,
+                       matcher: Optional[ParameterMatcher] = None) -> PrefillResult:
+    """
+    Заполняет параметры, однозначно найденные в тексте документа
+
+    Args:
+        converted_text: Текст документа
+        tz_json: Шаблон (полный или отобранный для документа)
+        synonyms: Синонимы match по путям параметров (GlossaryArtifact.synonyms)
+        matcher: Уже скомпилированный ParameterMatcher (для полного шаблона, см. get_matcher)
+
+    Returns:
+        PrefillResult: заполненные поля параметров по путям и шаблон для ИИ
+    """
+    matcher = matcher or ParameterMatcher(tz_json, synonyms)
+    template_paths = {path for path, _ in iter_parameters(tz_json)}
+    values = {}
+    for path, occurrences in matcher.scan(converted_text).items():
+        if path not in template_paths or len({value for value, _, _ in occurrences}) != 1:
+            continue
+        value, number, line = occurrences[0]
+        values[path] = {
+            'значение': value,
+            'источник': f"строка {number}: {line[:120]}",
+            'уверенность': 'высокая',
+            'комментарий': PREFILL_COMMENT,
+        }
+    return PrefillResult(values, remove_parameters(tz_json, values) if values else tz_json)
+
+
+def prefill_summary(values: Dict[Path, Dict]) -> List[Dict]:
+    """Заполненные параметры списком для статуса задачи (частичный результат до ответа ИИ)"""
+    return [
+        {'параметр': ' > '.join(path), 'значение': fields['значение'], 'источник': fields['источник']}
+        for path, fields in values.items()
+    ]
+
+
+def apply_prefill(answer: Dict, values: Dict[Path, Dict]) -> Dict:
+    """Подставляет заполненные локально параметры в полную структуру ответа"""
+    for path, fields in values.items():
+        node = answer
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        parameter = node.get(path[-1])
+        node[path[-1]] = {**parameter, **fields} if isinstance(parameter, dict) else dict(fields)
+    return answer
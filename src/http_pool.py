@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+Модуль общего пула HTTP-соединений для AI клиентов
+
+Один keep-alive пул на пару (провайдер, прокси) на процесс, общий для всех потоков
+и обоих стеков клиентов (src/ и app/core/ai/). Вместо нового TCP+TLS соединения
+на каждый промпт соединения переиспользуются, а сокеты закрываются при выходе.
+Асинхронные клиенты (httpx.AsyncClient, AsyncOpenAI) привязаны к event loop,
+поэтому их пулы хранятся отдельно для каждого loop.
+
+Синхронные запросы можно прервать из другого потока: внутри abort_on_cancel(token)
+сокеты, которые использует текущий поток, запоминаются (urllib3 - при выдаче
+соединения из пула, httpx - при чтении и записи), и отмена токена делает им
+shutdown. Заблокированный запрос сразу завершается ошибкой соединения, а
+соединение не возвращается в пул.
+
+Настройки через переменные окружения:
+    HTTP_POOL_MAX_CONNECTIONS - максимум соединений в пуле (по умолчанию 20)
+    HTTP_POOL_MAX_KEEPALIVE - максимум простаивающих keep-alive соединений (по умолчанию 10)
+    HTTP_POOL_KEEPALIVE_EXPIRY - время жизни простаивающего соединения, сек (по умолчанию 60)
+    HTTP_POOL_HTTP2 - включить HTTP/2 для OpenAI (true/false, требует пакет h2)
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import socket
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Таймаут 30 минут (1800 секунд) для обработки больших документов
+DEFAULT_TIMEOUT = 1800.0
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_httpx_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_openai_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_sessions: Dict[Tuple[str, Optional[str]], Any] = {}
+_stats: Dict[Tuple[str, Optional[str]], 'PoolStats'] = {}
+# event loop -> {ключ: асинхронный клиент}
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, Any]]' = weakref.WeakKeyDictionary()
+
+
+class PoolStats:
+    """Счетчики запросов и новых соединений пула"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_ratio': round(reused / self.requests, 3) if self.requests else 0.0
+            }
+
+
+class AbortScope:
+    """Сокеты запросов одного потока, закрываемые при отмене"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets: List[Any] = []
+        self.aborted = False
+
+    def attach(self, sock) -> None:
+        if sock is None:
+            return
+        with self._lock:
+            if not self.aborted:
+                if not any(known is sock for known in self._sockets):
+                    self._sockets.append(sock)
+                return
+        # Отмена уже произошла (например, во время установки соединения)
+        _shutdown(sock)
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            _shutdown(sock)
+
+
+def _shutdown(sock) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+_scopes = threading.local()
+
+
+def _attach_socket(sock) -> None:
+    scope = getattr(_scopes, 'current', None)
+    if scope is not None:
+        scope.attach(sock)
+
+
+@contextmanager
+def abort_on_cancel(cancel_token):
+    """
+    Прерывает синхронные HTTP запросы текущего потока при отмене cancel_token
+
+    Callback регистрируется до отправки запроса, поэтому отмена во время установки
+    соединения, отправки промпта или ожидания ответа закрывает сокет сразу.
+    """
+    if cancel_token is None:
+        yield
+        return
+    scope = AbortScope()
+    previous = getattr(_scopes, 'current', None)
+    _scopes.current = scope
+    unregister = cancel_token.register(scope.abort)
+    try:
+        yield
+    finally:
+        unregister()
+        _scopes.current = previous
+
+
+class _AbortableStream:
+    """Поток httpcore, сообщающий свой сокет области отмены текущего потока"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _attach(self):
+        _attach_socket(self._stream.get_extra_info('socket'))
+
+    def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        self._attach()
+        return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        self._attach()
+        self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, *args, **kwargs) -> '_AbortableStream':
+        return _AbortableStream(self._stream.start_tls(*args, **kwargs))
+
+    def get_extra_info(self, info: str) -> Any:
+        return self._stream.get_extra_info(info)
+
+
+class _AbortableBackend:
+    """Сетевой backend httpcore, оборачивающий соединения в _AbortableStream"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def connect_tcp(self, *args, **kwargs) -> _AbortableStream:
+        return _AbortableStream(self._backend.connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs) -> _AbortableStream:
+        return _AbortableStream(self._backend.connect_unix_socket(*args, **kwargs))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+def _make_abortable_httpx(client) -> None:
+    """Подключает _AbortableBackend к пулам httpx.Client (основному и прокси)"""
+    transports = [getattr(client, '_transport', None)] + list(getattr(client, '_mounts', {}).values())
+    for transport in transports:
+        pool = getattr(transport, '_pool', None)
+        backend = getattr(pool, '_network_backend', None)
+        if backend is not None and not isinstance(backend, _AbortableBackend):
+            pool._network_backend = _AbortableBackend(backend)
+
+
+def _abortable_pools():
+    """Классы пулов urllib3, сообщающие сокеты соединений области отмены"""
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def connection_class(base):
+        class AbortableConnection(base):
+            def connect(self):
+                super().connect()
+                _attach_socket(self.sock)
+        return AbortableConnection
+
+    def pool_class(base, connection):
+        class AbortablePool(base):
+            ConnectionCls = connection
+
+            def _get_conn(self, timeout=None):
+                conn = super()._get_conn(timeout)
+                # Переиспользуемое соединение: сокет уже открыт
+                _attach_socket(getattr(conn, 'sock', None))
+                return conn
+        return AbortablePool
+
+    return {
+        'http': pool_class(HTTPConnectionPool, connection_class(HTTPConnection)),
+        'https': pool_class(HTTPSConnectionPool, connection_class(HTTPSConnection)),
+    }
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 включается только если установлен пакет h2"""
+    if os.environ.get('HTTP_POOL_HTTP2', 'false').lower() not in ('true', '1', 'yes'):
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("⚠️  HTTP_POOL_HTTP2 включен, но пакет h2 не установлен (pip install httpx[http2]). Используется HTTP/1.1")
+        return False
+
+
+def _reset_after_fork():
+    """После fork (gunicorn) пулы родительского процесса не используются"""
+    global _pid
+    if os.getpid() != _pid:
+        _pid = os.getpid()
+        _httpx_clients.clear()
+        _openai_clients.clear()
+        _sessions.clear()
+        _stats.clear()
+        _async_clients.clear()
+
+
+def _get_stats(provider: str, proxy: Optional[str]) -> PoolStats:
+    key = (provider, proxy)
+    if key not in _stats:
+        _stats[key] = PoolStats()
+    return _stats[key]
+
+
+def _httpx_client_kwargs(timeout: float, on_request, on_response, **extra) -> Dict[str, Any]:
+    """Общие параметры httpx клиента: лимиты пула, HTTP/2, хуки статистики"""
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=_env_int('HTTP_POOL_MAX_CONNECTIONS', 20),
+        max_keepalive_connections=_env_int('HTTP_POOL_MAX_KEEPALIVE', 10),
+        keepalive_expiry=_env_int('HTTP_POOL_KEEPALIVE_EXPIRY', 60)
+    )
+    return {
+        'timeout': timeout,
+        'limits': limits,
+        'http2': _http2_enabled(),
+        'event_hooks': {'request': [on_request], 'response': [on_response]},
+        **extra
+    }
+
+
+def _create_httpx_client(client_class, proxy: Optional[str], client_kwargs: Dict[str, Any]):
+    """Создает httpx.Client/AsyncClient с учетом прокси"""
+    if proxy:
+        try:
+            return client_class(proxy=proxy, **client_kwargs)
+        except TypeError:
+            # httpx < 0.26 принимает только proxies
+            return client_class(proxies=proxy, **client_kwargs)
+    return client_class(**client_kwargs)
+
+
+def get_httpx_client(provider: str = 'openai', proxy: Optional[str] = None,
+                     timeout: float = DEFAULT_TIMEOUT):
+    """
+    Возвращает общий httpx.Client для провайдера и прокси
+
+    Args:
+        provider: Имя провайдера (ключ пула)
+        proxy: URL прокси (опционально)
+        timeout: Таймаут запросов по умолчанию
+
+    Returns:
+        httpx.Client с keep-alive пулом
+    """
+    import httpx
+
+    key = (provider, proxy)
+    with _lock:
+        _reset_after_fork()
+        client = _httpx_clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        stats = _get_stats(provider, proxy)
+
+        def trace(event_name: str, info: dict):
+            # Событие httpcore при установке нового TCP соединения
+            if event_name == 'connection.connect_tcp.complete':
+                stats.add_connection()
+
+        def on_request(request):
+            request.extensions['trace'] = trace
+
+        def on_response(response):
+            stats.add_request()
+
+        client_kwargs = _httpx_client_kwargs(timeout, on_request, on_response)
+        client = _create_httpx_client(httpx.Client, proxy, client_kwargs)
+        _make_abortable_httpx(client)
+
+        _httpx_clients[key] = client
+        logger.info(f"🔌 Создан пул HTTP-соединений: {provider}"
+                    f"{' через прокси' if proxy else ''} (http2: {client_kwargs['http2']})")
+        return client
+
+
+def get_openai_client(api_key: str, proxy: Optional[str] = None):
+    """
+    Возвращает общий openai.OpenAI поверх пула соединений
+
+    Args:
+        api_key: API ключ OpenAI
+        proxy: URL прокси (опционально)
+    """
+    import openai
+
+    http_client = get_httpx_client('openai', proxy)
+    key = (api_key, proxy)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None or getattr(client, '_client', http_client) is not http_client:
+            client = openai.OpenAI(api_key=api_key, http_client=http_client)
+            _openai_clients[key] = client
+        return client
+
+
+def get_requests_session(provider: str = 'jayflow', proxy: Optional[str] = None):
+    """
+    Возвращает общую requests.Session с пулом соединений для провайдера
+
+    Args:
+        provider: Имя провайдера (ключ пула)
+        proxy: URL прокси (опционально)
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    key = (provider, proxy)
+    with _lock:
+        _reset_after_fork()
+        session = _sessions.get(key)
+        if session is not None:
+            return session
+
+        stats = _get_stats(provider, proxy)
+        pool_size = _env_int('HTTP_POOL_MAX_CONNECTIONS', 20)
+        pool_classes = _abortable_pools()
+
+        class AbortableAdapter(HTTPAdapter):
+            """Пулы соединений (в том числе через прокси) с поддержкой abort_on_cancel"""
+
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = pool_classes
+
+            def proxy_manager_for(self, *args, **kwargs):
+                manager = super().proxy_manager_for(*args, **kwargs)
+                manager.pool_classes_by_scheme = pool_classes
+                return manager
+
+        adapter = AbortableAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if proxy:
+            session.proxies.update({'http': proxy, 'https': proxy})
+        session.hooks['response'].append(lambda response, *args, **kwargs: stats.add_request())
+        session._pool_adapter = adapter
+
+        _sessions[key] = session
+        logger.info(f"🔌 Создан пул HTTP-соединений: {provider}{' через прокси' if proxy else ''}")
+        return session
+
+
+def _loop_clients() -> Dict[tuple, Any]:
+    """Асинхронные клиенты текущего event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _reset_after_fork()
+        clients = _async_clients.get(loop)
+        if clients is None:
+            clients = {}
+            _async_clients[loop] = clients
+        return clients
+
+
+def get_async_httpx_client(provider: str = 'openai', proxy: Optional[str] = None,
+                           verify: bool = True, timeout: float = DEFAULT_TIMEOUT):
+    """
+    Возвращает общий httpx.AsyncClient для провайдера в текущем event loop
+
+    Args:
+        provider: Имя провайдера (ключ пула)
+        proxy: URL прокси (опционально)
+        verify: Проверять SSL сертификат
+        timeout: Таймаут запросов по умолчанию
+
+    Returns:
+        httpx.AsyncClient с keep-alive пулом
+    """
+    import httpx
+
+    clients = _loop_clients()
+    key = ('httpx', provider, proxy, verify)
+    client = clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+
+    with _lock:
+        stats = _get_stats(provider, proxy)
+
+    async def trace(event_name: str, info: dict):
+        if event_name == 'connection.connect_tcp.complete':
+            stats.add_connection()
+
+    async def on_request(request):
+        request.extensions['trace'] = trace
+
+    async def on_response(response):
+        stats.add_request()
+
+    client_kwargs = _httpx_client_kwargs(timeout, on_request, on_response, verify=verify)
+    client = _create_httpx_client(httpx.AsyncClient, proxy, client_kwargs)
+    clients[key] = client
+    logger.info(f"🔌 Создан асинхронный пул HTTP-соединений: {provider}"
+                f"{' через прокси' if proxy else ''} (http2: {client_kwargs['http2']})")
+    return client
+
+
+def get_async_openai_client(api_key: str, proxy: Optional[str] = None):
+    """
+    Возвращает общий openai.AsyncOpenAI поверх асинхронного пула текущего event loop
+
+    Args:
+        api_key: API ключ OpenAI
+        proxy: URL прокси (опционально)
+    """
+    import openai
+
+    http_client = get_async_httpx_client('openai', proxy)
+    clients = _loop_clients()
+    key = ('openai', api_key, proxy)
+    client = clients.get(key)
+    if client is None or getattr(client, '_client', http_client) is not http_client:
+        client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client)
+        clients[key] = client
+    return client
+
+
+async def aclose_async_clients():
+    """Закрывает асинхронные пулы текущего event loop (вызывать перед закрытием loop)"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.pop(loop, {})
+    for key, client in clients.items():
+        if key[0] != 'httpx':
+            continue
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+def _session_connections(session) -> int:
+    """Количество соединений, открытых urllib3 пулами сессии"""
+    adapter = getattr(session, '_pool_adapter', None)
+    if adapter is None:
+        return 0
+    total = 0
+    try:
+        pools = adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool is not None:
+                total += getattr(pool, 'num_connections', 0)
+    except Exception:
+        pass
+    return total
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Статистика переиспользования соединений по пулам
+
+    Returns:
+        {'<provider>[@proxy]': {'requests', 'new_connections', 'reused_connections', 'reuse_ratio'}}
+    """
+    with _lock:
+        for key, session in _sessions.items():
+            stats = _get_stats(*key)
+            with stats._lock:
+                stats.new_connections = _session_connections(session)
+
+        result = {}
+        for (provider, proxy), stats in _stats.items():
+            name = f"{provider}@proxy" if proxy else provider
+            result[name] = stats.as_dict()
+        return result
+
+
+def close_all():
+    """Закрывает все пулы соединений"""
+    with _lock:
+        for client in _httpx_clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        _httpx_clients.clear()
+        _openai_clients.clear()
+        _sessions.clear()
+
+
+atexit.register(close_all)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Потоковое получение ответов ИИ
+
+Клиенты OpenAI читают ответ по мере генерации (stream=True): число полученных
+токенов передается в callback прогресса (исполнитель сценария пишет его в
+ProcessingStatus), а зависший запрос обнаруживается по отсутствию данных, а не по
+общему таймауту в 30 минут.
+
+Таймаутов два: до первого токена ответа reasoning-модель может долго думать молча,
+поэтому ожидание первого токена ограничено отдельным LLM_STREAM_FIRST_TOKEN_TIMEOUT;
+после него пауза между порциями ограничена LLM_STREAM_IDLE_TIMEOUT. Read timeout HTTP
+клиента равен большему из них, меньший соблюдается сторожем потока (синхронный
+клиент) или ожиданием очередного чанка (асинхронный). Зависание повторяется редко и с
+паузой (политика stream_stalled): каждый повтор заново оплачивает весь промпт.
+
+Настройки через переменные окружения:
+    LLM_STREAMING - потоковый режим (true/false, по умолчанию true)
+    LLM_STREAM_FIRST_TOKEN_TIMEOUT - сколько секунд ждать первый токен ответа (по умолчанию 900)
+    LLM_STREAM_IDLE_TIMEOUT - сколько секунд ждать очередную порцию ответа после первого
+                              токена (по умолчанию 180)
+    LLM_STREAM_PROGRESS_INTERVAL - минимальный интервал обновления прогресса, сек (по умолчанию 1)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+from cancellation import CancellationToken, TaskCancelled
+
+logger = logging.getLogger(__name__)
+
+# Callback прогресса: получает число принятых токенов ответа
+ProgressCallback = Callable[[int], None]
+
+
+class StreamStalled(Exception):
+    """Поток ответа не присылал данных дольше таймаута (первого токена или idle)"""
+
+    def __init__(self, idle_timeout: float, tokens: int = 0):
+        if tokens:
+            message = f"нет данных {idle_timeout:.0f} сек (получено токенов: {tokens})"
+        else:
+            message = f"нет первого токена ответа за {idle_timeout:.0f} сек"
+        super().__init__(message)
+        self.idle_timeout = idle_timeout
+        self.tokens = tokens
+
+
+class StreamProgress:
+    """Счетчик принятых токенов с ограничением частоты обновлений прогресса"""
+
+    def __init__(self, on_progress: Optional[ProgressCallback] = None, interval: Optional[float] = None):
+        """
+        Args:
+            on_progress: Callback прогресса (None - только подсчет)
+            interval: Минимальный интервал между вызовами callback, сек
+        """
+        if interval is None:
+            interval = float(os.environ.get('LLM_STREAM_PROGRESS_INTERVAL', 1))
+        self.on_progress = on_progress
+        self.interval = interval
+        self.tokens = 0
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self._reported_at = 0.0
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def add(self, tokens: int = 1):
+        """Учитывает принятые токены и при необходимости сообщает прогресс"""
+        now = time.monotonic()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            logger.info(f"⚡ Первый токен ответа через {now - self.started_at:.1f} сек")
+        self.tokens += tokens
+        if now - self._reported_at >= self.interval:
+            self._reported_at = now
+            self._report()
+
+    def finish(self, total_tokens: Optional[int] = None):
+        """Итоговое обновление прогресса (total_tokens - точное число из usage)"""
+        if total_tokens:
+            self.tokens = total_tokens
+        self._report()
+
+    def _report(self):
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(self.tokens)
+        except Exception as e:
+            logger.warning(f"⚠️  Ошибка обновления прогресса потока: {e}")
+
+
+class _ChatStreamAccumulator:
+    """Собирает чанки chat.completions в объект, совместимый с обычным ответом"""
+
+    def __init__(self, progress: StreamProgress):
+        self.progress = progress
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+        self.model = None
+
+    def add(self, chunk):
+        self.model = getattr(chunk, 'model', None) or self.model
+        # При stream_options.include_usage последний чанк содержит usage без choices
+        if getattr(chunk, 'usage', None):
+            self.usage = chunk.usage
+        for choice in chunk.choices or []:
+            if getattr(choice, 'index', 0) != 0:
+                continue
+            content = getattr(choice.delta, 'content', None) if choice.delta else None
+            if content:
+                self.parts.append(content)
+                # OpenAI присылает примерно по одному токену в чанке
+                self.progress.add(1)
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+
+    def response(self):
+        """Ответ в форме ChatCompletion (choices[0].message.content, finish_reason, usage)"""
+        self.progress.finish(self.usage.completion_tokens if self.usage else None)
+        message = SimpleNamespace(role='assistant', content=''.join(self.parts) or None)
+        choice = SimpleNamespace(index=0, message=message, finish_reason=self.finish_reason)
+        return SimpleNamespace(model=self.model, choices=[choice], usage=self.usage)
+
+
+def _is_timeout(error: Exception) -> bool:
+    import httpx
+    import openai
+    return isinstance(error, (openai.APITimeoutError, httpx.TimeoutException))
+
+
+def _phase_timeout(progress: StreamProgress, idle_timeout: float, first_token_timeout: Optional[float]) -> float:
+    """Допустимая пауза сейчас: до первого токена - first_token_timeout, после - idle_timeout"""
+    if progress.first_token_at is None and first_token_timeout:
+        return first_token_timeout
+    return idle_timeout
+
+
+class _StallWatchdog:
+    """
+    Сторож синхронного потока: закрывает stream, если данных нет дольше таймаута фазы
+
+    Read timeout HTTP клиента один на весь запрос (больший из двух), поэтому меньший
+    таймаут текущей фазы соблюдается отдельным потоком.
+    """
+
+    def __init__(self, stream, progress: StreamProgress, idle_timeout: float, first_token_timeout: Optional[float]):
+        self.stream = stream
+        self.progress = progress
+        self.idle_timeout = idle_timeout
+        self.first_token_timeout = first_token_timeout
+        self.stalled_after: Optional[float] = None
+        self._last = time.monotonic()
+        self._first_token_seen = False
+        self._done = False
+        # Будит сторожа при остановке и при смене фазы (пришел первый токен - таймаут короче)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='llm-stream-watchdog', daemon=True)
+        self._thread.start()
+
+    def touch(self):
+        """Отмечает полученный чанк (вызывать после учета чанка в StreamProgress)"""
+        self._last = time.monotonic()
+        if not self._first_token_seen and self.progress.first_token_at is not None:
+            self._first_token_seen = True
+            self._wake.set()
+
+    def stop(self):
+        self._done = True
+        self._wake.set()
+
+    def _run(self):
+        while not self._done:
+            timeout = _phase_timeout(self.progress, self.idle_timeout, self.first_token_timeout)
+            remaining = self._last + timeout - time.monotonic()
+            if remaining <= 0:
+                self.stalled_after = timeout
+                try:
+                    self.stream.close()
+                except Exception as e:
+                    logger.debug(f"Ошибка закрытия зависшего потока: {e}")
+                return
+            self._wake.wait(remaining)
+            self._wake.clear()
+
+
+def stream_chat_completion(client, progress: StreamProgress, idle_timeout: float,
+                           cancel_token: Optional[CancellationToken] = None,
+                           first_token_timeout: Optional[float] = None, **request):
+    """
+    Выполняет chat.completions.create(stream=True) и собирает ответ
+
+    При отмене cancel_token поток ответа закрывается из потока наблюдателя,
+    не дожидаясь окончания генерации.
+
+    Returns:
+        Объект ответа с полями choices и usage (как у обычного ChatCompletion)
+
+    Raises:
+        StreamStalled: Нет первого токена дольше first_token_timeout или данных дольше idle_timeout
+        TaskCancelled: Задача отменена
+    """
+    acc = _ChatStreamAccumulator(progress)
+    read_timeout = max(idle_timeout, first_token_timeout or 0)
+    watchdog = None
+    try:
+        stream = client.chat.completions.create(
+            stream=True,
+            stream_options={'include_usage': True},
+            timeout=stream_timeout(read_timeout),
+            **request
+        )
+        unregister = cancel_token.register(stream.close) if cancel_token else None
+        if read_timeout > idle_timeout:
+            watchdog = _StallWatchdog(stream, progress, idle_timeout, first_token_timeout)
+        try:
+            for chunk in stream:
+                if cancel_token and cancel_token.cancelled:
+                    break
+                acc.add(chunk)
+                if watchdog:
+                    watchdog.touch()
+        finally:
+            if watchdog:
+                watchdog.stop()
+            if unregister:
+                unregister()
+            stream.close()
+    except Exception as e:
+        if cancel_token and cancel_token.cancelled:
+            raise TaskCancelled('Задача отменена пользователем') from e
+        if watchdog and watchdog.stalled_after:
+            raise StreamStalled(watchdog.stalled_after, progress.tokens) from e
+        if _is_timeout(e):
+            raise StreamStalled(_phase_timeout(progress, idle_timeout, first_token_timeout), progress.tokens) from e
+        raise
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+    if watchdog and watchdog.stalled_after:
+        # Закрытый сторожем поток может завершить итерацию без исключения
+        raise StreamStalled(watchdog.stalled_after, progress.tokens)
+    return acc.response()
+
+
+async def astream_chat_completion(client, progress: StreamProgress, idle_timeout: float,
+                                  first_token_timeout: Optional[float] = None, **request):
+    """
+    Асинхронный вариант stream_chat_completion (client - openai.AsyncOpenAI)
+
+    Отмена - через отмену корутины (cancellation.cancel_task_on), stream закрывается в finally.
+    Таймаут текущей фазы соблюдается ожиданием очередного чанка (asyncio.wait_for).
+    """
+    acc = _ChatStreamAccumulator(progress)
+    read_timeout = max(idle_timeout, first_token_timeout or 0)
+    try:
+        stream = await client.chat.completions.create(
+            stream=True,
+            stream_options={'include_usage': True},
+            timeout=stream_timeout(read_timeout),
+            **request
+        )
+        try:
+            chunks = stream.__aiter__()
+            while True:
+                timeout = _phase_timeout(progress, idle_timeout, first_token_timeout)
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError as e:
+                    raise StreamStalled(timeout, progress.tokens) from e
+                acc.add(chunk)
+        finally:
+            await stream.close()
+    except StreamStalled:
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            raise StreamStalled(_phase_timeout(progress, idle_timeout, first_token_timeout), progress.tokens) from e
+        raise
+    return acc.response()
+
+
+def stream_timeout(idle_timeout: float):
+    """Таймауты httpx: read - максимальная пауза между порциями данных"""
+    import httpx
+    return httpx.Timeout(connect=30.0, read=idle_timeout, write=120.0, pool=60.0)
+
+
+class StreamingMixin:
+    """Настройки потокового режима для AI клиентов"""
+
+    def _streaming_enabled(self) -> bool:
+        return os.environ.get('LLM_STREAMING', 'true').lower() in ('true', '1', 'yes')
+
+    def _stream_idle_timeout(self) -> float:
+        return float(os.environ.get('LLM_STREAM_IDLE_TIMEOUT', 180))
+
+    def _stream_first_token_timeout(self) -> float:
+        return float(os.environ.get('LLM_STREAM_FIRST_TOKEN_TIMEOUT', 900))
+
+    def _stalled_result(self, e: StreamStalled) -> Dict[str, Any]:
+        """Результат для зависшего потока (повторяется по политике stream_stalled)"""
+        logger.warning(f"⏱️  Поток ответа ИИ завис: {e}")
+        setting = 'LLM_STREAM_IDLE_TIMEOUT' if e.tokens else 'LLM_STREAM_FIRST_TOKEN_TIMEOUT'
+        return {
+            'success': False,
+            'error': (
+                f'Ответ ИИ перестал поступать: {e}.\n'
+                f'Запрос прерван по таймауту ({setting}).'
+            ),
+            'error_type': 'stream_stalled'
+        }
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Пул постоянно запущенных LibreOffice для конвертации старых .doc
+
+Вместо запуска "libreoffice --convert-to" на каждый файл (холодный старт в несколько
+секунд, а параллельные запуски конфликтуют на общем профиле пользователя) пул держит
+несколько headless-процессов soffice, каждый со своим профилем и портом, и передает
+им документы через UNO. Число слотов ограничивает параллельность; перед выдачей
+слот проверяется (процесс жив, порт принимает соединения), после
+OFFICE_MAX_CONVERSIONS конвертаций или ошибки процесс перезапускается. Зависшая
+конвертация прерывается по таймауту убийством процесса слота.
+
+Модуль uno ставится для системного Python (пакет python3-uno) и из обычного venv
+не импортируется. Чтобы пул работал через UNO, venv создается от системного
+python3 с доступом к его пакетам (python3 -m venv --system-site-packages venv, так
+делает scripts/fresh_install.sh) или каталог с uno.py указывается в OFFICE_UNO_PATH.
+Версия Python venv должна совпадать с той, для которой собран pyuno.
+
+Если модуль uno все же недоступен, слоты конвертируют отдельным запуском soffice, но
+со своим постоянным профилем: сохраняются ограничение параллельности и отсутствие
+конфликтов профиля, а профиль не создается заново при каждом запуске (холодный
+старт LibreOffice остается на каждом файле).
+
+Настройки через переменные окружения:
+    OFFICE_POOL_SIZE - число слотов (процессов LibreOffice), по умолчанию 2
+    OFFICE_MAX_CONVERSIONS - перезапуск процесса после стольких конвертаций (по умолчанию 50)
+    OFFICE_CONVERT_TIMEOUT - таймаут конвертации одного файла, сек (по умолчанию 60)
+    OFFICE_START_TIMEOUT - ожидание готовности процесса при запуске, сек (по умолчанию 30)
+    OFFICE_BINARY - путь к soffice (по умолчанию ищется soffice/libreoffice в PATH)
+    OFFICE_PROFILE_DIR - папка профилей слотов (по умолчанию <tmp>/ai_manager_office)
+    OFFICE_UNO_PATH - каталоги с модулем uno через ":" (например /usr/lib/python3/dist-packages),
+                      добавляются в конец sys.path, если uno не импортируется
+"""
+
+import atexit
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TEXT_FILTER = 'Text (encoded)'
+TEXT_FILTER_OPTIONS = 'UTF8'
+
+
+class OfficeUnavailable(RuntimeError):
+    """LibreOffice не установлен"""
+
+
+def _find_binary() -> Optional[str]:
+    configured = os.environ.get('OFFICE_BINARY')
+    if configured:
+        return configured
+    return shutil.which('soffice') or shutil.which('libreoffice')
+
+
+def _uno_available() -> bool:
+    try:
+        import uno  # noqa: F401
+        return True
+    except ImportError:
+        pass
+
+    # Каталоги добавляются в конец sys.path: пакеты venv остаются в приоритете
+    extra = [path for path in os.environ.get('OFFICE_UNO_PATH', '').split(os.pathsep)
+             if path and path not in sys.path]
+    if not extra:
+        return False
+    sys.path.extend(extra)
+    try:
+        import uno  # noqa: F401,F811
+        return True
+    except ImportError as e:
+        logger.warning(f"⚠️  Модуль uno не импортируется из OFFICE_UNO_PATH: {e}")
+        return False
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _property(name: str, value):
+    from com.sun.star.beans import PropertyValue
+    return PropertyValue(Name=name, Value=value)
+
+
+class OfficeSlot:
+    """Один процесс LibreOffice со своим профилем"""
+
+    def __init__(self, index: int, binary: str, profile_dir: Path, use_uno: bool,
+                 start_timeout: float = 30):
+        self.index = index
+        self.binary = binary
+        self.profile_dir = profile_dir
+        self.use_uno = use_uno
+        self.start_timeout = start_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.port: Optional[int] = None
+        self.desktop = None
+        self.conversions = 0
+
+    @property
+    def _profile_arg(self) -> str:
+        return f"-env:UserInstallation={self.profile_dir.resolve().as_uri()}"
+
+    def is_healthy(self) -> bool:
+        """Процесс жив и принимает соединения (для режима без UNO - всегда True)"""
+        if not self.use_uno:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=2):
+                return True
+        except OSError:
+            return False
+
+    def start(self) -> None:
+        """Запускает soffice в режиме слушателя и подключается к нему через UNO"""
+        self.conversions = 0
+        if not self.use_uno:
+            return
+        import uno
+
+        self.port = _free_port()
+        self.process = subprocess.Popen(
+            [
+                self.binary, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+                '--nolockcheck', self._profile_arg,
+                f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # Своя группа процессов: soffice - обертка, убивать нужно и soffice.bin
+            start_new_session=True
+        )
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        url = f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                context = resolver.resolve(url)
+                self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.kill()
+                    raise RuntimeError(f"LibreOffice (слот {self.index}) не запустился за {self.start_timeout:.0f} сек")
+                time.sleep(0.25)
+
+        logger.info(f"📝 LibreOffice слот {self.index} запущен (порт {self.port})")
+
+    def kill(self) -> None:
+        """Завершает процесс слота (вместе с дочерним soffice.bin)"""
+        self.desktop = None
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+        process.wait()
+
+    def restart(self) -> None:
+        self.kill()
+        self.start()
+
+    def convert(self, file_path: str, output_path: str, timeout: float) -> None:
+        """Конвертирует документ в текстовый файл UTF-8"""
+        self.conversions += 1
+        if not self.use_uno:
+            self._convert_subprocess(file_path, output_path, timeout)
+            return
+
+        import uno
+
+        # UNO-вызов нельзя прервать: по таймауту убиваем процесс, вызов завершится ошибкой
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            self.kill()
+
+        watchdog = threading.Timer(timeout, on_timeout)
+        watchdog.start()
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(str(Path(file_path).resolve())), '_blank', 0,
+                (_property('Hidden', True), _property('ReadOnly', True))
+            )
+            if document is None:
+                raise RuntimeError("LibreOffice не открыл документ")
+            try:
+                document.storeToURL(
+                    uno.systemPathToFileUrl(str(Path(output_path).resolve())),
+                    (_property('FilterName', TEXT_FILTER), _property('FilterOptions', TEXT_FILTER_OPTIONS))
+                )
+            finally:
+                document.close(True)
+        except Exception as e:
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(self.binary, timeout)
+            raise RuntimeError(f"LibreOffice: {e}") from e
+        finally:
+            watchdog.cancel()
+
+    def _convert_subprocess(self, file_path: str, output_path: str, timeout: float) -> None:
+        out_dir = Path(output_path).parent
+        subprocess.run(
+            [
+                self.binary, '--headless', '--norestore', '--nolockcheck', self._profile_arg,
+                '--convert-to', f"txt:{TEXT_FILTER}:{TEXT_FILTER_OPTIONS}", '--outdir', str(out_dir), file_path
+            ],
+            capture_output=True,
+            timeout=timeout,
+            check=True
+        )
+        produced = out_dir / f"{Path(file_path).stem}.txt"
+        if produced != Path(output_path):
+            produced.replace(output_path)
+
+
+class OfficePool:
+    """Ограниченный пул слотов LibreOffice"""
+
+    def __init__(self, size: int = 2, max_conversions: int = 50, convert_timeout: float = 60,
+                 start_timeout: float = 30, binary: Optional[str] = None, profile_root: Optional[str] = None):
+        self.binary = binary or _find_binary()
+        self.max_conversions = max_conversions
+        self.convert_timeout = convert_timeout
+        self.use_uno = _uno_available()
+        # Профили уникальны для процесса: пул может существовать в нескольких процессах
+        root = Path(profile_root or Path(tempfile.gettempdir()) / 'ai_manager_office')
+        self.profile_dir = root / f"pool-{os.getpid()}"
+
+        self._slots: List[OfficeSlot] = [
+            OfficeSlot(index, self.binary, self.profile_dir / f"slot{index}", self.use_uno, start_timeout)
+            for index in range(max(1, size))
+        ]
+        self._idle: 'queue.Queue[OfficeSlot]' = queue.Queue()
+        for slot in self._slots:
+            self._idle.put(slot)
+
+        if self.binary and not self.use_uno:
+            logger.warning("⚠️  Модуль uno недоступен: LibreOffice запускается на каждый файл с постоянным профилем "
+                           "слота. Установите python3-uno и создайте venv с --system-site-packages "
+                           "(или укажите OFFICE_UNO_PATH)")
+
+    @property
+    def available(self) -> bool:
+        return bool(self.binary)
+
+    def convert_to_text(self, file_path: str) -> str:
+        """
+        Конвертирует документ в текст через свободный слот
+
+        Raises:
+            OfficeUnavailable: LibreOffice не установлен
+            subprocess.TimeoutExpired: превышен OFFICE_CONVERT_TIMEOUT
+            RuntimeError: ошибка конвертации
+        """
+        if not self.available:
+            raise OfficeUnavailable("LibreOffice не найден (soffice/libreoffice)")
+
+        slot = self._idle.get()
+        try:
+            if not slot.is_healthy() or slot.conversions >= self.max_conversions:
+                if slot.process is not None:
+                    logger.info(f"🔄 LibreOffice слот {slot.index}: перезапуск после {slot.conversions} конвертаций")
+                slot.restart()
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                output_path = Path(tmp_dir) / f"{Path(file_path).stem}.txt"
+                try:
+                    slot.convert(file_path, str(output_path), self.convert_timeout)
+                except Exception:
+                    # Процесс мог остаться в неизвестном состоянии - следующий вызов перезапустит его
+                    slot.kill()
+                    raise
+                with open(output_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    return f.read()
+        finally:
+            self._idle.put(slot)
+
+    def shutdown(self) -> None:
+        """Останавливает все процессы и удаляет профили"""
+        for slot in self._slots:
+            slot.kill()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+_pool: Optional[OfficePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_office_pool() -> OfficePool:
+    """Возвращает пул LibreOffice процесса (настройки из переменных окружения)"""
+    global _pool
+    with _pool_lock:
+        # После fork дочерний процесс создает свой пул (процессы слотов принадлежат родителю)
+        if _pool is None or _pool.profile_dir.name != f"pool-{os.getpid()}":
+            _pool = OfficePool(
+                size=int(os.environ.get('OFFICE_POOL_SIZE', 2)),
+                max_conversions=int(os.environ.get('OFFICE_MAX_CONVERSIONS', 50)),
+                convert_timeout=float(os.environ.get('OFFICE_CONVERT_TIMEOUT', 60)),
+                start_timeout=float(os.environ.get('OFFICE_START_TIMEOUT', 30)),
+                profile_root=os.environ.get('OFFICE_PROFILE_DIR') or None
+            )
+            if multiprocessing.parent_process() is not None:
+                # Процессы multiprocessing завершаются без atexit - только через финализаторы
+                multiprocessing.util.Finalize(None, shutdown_office_pool, exitpriority=10)
+        return _pool
+
+
+def shutdown_office_pool() -> None:
+    """Останавливает пул текущего процесса"""
+    with _pool_lock:
+        if _pool is not None and _pool.profile_dir.name == f"pool-{os.getpid()}":
+            _pool.shutdown()
+
+
+atexit.register(shutdown_office_pool)
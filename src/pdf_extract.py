@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Постраничное извлечение текста из PDF в пуле процессов
+
+Большой PDF делится на диапазоны страниц, которые извлекаются параллельно отдельными
+процессами (PyPDF2 - чистый Python, потоки не дали бы выигрыша из-за GIL), и собираются
+в исходном порядке с маркерами "--- Страница N ---". Каждая страница ограничена
+таймаутом: зависшая страница заменяется пометкой, а документ конвертируется дальше.
+
+Таймаут страницы работает через SIGALRM и поэтому соблюдается в процессе-воркере
+(задача пула выполняется в его основном потоке). Веб-сервер вызывает конвертер из
+рабочих потоков, поэтому из них даже небольшой документ извлекается в отдельном
+процессе. Процессы запускаются через forkserver (или spawn): fork многопоточного
+сервера может унаследовать захваченные другими потоками блокировки и зависнуть.
+
+Пул процессов один на процесс приложения: создается при первом документе и
+переиспользуется следующими (запуск воркеров и импорт PyPDF2 не повторяются на
+каждый файл). Если документ не уложился в общий срок (зависание вне Python-кода),
+пул завершается и при следующем обращении создается заново; документы, ждавшие
+ответа от завершенного пула, отправляют оставшиеся диапазоны в новый.
+
+Настройки через переменные окружения:
+    PDF_PARALLEL_MIN_PAGES - с какого числа страниц извлекать параллельно (по умолчанию 20)
+    PDF_EXTRACT_WORKERS - число процессов (по умолчанию - число CPU, не больше 8)
+    PDF_PAGE_TIMEOUT - таймаут извлечения одной страницы, сек (по умолчанию 30)
+"""
+
+import atexit
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import signal
+import threading
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Результат страницы: (номер страницы с 1, текст, ошибка или None)
+PageResult = Tuple[int, str, Optional[str]]
+
+
+# Интервал проверки, не заменен ли пул, пока документ ждет результат диапазона, сек
+POOL_CHECK_INTERVAL = 1.0
+
+_pool: Optional[multiprocessing.pool.Pool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+class PageTimeout(Exception):
+    """Извлечение страницы превысило таймаут"""
+
+
+def _settings() -> Tuple[int, int, float]:
+    min_pages = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 20))
+    workers = int(os.environ.get('PDF_EXTRACT_WORKERS', 0)) or min(os.cpu_count() or 1, 8)
+    page_timeout = float(os.environ.get('PDF_PAGE_TIMEOUT', 30))
+    return min_pages, workers, page_timeout
+
+
+def _on_alarm(signum, frame):
+    raise PageTimeout()
+
+
+def _extract_page(page, page_timeout: Optional[float]) -> str:
+    """Текст страницы; таймаут - через SIGALRM (только в основном потоке процесса, например в воркере пула)"""
+    if not page_timeout or not hasattr(signal, 'setitimer'):
+        return page.extract_text() or ''
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+    try:
+        return page.extract_text() or ''
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_range(file_path: str, start: int, end: int, page_timeout: Optional[float]) -> List[PageResult]:
+    """Извлекает страницы [start, end) в процессе пула"""
+    import PyPDF2
+
+    results = []
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for index in range(start, end):
+            try:
+                results.append((index + 1, _extract_page(reader.pages[index], page_timeout), None))
+            except PageTimeout:
+                results.append((index + 1, '', f'превышен таймаут {page_timeout:.0f} сек'))
+            except Exception as e:
+                results.append((index + 1, '', str(e) or e.__class__.__name__))
+    return results
+
+
+def _page_ranges(num_pages: int, workers: int) -> List[Tuple[int, int]]:
+    """Диапазоны страниц: по ~4 на процесс, чтобы тяжелые страницы не задерживали один процесс"""
+    chunk = max(1, -(-num_pages // (workers * 4)))
+    return [(start, min(start + chunk, num_pages)) for start in range(0, num_pages, chunk)]
+
+
+def _format_pages(pages: List[PageResult]) -> str:
+    """Собирает текст страниц в порядке номеров (формат прежнего последовательного конвертера)"""
+    text_content = []
+    for page_num, text, error in sorted(pages):
+        if error:
+            logger.warning(f"⚠️  PDF: страница {page_num} не извлечена: {error}")
+            text_content.append(f"--- Страница {page_num} ---\n")
+            text_content.append(f"[Текст страницы не извлечен: {error}]")
+            text_content.append("\n")
+        elif text.strip():
+            text_content.append(f"--- Страница {page_num} ---\n")
+            text_content.append(text)
+            text_content.append("\n")
+    return "\n".join(text_content)
+
+
+def _get_pool() -> multiprocessing.pool.Pool:
+    """Общий пул процесса (создается при первом обращении и после fork/завершения)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Не fork: процесс веб-сервера многопоточный. forkserver импортирует точку входа
+            # (run.py) один раз в процессе-сервере, а воркеры порождаются от него
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _, workers, _ = _settings()
+            _pool = multiprocessing.get_context(method).Pool(processes=workers)
+            _pool_pid = os.getpid()
+            logger.info(f"📄 PDF: запущен пул из {workers} процессов извлечения текста")
+        return _pool
+
+
+def _recycle_pool(pool: multiprocessing.pool.Pool):
+    """Завершает пул с зависшим воркером; следующий документ получит новый пул"""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    logger.warning("⚠️  PDF: извлечение зависло, пул процессов перезапускается")
+    pool.terminate()
+    pool.join()
+
+
+@atexit.register
+def _shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.terminate()
+
+
+def _extract_in_pool(file_path: str, num_pages: int, workers: int, page_timeout: float) -> List[PageResult]:
+    """Извлекает страницы в общем пуле диапазонами на workers процессов; таймаут страницы - внутри воркера"""
+    ranges = _page_ranges(num_pages, workers)
+    pages: List[PageResult] = []
+    # Страховка от зависания вне Python-кода (SIGALRM его не прервет): общий срок документа
+    deadline = time.monotonic() + 60 + page_timeout * -(-num_pages // workers)
+
+    pool = _get_pool()
+    pending = [pool.apply_async(_extract_range, (file_path, start, end, page_timeout)) for start, end in ranges]
+    index = 0
+    while index < len(ranges):
+        remaining = deadline - time.monotonic()
+        try:
+            pages.extend(pending[index].get(timeout=max(0.0, min(remaining, POOL_CHECK_INTERVAL))))
+            index += 1
+            continue
+        except multiprocessing.TimeoutError:
+            pass
+
+        if remaining <= 0:
+            # Готовые диапазоны сохраняются, остальные помечаются, зависший пул перезапускается
+            for (start, end), async_result in zip(ranges[index:], pending[index:]):
+                if async_result.ready() and async_result.successful():
+                    pages.extend(async_result.get())
+                else:
+                    pages.extend((page + 1, '', 'превышено время извлечения документа') for page in range(start, end))
+            _recycle_pool(pool)
+            break
+        if _pool is not pool:
+            # Пул завершен из-за другого документа - оставшиеся диапазоны отправляются в новый
+            pool = _get_pool()
+            pending[index:] = [
+                pool.apply_async(_extract_range, (file_path, start, end, page_timeout))
+                for start, end in ranges[index:]
+            ]
+    return pages
+
+
+def extract_pdf_text(file_path: str) -> str:
+    """
+    Извлекает текст PDF с маркерами страниц
+
+    Небольшие документы и вызовы из дочерних процессов (пакетная обработка уже
+    распределяет документы по процессам) извлекаются последовательно; из рабочего
+    потока небольшой документ извлекается одним процессом-воркером ради таймаута страниц.
+    """
+    import PyPDF2
+
+    min_pages, workers, page_timeout = _settings()
+    with open(file_path, 'rb') as file:
+        num_pages = len(PyPDF2.PdfReader(file).pages)
+
+    started = time.time()
+    in_child = multiprocessing.parent_process() is not None
+    on_main_thread = threading.current_thread() is threading.main_thread()
+    if in_child or ((num_pages < min_pages or workers < 2) and on_main_thread):
+        # Последовательно в текущем процессе: SIGALRM доступен только основному потоку,
+        # а дочерний процесс пакетной обработки не может запускать свои процессы
+        pages = _extract_range(file_path, 0, num_pages, page_timeout if on_main_thread else None)
+    elif num_pages < min_pages or workers < 2:
+        # Рабочий поток сервера: таймаут страницы соблюдается в отдельном процессе
+        pages = _extract_in_pool(file_path, num_pages, 1, page_timeout)
+    else:
+        pages = _extract_in_pool(file_path, num_pages, workers, page_timeout)
+        logger.info(f"📄 PDF: {num_pages} страниц извлечено за {time.time() - started:.1f} сек "
+                    f"({min(workers, num_pages)} процессов)")
+    return _format_pages(pages)
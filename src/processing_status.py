@@ -1,25 +1,35 @@
 #!/usr/bin/env python3
 """
 Модуль для отслеживания статуса обработки в реальном времени
+
+Статусы хранятся в общем для процесса хранилище (см. status_store): SQLite в режиме
+WAL по умолчанию или память процесса (PROCESSING_STATUS_BACKEND=memory).
+Экземпляры ProcessingStatus можно создавать на каждый запрос - все они работают
+с одним хранилищем, обновления атомарны на уровне полей.
 """
 
-import json
+import sys
 import time
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
-import threading
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from status_store import get_status_store
 
 
 class ProcessingStatus:
     """Управление статусом обработки для отображения прогресса"""
     
+    # Активные (pending/processing) статусы не удаляются при очистке раньше этого срока
+    ACTIVE_STATUS_MAX_AGE_SECONDS = 24 * 60 * 60
+    
     def __init__(self, status_dir: str = "storage/status"):
         """Инициализация менеджера статусов"""
         project_root = Path(__file__).parent.parent
         self.status_dir = project_root / status_dir
-        self.status_dir.mkdir(parents=True, exist_ok=True)
-        self._lock = threading.Lock()
+        self.store = get_status_store(self.status_dir)
     
     def create_status(self, task_id: str) -> Dict:
         """Создает новый статус обработки"""
@@ -40,111 +50,89 @@ class ProcessingStatus:
             'errors': []
         }
         
-        with self._lock:
-            status_file = self.status_dir / f"{task_id}.json"
-            with open(status_file, 'w', encoding='utf-8') as f:
-                json.dump(status, f, ensure_ascii=False, indent=2)
-        
+        self.store.create(task_id, status)
         return status
     
     def update_status(self, task_id: str, **kwargs):
-        """Обновляет статус обработки"""
-        with self._lock:
-            status_file = self.status_dir / f"{task_id}.json"
-            
-            if not status_file.exists():
-                return
-            
-            try:
-                with open(status_file, 'r', encoding='utf-8') as f:
-                    status = json.load(f)
-                
-                # Обновляем поля
-                status.update(kwargs)
-                
-                # Обновляем метрики времени
-                if 'metrics' in status and 'start_time' in status['metrics']:
-                    start_time = datetime.fromisoformat(status['metrics']['start_time'])
-                    status['metrics']['time_elapsed'] = (datetime.now() - start_time).total_seconds()
-                
-                # Сохраняем
-                with open(status_file, 'w', encoding='utf-8') as f:
-                    json.dump(status, f, ensure_ascii=False, indent=2)
-            except Exception as e:
-                print(f"⚠️  Ошибка обновления статуса: {e}")
+        """
+        Обновляет статус обработки
+        
+        Переданные поля заменяются, metrics сливаются с уже сохраненными метриками
+        """
+        metrics = kwargs.pop('metrics', None)
+        try:
+            self.store.update(task_id, kwargs, metrics)
+        except Exception as e:
+            print(f"⚠️  Ошибка обновления статуса: {e}")
+    
+    def update_metrics(self, task_id: str, message: Optional[str] = None, **metrics):
+        """Обновляет отдельные метрики, не затирая остальные (start_time, prompt_size и т.д.)"""
+        fields = {'message': message} if message is not None else {}
+        try:
+            self.store.update(task_id, fields, metrics)
+        except Exception as e:
+            print(f"⚠️  Ошибка обновления метрик: {e}")
     
     def get_status(self, task_id: str) -> Optional[Dict]:
-        """Получает текущий статус обработки (thread-safe чтение)"""
-        status_file = self.status_dir / f"{task_id}.json"
-        
-        if not status_file.exists():
-            return None
-        
+        """Получает текущий статус обработки"""
         try:
-            # Чтение не требует блокировки, так как каждый task_id уникален
-            with open(status_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.store.get(task_id)
         except Exception as e:
             print(f"⚠️  Ошибка чтения статуса: {e}")
             return None
     
+    def get_events(self, task_id: str, last_event_id: int = 0) -> List[Dict]:
+        """Снимки статуса после события last_event_id (журнал для SSE, поле event_id в каждом)"""
+        try:
+            return [status for _, status in self.store.events_since(task_id, last_event_id)]
+        except Exception as e:
+            print(f"⚠️  Ошибка чтения событий статуса: {e}")
+            return []
+    
+    def wait_for_update(self, task_id: str, last_event_id: int, timeout: float) -> bool:
+        """Ждет изменения статуса после события last_event_id (False - истек таймаут)"""
+        started = time.monotonic()
+        try:
+            return self.store.wait_for_event(task_id, last_event_id, timeout)
+        except Exception as e:
+            print(f"⚠️  Ошибка ожидания статуса: {e}")
+            # Хранилище недоступно (например, база заблокирована) - выжидаем таймаут,
+            # а не возвращаемся сразу, иначе SSE поток опрашивает его без пауз
+            time.sleep(max(0.0, timeout - (time.monotonic() - started)))
+            return False
+    
     def delete_status(self, task_id: str):
         """Удаляет статус после завершения"""
-        status_file = self.status_dir / f"{task_id}.json"
-        if status_file.exists():
-            try:
-                status_file.unlink()
-            except Exception as e:
-                print(f"⚠️  Ошибка удаления статуса: {e}")
+        try:
+            self.store.delete(task_id)
+        except Exception as e:
+            print(f"⚠️  Ошибка удаления статуса: {e}")
     
     def cleanup_old_statuses(self, max_age_minutes: int = 10):
-        """Удаляет старые статусы (старше max_age_minutes минут)"""
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_minutes * 60
-        
-        with self._lock:
-            for status_file in self.status_dir.glob("*.json"):
-                try:
-                    file_age = current_time - status_file.stat().st_mtime
-                    if file_age > max_age_seconds:
-                        status_file.unlink()
-                except Exception as e:
-                    print(f"⚠️  Ошибка удаления старого статуса {status_file}: {e}")
+        """Удаляет старые статусы (не обновлявшиеся дольше max_age_minutes минут)"""
+        # Задачи в очереди могут долго не обновляться - активные статусы хранятся дольше
+        try:
+            self.store.cleanup(max_age_minutes * 60, self.ACTIVE_STATUS_MAX_AGE_SECONDS)
+        except Exception as e:
+            print(f"⚠️  Ошибка удаления старых статусов: {e}")
     
     def add_error(self, task_id: str, error: str):
         """Добавляет ошибку в статус"""
-        status = self.get_status(task_id)
-        if status:
-            if 'errors' not in status:
-                status['errors'] = []
-            status['errors'].append(error)
-            self.update_status(task_id, errors=status['errors'])
+        try:
+            self.store.append_error(task_id, error)
+        except Exception as e:
+            print(f"⚠️  Ошибка добавления ошибки в статус: {e}")
     
     def cancel_task(self, task_id: str) -> bool:
         """Отменяет задачу (устанавливает флаг cancelled)"""
-        with self._lock:
-            status_file = self.status_dir / f"{task_id}.json"
-            
-            if not status_file.exists():
-                return False
-            
-            try:
-                with open(status_file, 'r', encoding='utf-8') as f:
-                    status = json.load(f)
-                
-                # Устанавливаем статус cancelled
-                status['status'] = 'cancelled'
-                status['message'] = 'Обработка отменена пользователем'
-                
-                # Сохраняем
-                with open(status_file, 'w', encoding='utf-8') as f:
-                    json.dump(status, f, ensure_ascii=False, indent=2)
-                
-                return True
-            except Exception as e:
-                print(f"⚠️  Ошибка отмены задачи: {e}")
-                return False
+        try:
+            return self.store.update(task_id, {
+                'status': 'cancelled',
+                'message': 'Обработка отменена пользователем'
+            })
+        except Exception as e:
+            print(f"⚠️  Ошибка отмены задачи: {e}")
+            return False
     
     def is_cancelled(self, task_id: str) -> bool:
         """Проверяет, отменена ли задача"""
@@ -152,4 +140,3 @@ class ProcessingStatus:
         if status:
             return status.get('status') == 'cancelled'
         return False
-
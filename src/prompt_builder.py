@@ -4,8 +4,93 @@
 """
 
 import json
+import os
+import re
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+from glossary_artifact import compile_glossary, filter_glossary, flatten_synonyms, load_glossary_artifact
+from tz_compact import ENCODINGS, decode_answer, encode_for_prompt
+from tz_relevance import backfill, iter_sections, slice_tree
+
+# Метки мест, заполняемых при render: текст документа, шаблон TZ.json и глоссарий
+TEXT_MARKER = '\x00CONVERTED_TEXT\x00'
+TZ_MARKER = '\x00TZ_TEMPLATE\x00'
+GLOSSARY_MARKER = '\x00GLOSSARY\x00'
+_MARKERS_RE = re.compile('(' + '|'.join(re.escape(marker) for marker in (TEXT_MARKER, TZ_MARKER, GLOSSARY_MARKER)) + ')')
+
+
+class CompiledPrompt:
+    """
+    Промпт с уже подставленными TZ.json и глоссарием
+    
+    Статичные части сериализованы один раз; на каждый документ остается только
+    склеить их с текстом документа. Для части шаблона (отбор секций по документу)
+    сериализуются только переданная часть шаблона и соответствующая часть глоссария.
+    Объект неизменяемый и общий для потоков.
+    """
+    
+    def __init__(self, parts: List[str], tz_json: dict, glossary: dict, tz_encoding: str = 'json',
+                 glossary_text: Optional[str] = None, glossary_version: Optional[str] = None,
+                 glossary_synonyms: Optional[Dict[str, List[str]]] = None):
+        self.parts = parts
+        self.tz_json = tz_json
+        self.glossary = glossary
+        self.tz_encoding = tz_encoding
+        self.tz_text = self.encode_tz(tz_json)
+        # Фрагмент и версия берутся из скомпилированного глоссария (glossary_artifact)
+        self.glossary_text = glossary_text if glossary_text is not None else json.dumps(glossary, ensure_ascii=False, indent=2)
+        self.glossary_version = glossary_version
+        # Плоский индекс синонимов (для локального извлечения параметров, glossary_prefill)
+        self.glossary_synonyms = glossary_synonyms if glossary_synonyms is not None else flatten_synonyms(glossary)
+        self.static_size = self.prompt_size()
+    
+    def encode_tz(self, tz_json: dict) -> str:
+        """Шаблон в представлении промпта"""
+        if self.tz_encoding == 'compact':
+            return encode_for_prompt(tz_json)
+        return json.dumps(tz_json, ensure_ascii=False, indent=2)
+    
+    def _fragments(self, tz_json: Optional[dict]) -> Tuple[str, str]:
+        """(шаблон, глоссарий) для полного шаблона или его части"""
+        if tz_json is None or tz_json is self.tz_json:
+            return self.tz_text, self.glossary_text
+        sections = [path for path, _ in iter_sections(tz_json)]
+        glossary = slice_tree(self.glossary, sections)
+        return self.encode_tz(tz_json), json.dumps(glossary, ensure_ascii=False, indent=2)
+    
+    def prompt_size(self, converted_text: str = '', tz_json: Optional[dict] = None) -> int:
+        """Размер промпта в символах без его сборки"""
+        tz_text, glossary_text = self._fragments(tz_json)
+        sizes = {TEXT_MARKER: len(converted_text), TZ_MARKER: len(tz_text), GLOSSARY_MARKER: len(glossary_text)}
+        return sum(sizes.get(part, len(part)) for part in self.parts)
+    
+    def render(self, converted_text: str, tz_json: Optional[dict] = None) -> str:
+        """
+        Готовый промпт для текста документа
+        
+        Args:
+            converted_text: Текст документа
+            tz_json: Часть шаблона (секции, отобранные для документа); None - полный шаблон
+        """
+        tz_text, glossary_text = self._fragments(tz_json)
+        values = {TEXT_MARKER: converted_text, TZ_MARKER: tz_text, GLOSSARY_MARKER: glossary_text}
+        return ''.join([values.get(part, part) for part in self.parts])
+    
+    def decode_answer(self, answer: dict, tz_json: Optional[dict] = None) -> dict:
+        """
+        Ответ ИИ в полной структуре TZ.json
+        
+        Компактный ответ разворачивается по шаблону, по которому строился промпт;
+        секции, не отправленные в ИИ, заполняются пустыми параметрами шаблона.
+        """
+        template = self.tz_json if tz_json is None else tz_json
+        if self.tz_encoding == 'compact':
+            answer = decode_answer(answer, template)
+        if template is not self.tz_json:
+            answer = backfill(answer, self.tz_json)
+        return answer
 
 
 class PromptBuilder:
@@ -145,21 +230,40 @@ class PromptBuilder:
         Returns:
             Готовый промпт для отправки в ИИ
         """
+        return self.compile(tz_json, glossary).render(converted_text)
+    
+    def compile(self, tz_json: Optional[dict] = None, glossary: Optional[dict] = None,
+                tz_encoding: str = 'json') -> 'CompiledPrompt':
+        """
+        Подставляет в шаблон TZ.json и глоссарий, оставляя место для текста документа
+        
+        Args:
+            tz_json: JSON шаблон (если None, загружается из файла)
+            glossary: JSON глоссарий (если None, загружается из файла)
+            tz_encoding: 'json' - шаблон как JSON с отступами, 'compact' - список параметров (tz_compact)
+        
+        Returns:
+            Скомпилированный промпт: render(converted_text) дает тот же результат, что build_prompt
+        """
+        # Текст документа, шаблон и глоссарий подставляются при render: здесь на их местах метки
+        converted_text = TEXT_MARKER
         if self.prompt_template is None:
             self.load_prompt_template()
         
         if tz_json is None:
             tz_json = self.load_tz_template()
         
+        # Глоссарий уже отфильтрован и сериализован в артефакте (glossary_artifact)
         if glossary is None:
-            glossary = self.load_glossary()
-        
-        # Оптимизируем глоссарий: оставляем только параметры с match != null
-        optimized_glossary = self._filter_glossary(glossary)
+            glossary_compiled = load_glossary_artifact(self.glossary_file)
+        else:
+            glossary_compiled = compile_glossary(glossary)
         
-        # Форматируем JSON для вставки в промпт
-        tz_json_str = json.dumps(tz_json, ensure_ascii=False, indent=2)
-        glossary_json_str = json.dumps(optimized_glossary, ensure_ascii=False, indent=2)
+        # Шаблон и глоссарий сериализует CompiledPrompt (целиком или часть шаблона для документа)
+        if tz_encoding not in ENCODINGS:
+            raise ValueError(f"Неизвестное представление шаблона: {tz_encoding} (допустимо: {', '.join(ENCODINGS)})")
+        tz_json_str = TZ_MARKER
+        glossary_json_str = GLOSSARY_MARKER
         
         # Заменяем плейсхолдеры в промпте
         prompt = self.prompt_template
@@ -221,42 +325,13 @@ class PromptBuilder:
             f"Текст ТЗ\n{converted_text}\n\n"
         )
         
-        return prompt
+        parts = [part for part in _MARKERS_RE.split(prompt) if part]
+        return CompiledPrompt(parts, tz_json, glossary_compiled.tree, tz_encoding,
+                              glossary_compiled.fragment, glossary_compiled.version, glossary_compiled.synonyms)
     
     def _filter_glossary(self, glossary: dict) -> dict:
-        """
-        Фильтрует глоссарий, оставляя только параметры с match != null
-        
-        Args:
-            glossary: Полный глоссарий
-        
-        Returns:
-            Оптимизированный глоссарий (только параметры с match)
-        """
-        if not isinstance(glossary, dict):
-            return {}
-        
-        filtered = {}
-        
-        for key, value in glossary.items():
-            if not isinstance(value, dict):
-                continue
-            
-            # Проверяем, является ли это параметром (имеет поля match/unit)
-            if 'match' in value or 'unit' in value:
-                # Это параметр - проверяем match
-                match_value = value.get('match')
-                # Оставляем только если match не null и не пустой список
-                if match_value is not None and match_value != []:
-                    filtered[key] = value
-            else:
-                # Это секция - рекурсивно фильтруем
-                filtered_section = self._filter_glossary(value)
-                # Добавляем секцию только если в ней есть параметры
-                if filtered_section:
-                    filtered[key] = filtered_section
-        
-        return filtered
+        """Фильтрует глоссарий, оставляя только параметры с match != null (см. glossary_artifact)"""
+        return filter_glossary(glossary)
     
     def save_prompt(self, prompt: str, output_file: str = "prompt_final.txt"):
         """Сохраняет финальный промпт в файл (для отладки)"""
@@ -265,3 +340,55 @@ class PromptBuilder:
             f.write(prompt)
         return str(output_path)
 
+
+# Скомпилированные промпты процесса: {(промпт, TZ.json, глоссарий, представление): (подписи, промпт)}
+_compiled: Dict[Tuple[str, str, str, str], Tuple[tuple, CompiledPrompt]] = {}
+_compiled_lock = threading.Lock()
+
+
+def _file_signature(path: Path) -> Tuple[int, int]:
+    """(mtime_ns, размер) - меняется при любой перезаписи файла"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (0, -1)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_compiled_prompt(prompt_file: str, tz_template_file: str, glossary_file: str,
+                        tz_encoding: str = 'json') -> CompiledPrompt:
+    """
+    Скомпилированный промпт для набора файлов
+    
+    Промпт и TZ.json читаются заново только если изменилось время модификации или
+    размер файла; глоссарий - только если изменилась версия его скомпилированного
+    артефакта (glossary_artifact), например после сохранения в веб-интерфейсе.
+    
+    Args:
+        prompt_file: Файл шаблона промпта
+        tz_template_file: Файл TZ.json
+        glossary_file: Файл glossary.json
+        tz_encoding: Представление шаблона в промпте ('json' или 'compact')
+    
+    Returns:
+        CompiledPrompt
+    """
+    builder = PromptBuilder(prompt_file, tz_template_file, glossary_file)
+    files = (str(builder.prompt_file), str(builder.tz_template_file), str(builder.glossary_file))
+    key = files + (tz_encoding,)
+    signature = (
+        _file_signature(builder.prompt_file),
+        _file_signature(builder.tz_template_file),
+        load_glossary_artifact(builder.glossary_file).version
+    )
+    
+    with _compiled_lock:
+        cached = _compiled.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        
+        # Компилируем под блокировкой: параллельные задачи не читают файлы повторно
+        builder.load_prompt_template()
+        compiled = builder.compile(tz_encoding=tz_encoding)
+        _compiled[key] = (signature, compiled)
+        return compiled
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Ограничитель скорости запросов к ИИ (token bucket по TPM и RPM)
+
+Отдельная пара корзин (токены в минуту, запросы в минуту) для каждого сочетания
+провайдер + модель + API ключ. Перед запросом корзина списывает оценку токенов
+промпта, после ответа оценка исправляется на фактический usage. Если емкости
+не хватает, вызов ждет ее пополнения, а не падает с ошибкой token_limit.
+
+Состояние корзин хранится в SQLite (BEGIN IMMEDIATE), поэтому лимит общий для всех
+потоков и всех процессов воркеров на машине.
+
+Настройки через переменные окружения:
+    LLM_RATE_LIMITS - JSON с лимитами, ключ "провайдер:модель" или "провайдер":
+                      '{"openai:gpt-5": {"tpm": 30000, "rpm": 500}, "jayflow": {"rpm": 60}}'
+    LLM_RATE_LIMIT_DB - файл состояния (по умолчанию storage/rate_limits.sqlite3)
+    LLM_RATE_LIMIT_MAX_WAIT - максимальное ожидание емкости, сек (по умолчанию 600)
+
+Если для ключа лимит не задан, он узнается из ответа API с ошибкой TPM (Limit N).
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пауза при занятой корзине не больше этого значения (емкость могла освободиться раньше)
+MAX_SLEEP_SECONDS = 5.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Примерная оценка токенов (1 токен ≈ 4 символа)"""
+    return max(1, len(text) // 4)
+
+
+class RateLimitTimeout(Exception):
+    """Емкость не освободилась за максимальное время ожидания"""
+
+
+class RateLimiter:
+    """Token bucket с общим состоянием в SQLite"""
+
+    def __init__(self, db_path: str, limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 max_wait: float = 600.0):
+        """
+        Args:
+            db_path: Путь к файлу SQLite
+            limits: Лимиты {"провайдер:модель" или "провайдер": {"tpm": ..., "rpm": ...}}
+            max_wait: Максимальное ожидание емкости, сек
+        """
+        self.db_path = Path(db_path)
+        self.limits = limits or {}
+        self.max_wait = max_wait
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'learned_limits': 0
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение SQLite для текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL, requests REAL, updated REAL, '
+                'tpm REAL, rpm REAL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(provider: str, model: str, api_key: Optional[str] = None) -> str:
+        """Ключ корзины: провайдер, модель и хэш API ключа (сам ключ не хранится)"""
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12] if api_key else '-'
+        return f"{provider}:{model}:{key_hash}"
+
+    def _configured_limits(self, key: str) -> Tuple[Optional[float], Optional[float]]:
+        # Модель (для Jay Flow - URL агента) может содержать ':', хэш ключа и провайдер - нет
+        head, _ = key.rsplit(':', 1)
+        provider, model = head.split(':', 1)
+        limits = self.limits.get(f"{provider}:{model}") or self.limits.get(provider) or {}
+        return limits.get('tpm'), limits.get('rpm')
+
+    def _load(self, conn: sqlite3.Connection, key: str, now: float):
+        """Читает корзину и пополняет ее за прошедшее время"""
+        tpm, rpm = self._configured_limits(key)
+        row = conn.execute(
+            'SELECT tokens, requests, updated, tpm, rpm FROM buckets WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return (tpm or 0.0), (rpm or 0.0), tpm, rpm, True
+        tokens, requests, updated, learned_tpm, learned_rpm = row
+        # Узнанный из ответа API лимит точнее настроенного
+        tpm = learned_tpm or tpm
+        rpm = learned_rpm or rpm
+        elapsed = max(0.0, now - updated)
+        if tpm:
+            tokens = min(tpm, tokens + elapsed * tpm / 60.0)
+        if rpm:
+            requests = min(rpm, requests + elapsed * rpm / 60.0)
+        return tokens, requests, tpm, rpm, False
+
+    def _save(self, conn: sqlite3.Connection, key: str, tokens: float, requests: float, now: float):
+        conn.execute(
+            'INSERT INTO buckets (key, tokens, requests, updated) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, '
+            'requests = excluded.requests, updated = excluded.updated',
+            (key, tokens, requests, now)
+        )
+
+    def try_acquire(self, key: str, tokens: int) -> float:
+        """
+        Пытается списать токены и один запрос
+
+        Returns:
+            0 - емкость списана, иначе сколько секунд подождать перед следующей попыткой
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            available, requests, tpm, rpm, _ = self._load(conn, key, now)
+            if not tpm and not rpm:
+                conn.execute('ROLLBACK')
+                return 0.0
+
+            # Запрос больше всей корзины никогда не поместится - ждем полную корзину
+            needed = min(float(tokens), tpm) if tpm else 0.0
+            wait = 0.0
+            if tpm and available < needed:
+                wait = (needed - available) / (tpm / 60.0)
+            if rpm and requests < 1:
+                wait = max(wait, (1 - requests) / (rpm / 60.0))
+
+            if wait > 0:
+                self._save(conn, key, available, requests, now)
+                conn.execute('COMMIT')
+                return wait
+
+            self._save(conn, key, available - needed, requests - 1 if rpm else requests, now)
+            conn.execute('COMMIT')
+            return 0.0
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _record_wait(self, waited: float):
+        with self._stats_lock:
+            self._stats['waits'] += 1
+            self._stats['wait_seconds'] += waited
+
+    def acquire(self, key: str, tokens: int, cancel_token=None) -> float:
+        """
+        Ждет емкость и списывает ее
+
+        Args:
+            cancel_token: CancellationToken задачи - отмена прерывает ожидание
+
+        Returns:
+            Время ожидания, сек
+
+        Raises:
+            RateLimitTimeout: Если емкость не освободилась за max_wait
+            TaskCancelled: Если задача отменена во время ожидания
+        """
+        started = time.time()
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if wait <= 0:
+                break
+            if time.time() - started + wait > self.max_wait:
+                with self._stats_lock:
+                    self._stats['timeouts'] += 1
+                raise RateLimitTimeout(f'Не дождались лимита скорости для {key} за {self.max_wait:.0f} сек')
+            if cancel_token is None:
+                time.sleep(min(wait, MAX_SLEEP_SECONDS))
+            elif cancel_token.wait(min(wait, MAX_SLEEP_SECONDS)):
+                cancel_token.raise_if_cancelled()
+        return self._finish_acquire(key, started)
+
+    async def acquire_async(self, key: str, tokens: int) -> float:
+        """
+        Асинхронный вариант acquire (ожидание не блокирует event loop, отмена - через отмену корутины)
+
+        Транзакция SQLite выполняется в пуле потоков: BEGIN IMMEDIATE может ждать
+        блокировку до 30 сек, а event loop общий для всех документов процесса.
+        """
+        started = time.time()
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, key, tokens)
+            if wait <= 0:
+                break
+            if time.time() - started + wait > self.max_wait:
+                with self._stats_lock:
+                    self._stats['timeouts'] += 1
+                raise RateLimitTimeout(f'Не дождались лимита скорости для {key} за {self.max_wait:.0f} сек')
+            await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+        return self._finish_acquire(key, started)
+
+    def _finish_acquire(self, key: str, started: float) -> float:
+        waited = time.time() - started
+        with self._stats_lock:
+            self._stats['acquired'] += 1
+        if waited > 0.5:
+            self._record_wait(waited)
+            logger.info(f"⏳ Ожидание лимита скорости {key.rsplit(':', 1)[0]}: {waited:.1f} сек")
+        return waited
+
+    def settle(self, key: str, estimated: int, actual: Optional[int]):
+        """
+        Исправляет списанную оценку на фактическое количество токенов
+
+        Args:
+            key: Ключ корзины
+            estimated: Списанная оценка
+            actual: Фактический usage.total_tokens (None - оставить оценку)
+        """
+        if actual is None or actual == estimated:
+            return
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            tokens, requests, tpm, rpm, is_new = self._load(conn, key, now)
+            if not tpm or is_new:
+                conn.execute('ROLLBACK')
+                return
+            # Корзина может уйти в минус - следующие вызовы подождут, пока долг не погасится
+            self._save(conn, key, min(tpm, tokens + estimated - actual), requests, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def learn_limit(self, key: str, tpm: Optional[int] = None, rpm: Optional[int] = None):
+        """
+        Запоминает лимит, сообщенный API, и опустошает корзину
+        (провайдер только что отказал - емкости сейчас нет)
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            conn.execute(
+                'INSERT INTO buckets (key, tokens, requests, updated, tpm, rpm) VALUES (?, 0, 0, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = 0, requests = 0, updated = excluded.updated, '
+                'tpm = COALESCE(excluded.tpm, buckets.tpm), rpm = COALESCE(excluded.rpm, buckets.rpm)',
+                (key, now, tpm, rpm)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._stats_lock:
+            self._stats['learned_limits'] += 1
+        logger.info(f"📏 Лимит скорости {key.rsplit(':', 1)[0]}: TPM={tpm or '-'}, RPM={rpm or '-'}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика ожиданий (в пределах процесса)"""
+        with self._stats_lock:
+            return {**self._stats, 'wait_seconds': round(self._stats['wait_seconds'], 1)}
+
+
+class RateLimitMixin:
+    """
+    Ограничение скорости для AI клиентов
+
+    Клиент должен реализовать _rate_limit_identity() -> (провайдер, модель, API ключ)
+    """
+
+    def _rate_limit_identity(self):
+        raise NotImplementedError
+
+    def _rate_limit_key(self) -> str:
+        return RateLimiter.make_key(*self._rate_limit_identity())
+
+    def _acquire_capacity(self, prompt: str) -> int:
+        """
+        Ждет емкость под промпт. Возвращает списанную оценку токенов
+
+        Ошибка базы лимитов (заблокирована, только для чтения) не мешает запросу:
+        запрос отправляется без ограничения, как и при ошибках settle/learn_limit.
+        """
+        estimated = estimate_tokens(prompt)
+        try:
+            get_rate_limiter().acquire(self._rate_limit_key(), estimated, getattr(self, 'cancel_token', None))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️  Лимит скорости не проверен, запрос без ожидания: {e}")
+        return estimated
+
+    async def _acquire_capacity_async(self, prompt: str) -> int:
+        estimated = estimate_tokens(prompt)
+        try:
+            await get_rate_limiter().acquire_async(self._rate_limit_key(), estimated)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️  Лимит скорости не проверен, запрос без ожидания: {e}")
+        return estimated
+
+    def _settle_capacity(self, estimated: int, usage: Optional[Dict]):
+        """Исправляет оценку токенов на фактический usage ответа"""
+        if usage and usage.get('total_tokens'):
+            try:
+                get_rate_limiter().settle(self._rate_limit_key(), estimated, usage['total_tokens'])
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️  Не удалось обновить лимит скорости: {e}")
+
+    def _learn_rate_limit(self, result: Dict[str, Any]):
+        """Запоминает лимит из ошибки API, чтобы следующие вызовы ждали емкость заранее"""
+        error_type = result.get('error_type')
+        if error_type not in ('token_limit', 'rate_limit'):
+            return
+        try:
+            get_rate_limiter().learn_limit(
+                self._rate_limit_key(),
+                tpm=result.get('limit') if error_type == 'token_limit' else None
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️  Не удалось сохранить лимит скорости: {e}")
+
+    def _rate_limit_timeout_result(self, error: Exception) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': f'Превышен лимит скорости запросов: {error}',
+            'error_type': 'rate_limit'
+        }
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Возвращает ограничитель скорости процесса (настройки из переменных окружения)"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            project_root = Path(__file__).parent.parent
+            try:
+                limits = json.loads(os.environ.get('LLM_RATE_LIMITS') or '{}')
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ Некорректный JSON в LLM_RATE_LIMITS: {e}")
+                limits = {}
+            _limiter = RateLimiter(
+                db_path=os.environ.get('LLM_RATE_LIMIT_DB') or str(project_root / 'storage' / 'rate_limits.sqlite3'),
+                limits=limits,
+                max_wait=float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT', 600))
+            )
+        return _limiter
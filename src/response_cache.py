@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Кэш ответов ИИ на диске
+
+Ключ - SHA-256 от провайдера, модели, системного сообщения и итогового текста промпта,
+поэтому повторная загрузка того же ТЗ (или перезапуск сценария) не тратит токены и время
+на уже полученные ответы. Кэшируются только успешные ответы.
+
+Размер ограничен (LRU по времени последнего обращения, см. disk_cache), записи устаревают по TTL.
+
+Настройки через переменные окружения:
+    LLM_CACHE_ENABLED - включить кэш (true/false, по умолчанию true)
+    LLM_CACHE_DIR - папка кэша (по умолчанию storage/cache/llm)
+    LLM_CACHE_MAX_MB - максимальный размер кэша в МБ (по умолчанию 512)
+    LLM_CACHE_TTL_HOURS - время жизни записи в часах (по умолчанию 168 - неделя)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Версия формата ключа: увеличить, если меняется состав ключа или формат записи
+CACHE_KEY_VERSION = 1
+
+
+class ResponseCache(DiskCache):
+    """Ограниченный по размеру LRU-кэш ответов ИИ на диске"""
+
+    name = 'Кэш ответов ИИ'
+
+    def __init__(self, cache_dir: str, max_size_bytes: int = 512 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = 7 * 24 * 60 * 60, enabled: bool = True):
+        """
+        Args:
+            cache_dir: Папка для файлов кэша
+            max_size_bytes: Максимальный суммарный размер записей
+            ttl_seconds: Время жизни записи (None - без ограничения)
+            enabled: Включен ли кэш
+        """
+        super().__init__(cache_dir, max_size_bytes, suffix='.json', enabled=enabled)
+        self.ttl_seconds = ttl_seconds
+        self._stats['expired'] = 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_message: str, prompt: str) -> str:
+        """
+        Формирует ключ кэша
+
+        Args:
+            provider: Провайдер ('openai', 'jayflow')
+            model: Модель (для Jay Flow - URL агента)
+            system_message: Системное сообщение
+            prompt: Итоговый текст промпта
+
+        Returns:
+            SHA-256 в hex
+        """
+        payload = json.dumps(
+            [CACHE_KEY_VERSION, provider, model or '', system_message or '', prompt],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает запись кэша или None
+
+        Returns:
+            {'content': str, 'usage': dict или None, 'created_at': float, ...}
+        """
+        if not self.enabled:
+            return None
+
+        data = self.read_bytes(key)
+        if data is None:
+            self._count('misses')
+            return None
+        try:
+            entry = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️  Поврежденная запись кэша {key}: {e}")
+            self.remove(key)
+            self._count('misses')
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry.get('created_at', 0) > self.ttl_seconds:
+            self.remove(key)
+            self._count('expired')
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        return entry
+
+    def set(self, key: str, content: str, usage: Optional[Dict] = None, **meta) -> None:
+        """
+        Сохраняет ответ в кэш
+
+        Args:
+            key: Ключ (make_key)
+            content: Текст ответа ИИ
+            usage: Использование токенов исходного запроса
+            **meta: Дополнительные поля записи (провайдер, модель)
+        """
+        if not self.enabled or not content:
+            return
+
+        entry = {
+            'content': content,
+            'usage': usage,
+            'created_at': time.time(),
+            **meta
+        }
+        self.write_bytes(key, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'ttl_seconds': self.ttl_seconds}
+
+
+class ResponseCacheMixin:
+    """
+    Кэширование ответов для AI клиентов
+
+    Клиент должен реализовать _cache_identity() -> (провайдер, модель, системное сообщение)
+    """
+
+    def _cache_identity(self):
+        raise NotImplementedError
+
+    def _cache_key(self, prompt: str) -> str:
+        provider, model, system_message = self._cache_identity()
+        return ResponseCache.make_key(provider, model, system_message, prompt)
+
+    def _cached_response(self, prompt: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+        """Запись кэша для промпта или None (кэш выключен, bypass или промах)"""
+        if not use_cache:
+            return None
+        cache = get_response_cache()
+        if not cache.enabled:
+            return None
+        entry = cache.get(self._cache_key(prompt))
+        if entry:
+            logger.info(f"💾 Ответ взят из кэша (промпт: {len(prompt):,} символов)")
+        return entry
+
+    def _store_response(self, prompt: str, content: str, usage: Optional[Dict], use_cache: bool):
+        """Сохраняет успешный ответ в кэш"""
+        if not use_cache:
+            return
+        cache = get_response_cache()
+        if cache.enabled:
+            provider, model, _ = self._cache_identity()
+            cache.set(self._cache_key(prompt), content, usage, provider=provider, model=model)
+
+    @staticmethod
+    def _cached_usage(usage: Optional[Dict]) -> Optional[Dict]:
+        """Ответ из кэша токены не расходует"""
+        if usage is None:
+            return None
+        return {
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_tokens': 0,
+            'cached_total_tokens': usage.get('total_tokens', 0)
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Возвращает кэш ответов процесса (настройки из переменных окружения)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            project_root = Path(__file__).parent.parent
+            ttl_hours = float(os.environ.get('LLM_CACHE_TTL_HOURS', 168))
+            _cache = ResponseCache(
+                cache_dir=os.environ.get('LLM_CACHE_DIR') or str(project_root / 'storage' / 'cache' / 'llm'),
+                max_size_bytes=int(float(os.environ.get('LLM_CACHE_MAX_MB', 512)) * 1024 * 1024),
+                ttl_seconds=ttl_hours * 3600 if ttl_hours > 0 else None,
+                enabled=os.environ.get('LLM_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+            )
+        return _cache
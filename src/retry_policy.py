@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Политики повторов запросов к ИИ
+
+Один механизм повторов для всех провайдеров: для каждого класса ошибки
+(error_type из _make_request) задано число попыток и экспоненциальная пауза
+с полным джиттером (full jitter), чтобы повторы разных задач не синхронизировались.
+Retry-After от провайдера имеет приоритет над расчетной паузой. Общий бюджет
+времени задачи (deadline) ограничивает суммарное время повторов.
+
+Настройки через переменные окружения:
+    LLM_RETRY_POLICIES - JSON с переопределением политик:
+                         '{"server_error": {"max_attempts": 5, "base_delay": 2, "max_delay": 30}}'
+    LLM_TASK_DEADLINE - бюджет времени на все вызовы ИИ одной задачи, сек (по умолчанию 3600)
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """Политика повторов для одного класса ошибок"""
+
+    def __init__(self, max_attempts: int = 1, base_delay: float = 1.0, max_delay: float = 30.0,
+                 multiplier: float = 2.0, jitter: bool = True):
+        """
+        Args:
+            max_attempts: Максимальное число попыток (1 - без повторов)
+            base_delay: Базовая пауза перед первым повтором, сек
+            max_delay: Максимальная пауза, сек
+            multiplier: Множитель экспоненциального роста паузы
+            jitter: Полный джиттер - пауза равномерно в [0, расчетная пауза]
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """Пауза перед повтором после попытки attempt (0 - первая попытка)"""
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'max_attempts': self.max_attempts,
+            'base_delay': self.base_delay,
+            'max_delay': self.max_delay,
+            'multiplier': self.multiplier,
+            'jitter': self.jitter
+        }
+
+
+# Политики по умолчанию для error_type клиентов
+DEFAULT_POLICIES = {
+    # Лимиты скорости: ждем дольше, учитываем Retry-After
+    'rate_limit': RetryPolicy(max_attempts=5, base_delay=2.0, max_delay=60.0),
+    # Превышение TPM: ограничитель скорости сам дождется емкости
+    'token_limit': RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=60.0),
+    # Временные сбои провайдера и сети
+    'server_error': RetryPolicy(max_attempts=4, base_delay=2.0, max_delay=30.0),
+    'timeout': RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=30.0),
+    'connection_error': RetryPolicy(max_attempts=4, base_delay=2.0, max_delay=30.0),
+    # Поток ответа перестал поступать (таймаут первого токена или idle, см. llm_stream):
+    # повтор заново оплачивает весь промпт - один повтор и с заметной паузой
+    'stream_stalled': RetryPolicy(max_attempts=2, base_delay=15.0, max_delay=60.0),
+    'ssl_error': RetryPolicy(max_attempts=2, base_delay=2.0, max_delay=10.0),
+    # Модель вернула пустой ответ или невалидный JSON - повторяем сразу
+    'empty_response': RetryPolicy(max_attempts=2, base_delay=0.0, jitter=False),
+    'invalid_json': RetryPolicy(max_attempts=3, base_delay=0.0, jitter=False),
+    # Ошибки, которые повтор не исправит
+    'authentication_error': RetryPolicy(max_attempts=1),
+    'model_not_found': RetryPolicy(max_attempts=1),
+    'length_limit': RetryPolicy(max_attempts=1),
+    'cancelled': RetryPolicy(max_attempts=1),
+    'api_error': RetryPolicy(max_attempts=1),
+    'unknown': RetryPolicy(max_attempts=2, base_delay=2.0, max_delay=10.0),
+}
+
+
+class RetryEngine:
+    """Выбор паузы перед повтором по классу ошибки, Retry-After и бюджету времени"""
+
+    def __init__(self, policies: Optional[Dict[str, RetryPolicy]] = None):
+        self.policies = dict(DEFAULT_POLICIES)
+        if policies:
+            self.policies.update(policies)
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = {}
+
+    def policy_for(self, error_type: Optional[str]) -> RetryPolicy:
+        return self.policies.get(error_type or 'unknown') or self.policies['unknown']
+
+    def _record(self, error_type: str, name: str, value: float = 1):
+        with self._lock:
+            metrics = self._metrics.setdefault(error_type, {
+                'retries': 0,
+                'gave_up': 0,
+                'deadline_exceeded': 0,
+                'sleep_seconds': 0.0
+            })
+            metrics[name] += value
+
+    def next_delay(self, response: Dict[str, Any], attempt: int, max_retries: Optional[int] = None,
+                   deadline: Optional[float] = None) -> Optional[float]:
+        """
+        Пауза перед следующей попыткой
+
+        Args:
+            response: Результат неудачной попытки (error_type, retry_after, limit, requested)
+            attempt: Номер неудачной попытки (0 - первая)
+            max_retries: Дополнительное ограничение числа повторов от вызывающего кода
+            deadline: Крайний срок задачи (time.monotonic()), None - без ограничения
+
+        Returns:
+            Пауза в секундах или None, если повторять не нужно
+        """
+        error_type = response.get('error_type') or 'unknown'
+        policy = self.policy_for(error_type)
+
+        max_attempts = policy.max_attempts
+        if max_retries is not None:
+            max_attempts = min(max_attempts, max_retries + 1)
+        if attempt + 1 >= max_attempts:
+            if max_attempts > 1:
+                self._record(error_type, 'gave_up')
+            return None
+
+        # Промпт больше лимита TPM - ожидание не поможет
+        limit, requested = response.get('limit'), response.get('requested')
+        if error_type == 'token_limit' and limit and requested and requested > limit:
+            self._record(error_type, 'gave_up')
+            return None
+
+        delay = policy.delay(attempt)
+        retry_after = response.get('retry_after')
+        if retry_after is not None:
+            delay = max(delay, min(float(retry_after), policy.max_delay * 2))
+
+        if deadline is not None and time.monotonic() + delay > deadline:
+            logger.warning(f"⏱️  Бюджет времени задачи исчерпан - повтор ({error_type}) не выполняется")
+            self._record(error_type, 'deadline_exceeded')
+            return None
+
+        self._record(error_type, 'retries')
+        self._record(error_type, 'sleep_seconds', delay)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики повторов по классам ошибок (в пределах процесса)"""
+        with self._lock:
+            return {
+                error_type: {**metrics, 'sleep_seconds': round(metrics['sleep_seconds'], 1)}
+                for error_type, metrics in self._metrics.items()
+            }
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Пауза из заголовков ответа (retry-after-ms, retry-after в секундах или HTTP-дате)
+
+    Returns:
+        Секунды или None
+    """
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value:
+            return max(0.0, float(value) / 1000.0)
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def task_deadline(budget: Optional[float] = None) -> Optional[float]:
+    """
+    Крайний срок задачи (time.monotonic()) от текущего момента
+
+    Args:
+        budget: Бюджет, сек (None - из LLM_TASK_DEADLINE)
+    """
+    if budget is None:
+        budget = float(os.environ.get('LLM_TASK_DEADLINE', 3600))
+    return time.monotonic() + budget if budget > 0 else None
+
+
+class RetryMixin:
+    """Повторы запросов AI клиентов по общему RetryEngine"""
+
+    # Крайний срок задачи (time.monotonic()), выставляется исполнителем сценария
+    retry_deadline: Optional[float] = None
+
+    def _retry_delay(self, response: Dict[str, Any], attempt: int,
+                     max_retries: Optional[int] = None) -> Optional[float]:
+        """Пауза перед повтором запроса или None, если повторять не нужно"""
+        return get_retry_engine().next_delay(response, attempt, max_retries, self.retry_deadline)
+
+
+_engine: Optional[RetryEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_retry_engine() -> RetryEngine:
+    """Возвращает механизм повторов процесса (политики из LLM_RETRY_POLICIES)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            policies = {}
+            try:
+                overrides = json.loads(os.environ.get('LLM_RETRY_POLICIES') or '{}')
+                for error_type, params in overrides.items():
+                    base = DEFAULT_POLICIES.get(error_type, RetryPolicy()).as_dict()
+                    base.update(params)
+                    policies[error_type] = RetryPolicy(**base)
+            except (json.JSONDecodeError, TypeError, AttributeError) as e:
+                logger.error(f"❌ Некорректные LLM_RETRY_POLICIES: {e}")
+            _engine = RetryEngine(policies)
+        return _engine
@@ -3,20 +3,28 @@
 Модуль для выполнения сценариев обработки ТЗ
 """
 
+import asyncio
+import copy
 import json
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import sys
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
 # Добавляем src в путь
 sys.path.insert(0, str(Path(__file__).parent))
 
-from prompt_builder import PromptBuilder
+from glossary_prefill import PrefillResult, apply_prefill, get_matcher, prefill_parameters, prefill_summary
+from prompt_builder import CompiledPrompt, get_compiled_prompt
+from tz_relevance import prune_template
+from tz_shards import TemplateShard, max_parallel_requests, merge_shards, shard_retries, split_template
 from ai_client import OpenAIClient, JayFlowClient
 from json_to_excel import JSONToExcelConverter
+from task_graph import TaskGraph
+from text_chunks import chunk_settings, merge_chunk_answers, merge_csv_answers, split_text
+from retry_policy import task_deadline
+from cancellation import CancellationToken, watch_cancellation
 try:
     from csv_to_excel import CSVToExcelAppender
 except ImportError:
@@ -26,10 +34,54 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+class ScenarioPrompts:
+    """
+    Шаблоны промптов сценария
+    
+    Основной промпт берется из скомпилированного шаблона процесса (общего для всех задач,
+    файлы перечитываются только при их изменении). Пакетная обработка передает один
+    экземпляр всем документам пакета: шаблоны дополнительных промптов читаются один раз.
+    """
+    
+    def __init__(self, scenario: Dict, project_root: Optional[Path] = None):
+        self.scenario = scenario
+        self.project_root = project_root or Path(__file__).parent.parent
+        self._lock = threading.Lock()
+        self._additional: Dict[str, str] = {}
+    
+    def main_compiled(self) -> CompiledPrompt:
+        """Скомпилированный основной промпт (перекомпилируется при изменении файлов)"""
+        prompt_config = self.scenario['prompts']['main']
+        return get_compiled_prompt(
+            prompt_file=str(self.project_root / prompt_config['file']),
+            tz_template_file=str(self.project_root / prompt_config['tz_template']),
+            glossary_file=str(self.project_root / prompt_config['glossary']),
+            tz_encoding=prompt_config.get('tz_encoding', 'json')
+        )
+    
+    def build_main(self, converted_text: str, tz_json: Optional[dict] = None) -> str:
+        """Строит основной промпт по скомпилированному шаблону (tz_json - часть шаблона для документа)"""
+        return self.main_compiled().render(converted_text, tz_json)
+    
+    def decode_main_answer(self, answer: dict, tz_json: Optional[dict] = None) -> dict:
+        """JSON ответа на основной промпт в полной структуре TZ.json"""
+        return self.main_compiled().decode_answer(answer, tz_json)
+    
+    def additional_template(self, prompt_type: str) -> str:
+        """Шаблон дополнительного промпта"""
+        with self._lock:
+            if prompt_type not in self._additional:
+                prompt_file = self.project_root / self.scenario['prompts'][prompt_type]['file']
+                with open(prompt_file, 'r', encoding='utf-8') as f:
+                    self._additional[prompt_type] = f.read()
+            return self._additional[prompt_type]
+
+
 class ScenarioExecutor:
     """Выполняет сценарий обработки ТЗ"""
     
-    def __init__(self, scenario: Dict, status_manager=None, task_id: str = None, results_folder: str = None):
+    def __init__(self, scenario: Dict, status_manager=None, task_id: str = None, results_folder: str = None,
+                 finalize_status: bool = True, prompts: Optional[ScenarioPrompts] = None):
         """
         Инициализация исполнителя
         
@@ -38,24 +90,64 @@ class ScenarioExecutor:
             status_manager: Менеджер статусов для отслеживания прогресса (опционально)
             task_id: ID задачи для отслеживания статуса (опционально)
             results_folder: Путь к папке для сохранения результатов (опционально)
+            finalize_status: Выставлять ли финальный статус (completed/error) по завершении.
+                             False - если финальный статус выставляет вызывающий код
+                             (например, после записи документа в БД)
+            prompts: Загруженные шаблоны промптов сценария (общие для пакета документов)
         """
         self.scenario = scenario
         self.project_root = Path(__file__).parent.parent
         self.results_folder = Path(results_folder) if results_folder else (self.project_root / "results")
         self.results = {}
         self.errors = []
+        # Частичные сбои, при которых результат все равно создан (например, не обработана часть шаблона)
+        self.warnings = []
         self.status_manager = status_manager
         self.task_id = task_id
+        self.finalize_status = finalize_status
+        self.prompts = prompts or ScenarioPrompts(scenario, self.project_root)
+        # Число токенов, полученных в потоковых ответах ИИ (по промптам)
+        self._received_tokens: Dict[str, int] = {}
+        self._received_tokens_lock = threading.Lock()
+        # Токен отмены: передается AI клиентам, отменяется при status='cancelled'
+        self.cancel_token = CancellationToken()
+        # Ограничение одновременных запросов основного промпта в асинхронном режиме
+        self._main_slots: Optional[asyncio.Semaphore] = None
+        # Брать ответы ИИ из кэша (выставляется в execute/execute_async)
+        self.use_cache = True
+    
+    # Имена листов Excel для дополнительных промптов
+    SHEET_NAMES = {
+        'instrument_tooling': 'Инструмент+Оснастка',
+        'services': 'Услуги',
+        'spare_parts': 'ЗИП'
+    }
+    
+    # Описания шагов для статуса
+    STEP_NAMES = {
+        'main': 'Обработка основного промпта (технические характеристики)',
+        'instrument_tooling': 'Извлечение инструмента и оснастки',
+        'services': 'Извлечение услуг',
+        'spare_parts': 'Извлечение ЗИП'
+    }
+    
+    ADDITIONAL_TYPES = ['instrument_tooling', 'services', 'spare_parts']
     
     def execute(self, converted_text: str, ai_provider: str = 'openai', 
-                output_prefix: str = "result") -> Dict[str, Any]:
+                output_prefix: str = "result", use_cache: bool = True) -> Dict[str, Any]:
         """
         Выполняет сценарий обработки
         
+        Все вызовы ИИ (основной и дополнительные промпты) запускаются одновременно,
+        сборка Excel выполняется финальным шагом после получения всех ответов.
+        
         Args:
             converted_text: Текст из сконвертированного документа
             ai_provider: Провайдер AI ('openai' или 'jayflow')
             output_prefix: Префикс для имен выходных файлов
+            use_cache: Брать ответы ИИ из кэша (False - все промпты отправляются заново).
+                       Отдельный промпт можно исключить из кэша в сценарии:
+                       "prompts": {"main": {"use_cache": false, ...}}
         
         Returns:
             Словарь с результатами:
@@ -66,38 +158,16 @@ class ScenarioExecutor:
                     'instrument': {...},  # CSV → Excel лист
                     ...
                 },
-                'errors': List[str]
+                'errors': List[str],
+                'warnings': List[str]  # частичные сбои, результат при этом создан
             }
         """
-        # Подсчитываем общее количество шагов
-        total_steps = 0
-        if self.scenario['prompts']['main'].get('enabled'):
-            total_steps += 1
-        # Объединенный промпт для инструмента и оснастки
-        additional_types = ['instrument_tooling', 'services', 'spare_parts']
-        for prompt_type in additional_types:
-            if self.scenario['prompts'][prompt_type].get('enabled'):
-                total_steps += 1
-        
-        # Обновляем статус
-        if self.status_manager and self.task_id:
-            self.status_manager.update_status(
-                self.task_id,
-                status='processing',
-                total_steps=total_steps,
-                current_step=0,
-                message='Инициализация обработки...'
-            )
+        self.use_cache = use_cache
+        prompt_types = self._enabled_prompt_types()
+        total_steps = len(prompt_types)
         
-        # Проверяем, не отменена ли задача
-        if self.status_manager and self.task_id:
-            if self.status_manager.is_cancelled(self.task_id):
-                logger.info(f"[{self.task_id}] ⛔ Задача отменена до начала обработки")
-                return {
-                    'success': False,
-                    'results': {},
-                    'errors': ['Задача отменена пользователем']
-                }
+        if not self._start_processing(total_steps):
+            return self._cancelled_result()
         
         # Инициализируем AI клиент
         logger.info(f"[{self.task_id}] 🤖 Инициализация AI клиента: {ai_provider}")
@@ -105,209 +175,718 @@ class ScenarioExecutor:
             ai_client = JayFlowClient()
         else:
             ai_client = OpenAIClient()
+        # Общий бюджет времени на повторы всех вызовов ИИ задачи
+        ai_client.retry_deadline = task_deadline()
+        ai_client.cancel_token = self.cancel_token
         logger.info(f"[{self.task_id}] ✅ AI клиент инициализирован")
         
-        # Обрабатываем основной промпт
-        excel_path = None
-        excel_filename = None
-        current_step = 0
+        # Граф задач: все вызовы ИИ независимы, сборка Excel зависит от всех
+        graph = TaskGraph(on_task_done=self._progress_callback(prompt_types))
+        if 'main' in prompt_types:
+            graph.add('main', lambda deps: self._request_main_prompt(converted_text, ai_client))
+        for prompt_type in prompt_types:
+            if prompt_type != 'main':
+                graph.add(
+                    prompt_type,
+                    lambda deps, pt=prompt_type: self._request_additional_prompt(pt, converted_text, ai_client)
+                )
+        graph.add(
+            'assembly',
+            lambda deps: self._assemble_results(deps, output_prefix),
+            depends_on=prompt_types
+        )
+        
+        self._announce_parallel_start(prompt_types)
+        stop_watch = self._watch_cancellation()
+        try:
+            graph.run()
+        finally:
+            stop_watch()
+        for name, error in graph.errors.items():
+            self.errors.append(f"Ошибка обработки промпта {name}: {str(error)}")
+        
+        return self._finish(total_steps)
+    
+    async def execute_async(self, converted_text: str, ai_provider: str = 'openai',
+                            output_prefix: str = "result", use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Асинхронный вариант execute
+        
+        Вызовы ИИ выполняются корутинами в текущем event loop (без отдельного потока
+        на каждый промпт); выбор шаблона, предзаполнение, обновления статуса и сборка
+        Excel - в пуле потоков, чтобы не блокировать loop, общий для всех документов.
+        Аргументы и формат результата совпадают с execute.
+        """
+        from async_ai_client import create_async_client
+        
+        self.use_cache = use_cache
+        prompt_types = self._enabled_prompt_types()
+        total_steps = len(prompt_types)
+        
+        if not await asyncio.to_thread(self._start_processing, total_steps):
+            return self._cancelled_result()
         
+        logger.info(f"[{self.task_id}] 🤖 Инициализация асинхронного AI клиента: {ai_provider}")
+        ai_client = create_async_client(ai_provider)
+        ai_client.retry_deadline = task_deadline()
+        ai_client.cancel_token = self.cancel_token
+        on_task_done = self._progress_callback(prompt_types)
+        
+        async def run_prompt(name: str):
+            if name == 'main':
+                coro = self._request_main_prompt_async(converted_text, ai_client)
+            else:
+                coro = self._request_additional_prompt_async(name, converted_text, ai_client)
+            try:
+                result = await coro
+            except Exception as e:
+                logger.error(f"❌ Задача {name} завершилась с ошибкой: {e}")
+                self.errors.append(f"Ошибка обработки промпта {name}: {str(e)}")
+                result = None
+            await asyncio.to_thread(on_task_done, name, result)
+            return name, result
+        
+        await asyncio.to_thread(self._announce_parallel_start, prompt_types)
+        stop_watch = self._watch_cancellation()
+        try:
+            llm_results = dict(await asyncio.gather(*(run_prompt(name) for name in prompt_types)))
+        finally:
+            stop_watch()
+        
+        try:
+            await asyncio.to_thread(self._assemble_results, llm_results, output_prefix)
+        except Exception as e:
+            logger.error(f"❌ Задача assembly завершилась с ошибкой: {e}")
+            self.errors.append(f"Ошибка обработки промпта assembly: {str(e)}")
+        
+        return await asyncio.to_thread(self._finish, total_steps)
+    
+    def _use_cache(self, prompt_type: str) -> bool:
+        """Брать ли ответ ИИ на промпт из кэша: не запрещено ни в запросе, ни в сценарии"""
+        return self.use_cache and self.scenario['prompts'][prompt_type].get('use_cache', True)
+    
+    def _enabled_prompt_types(self) -> List[str]:
+        """Включенные в сценарии промпты (основной первым)"""
+        prompt_types = []
         if self.scenario['prompts']['main'].get('enabled'):
-            current_step += 1
-            logger.info(f"[{self.task_id}] 📝 Начало обработки основного промпта (шаг {current_step}/{total_steps})")
+            prompt_types.append('main')
+        for prompt_type in self.ADDITIONAL_TYPES:
+            if self.scenario['prompts'].get(prompt_type, {}).get('enabled'):
+                prompt_types.append(prompt_type)
+        return prompt_types
+    
+    def _start_processing(self, total_steps: int) -> bool:
+        """Выставляет начальный статус. Возвращает False, если задача уже отменена"""
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                status='processing',
+                total_steps=total_steps,
+                current_step=0,
+                message='Инициализация обработки...'
+            )
+        
+        # Проверяем, не отменена ли задача
+        if self._is_cancelled():
+            logger.info(f"[{self.task_id}] ⛔ Задача отменена до начала обработки")
+            return False
+        return True
+    
+    def _cancelled_result(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'results': {},
+            'errors': ['Задача отменена пользователем'],
+            'warnings': []
+        }
+    
+    def _progress_callback(self, prompt_types: List[str]):
+        """Callback, обновляющий прогресс после каждого полученного ответа ИИ"""
+        total_steps = len(prompt_types)
+        completed_steps = []
+        status_lock = threading.Lock()
+        
+        def on_task_done(name: str, result: Any):
+            if name not in prompt_types:
+                return
+            with status_lock:
+                completed_steps.append(name)
+                current_step = len(completed_steps)
+                remaining = [t for t in prompt_types if t not in completed_steps]
+            logger.info(f"[{self.task_id}] ✅ Ответ для {name} получен ({current_step}/{total_steps})")
             if self.status_manager and self.task_id:
+                # Стадия указывает на еще выполняющийся промпт (основной в приоритете)
+                stage = f'{remaining[0]}_prompt' if remaining else 'assembly'
                 self.status_manager.update_status(
                     self.task_id,
                     current_step=current_step,
-                    stage='main_prompt',
-                    message='Обработка основного промпта (технические характеристики)...',
+                    stage=stage,
+                    message=f'{self.STEP_NAMES.get(name, name)}: готово ({current_step}/{total_steps})',
                     progress=int((current_step / total_steps) * 100) if total_steps > 0 else 0
                 )
-            
-            # Проверяем отмену перед обработкой
-            if self.status_manager and self.task_id and self.status_manager.is_cancelled(self.task_id):
-                logger.info(f"[{self.task_id}] ⛔ Задача отменена перед обработкой основного промпта")
-                return {
-                    'success': False,
-                    'results': {},
-                    'errors': ['Задача отменена пользователем']
-                }
-            
-            result = self._process_main_prompt(converted_text, ai_client, output_prefix)
-            if result:
-                self.results['main'] = result
-                # Сохраняем путь к Excel файлу для добавления дополнительных листов
-                excel_path = result.get('excel_path')
-                excel_filename = result.get('excel_file')
-                
-                # Обновляем метрики
-                if self.status_manager and self.task_id:
-                    usage = result.get('usage', {})
-                    prompt_size = result.get('prompt_size', 0)
-                    self.status_manager.update_status(
-                        self.task_id,
-                        metrics={
-                            'prompt_size': prompt_size,
-                            'tokens_used': usage.get('total_tokens', 0),
-                            'prompt_tokens': usage.get('prompt_tokens', 0),
-                            'completion_tokens': usage.get('completion_tokens', 0)
-                        }
-                    )
-        
-        # Обрабатываем дополнительные промпты (добавляем в тот же Excel)
-        step_names = {
-            'instrument_tooling': 'Извлечение инструмента и оснастки',
-            'services': 'Извлечение услуг',
-            'spare_parts': 'Извлечение ЗИП'
-        }
         
-        # Параллельная обработка дополнительных промптов
-        # Создаем список задач для параллельного выполнения
-        parallel_tasks = []
-        for prompt_type in additional_types:
-            if self.scenario['prompts'][prompt_type].get('enabled'):
-                parallel_tasks.append(prompt_type)
+        return on_task_done
+    
+    def _stream_progress(self, name: str):
+        """Callback прогресса потокового ответа ИИ: пишет число полученных токенов в статус"""
+        if not (self.status_manager and self.task_id):
+            return None
         
-        # Если есть задачи для параллельной обработки
-        if parallel_tasks:
-            logger.info(f"[{self.task_id}] 🚀 Запуск параллельной обработки {len(parallel_tasks)} промптов: {', '.join(parallel_tasks)}")
-            
-            # Создаем блокировку для записи в Excel
-            excel_lock = threading.Lock()
-            
-            def process_prompt_parallel(prompt_type: str):
-                """Обработка одного промпта в параллельном потоке"""
-                try:
-                    # Проверяем отмену перед обработкой
-                    if self.status_manager and self.task_id and self.status_manager.is_cancelled(self.task_id):
-                        logger.info(f"[{self.task_id}] ⛔ Задача отменена перед обработкой промпта {prompt_type}")
-                        return None
-                    
-                    # Для параллельных промптов шаг = основной + 1 (все параллельные на одном шаге)
-                    current_step = 2 if self.scenario['prompts']['main'].get('enabled') else 1
-                    total_steps_for_progress = 2  # основной + параллельные (считаем как один шаг)
-                    
-                    logger.info(f"[{self.task_id}] 📝 Начало обработки промпта {prompt_type} (параллельно)")
-                    if self.status_manager and self.task_id:
-                        self.status_manager.update_status(
-                            self.task_id,
-                            current_step=current_step,
-                            stage=f'{prompt_type}_prompt',
-                            message=f'{step_names.get(prompt_type, prompt_type)}...',
-                            progress=int((current_step / total_steps_for_progress) * 100) if total_steps_for_progress > 0 else 0
-                        )
-                    
-                    # Если Excel еще не создан, используем имя файла из основного результата или создаем новое
-                    local_excel_path = excel_path
-                    if not local_excel_path:
-                        if excel_filename:
-                            local_excel_path = str(self.results_folder / excel_filename)
-                        else:
-                            local_excel_filename = f"{output_prefix}_filled.xlsx"
-                            local_excel_path = str(self.results_folder / local_excel_filename)
-                    
-                    # Обрабатываем промпт
-                    result = self._process_additional_prompt(
-                        prompt_type, converted_text, ai_client, output_prefix, local_excel_path, excel_lock
-                    )
-                    
-                    if result:
-                        logger.info(f"[{self.task_id}] ✅ Промпт {prompt_type} обработан успешно")
-                        return (prompt_type, result)
-                    else:
-                        logger.warning(f"[{self.task_id}] ⚠️ Промпт {prompt_type} не вернул результат")
-                        return None
-                except Exception as e:
-                    logger.error(f"[{self.task_id}] ❌ Ошибка при параллельной обработке {prompt_type}: {e}")
-                    self.errors.append(f"Ошибка обработки промпта {prompt_type}: {str(e)}")
-                    return None
-            
-            # Запускаем параллельную обработку
-            with ThreadPoolExecutor(max_workers=len(parallel_tasks)) as executor:
-                # Отправляем все задачи
-                future_to_prompt = {executor.submit(process_prompt_parallel, prompt_type): prompt_type 
-                                    for prompt_type in parallel_tasks}
-                
-                # Собираем результаты по мере выполнения
-                for future in as_completed(future_to_prompt):
-                    prompt_type = future_to_prompt[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            result_prompt_type, result_data = result
-                            self.results[result_prompt_type] = result_data
-                            # Обновляем размер Excel файла в основном результате
-                            if 'main' in self.results and excel_path and Path(excel_path).exists():
-                                with excel_lock:
-                                    self.results['main']['excel_size'] = Path(excel_path).stat().st_size
-                    except Exception as e:
-                        logger.error(f"[{self.task_id}] ❌ Исключение при обработке {prompt_type}: {e}")
-                        self.errors.append(f"Ошибка обработки промпта {prompt_type}: {str(e)}")
-            
-            logger.info(f"[{self.task_id}] ✅ Параллельная обработка завершена. Обработано: {len(self.results)} промптов")
+        def on_progress(tokens: int):
+            with self._received_tokens_lock:
+                self._received_tokens[name] = tokens
+                received = dict(self._received_tokens)
+            self.status_manager.update_metrics(
+                self.task_id,
+                message=f'{self.STEP_NAMES.get(name.split(":")[0], name)}: получено {tokens:,} токенов ответа...',
+                received_tokens=sum(received.values()),
+                received_tokens_by_prompt=received
+            )
         
-        # Финальный статус
+        return on_progress
+    
+    def _announce_parallel_start(self, prompt_types: List[str]):
+        if not prompt_types:
+            return
+        total_steps = len(prompt_types)
+        logger.info(f"[{self.task_id}] 🚀 Запуск параллельной обработки {total_steps} промптов: {', '.join(prompt_types)}")
         if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                stage=f'{prompt_types[0]}_prompt',
+                message=f'Параллельная обработка промптов ({total_steps})...'
+            )
+    
+    def _finish(self, total_steps: int) -> Dict[str, Any]:
+        """Выставляет финальный статус (если нужно) и формирует результат"""
+        if self._is_cancelled():
+            # Статус 'cancelled' уже выставлен - не перезаписываем его на completed/error
+            logger.info(f"[{self.task_id}] ⛔ Обработка прервана: задача отменена пользователем")
+            return self._cancelled_result()
+        
+        logger.info(f"[{self.task_id}] ✅ Параллельная обработка завершена. Обработано: {len(self.results)} промптов")
+        
+        if self.warnings:
+            logger.warning(f"[{self.task_id}] ⚠️  Предупреждений: {len(self.warnings)}: {'; '.join(self.warnings)}")
+        
+        if self.status_manager and self.task_id and self.finalize_status:
+            if self.errors:
+                message = f'Ошибки: {len(self.errors)}'
+            elif self.warnings:
+                message = f'Обработка завершена (предупреждений: {len(self.warnings)})'
+            else:
+                message = 'Обработка завершена'
             self.status_manager.update_status(
                 self.task_id,
                 status='completed' if len(self.errors) == 0 else 'error',
                 current_step=total_steps,
                 progress=100,
-                message='Обработка завершена' if len(self.errors) == 0 else f'Ошибки: {len(self.errors)}'
+                message=message,
+                warnings=self.warnings
             )
         
         return {
             'success': len(self.errors) == 0,
             'results': self.results,
-            'errors': self.errors
+            'errors': self.errors,
+            'warnings': self.warnings
         }
     
-    def _process_main_prompt(self, converted_text: str, ai_client, output_prefix: str) -> Optional[Dict]:
-        """Обрабатывает основной промпт (JSON + Excel)"""
-        try:
-            logger.info(f"[{self.task_id}] 📋 Чтение конфигурации основного промпта")
-            prompt_config = self.scenario['prompts']['main']
-            prompt_file = self.project_root / prompt_config['file']
-            tz_template = self.project_root / prompt_config['tz_template']
-            glossary = self.project_root / prompt_config['glossary']
-            
-            logger.info(f"[{self.task_id}] 🔨 Построение промпта (файл: {prompt_file.name})")
-            # Строим промпт
-            prompt_builder = PromptBuilder(
-                prompt_file=str(prompt_file),
-                tz_template_file=str(tz_template),
-                glossary_file=str(glossary)
+    def _is_cancelled(self) -> bool:
+        """Проверяет, отменена ли задача"""
+        if self.cancel_token.cancelled:
+            return True
+        if self.status_manager and self.task_id and self.status_manager.is_cancelled(self.task_id):
+            self.cancel_token.cancel()
+            return True
+        return False
+    
+    def _watch_cancellation(self):
+        """
+        Запускает наблюдение за отменой задачи на время вызовов ИИ
+        
+        Returns:
+            Функция остановки наблюдателя
+        """
+        if not (self.status_manager and self.task_id):
+            return lambda: None
+        return watch_cancellation(
+            self.cancel_token,
+            lambda: self.status_manager.is_cancelled(self.task_id)
+        )
+    
+    def _assemble_results(self, llm_results: Dict[str, Optional[Dict]], output_prefix: str) -> None:
+        """
+        Финальный шаг: сохраняет JSON основного промпта и собирает Excel
+        (основной лист + листы дополнительных промптов)
+        """
+        if self._is_cancelled():
+            logger.info(f"[{self.task_id}] ⛔ Задача отменена перед сборкой результатов")
+            self.errors.append('Задача отменена пользователем')
+            return
+        
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                stage='assembly',
+                message='Сборка результатов (JSON и Excel)...'
             )
-            final_prompt = prompt_builder.build_prompt(converted_text)
-            
-            # Сохраняем размер промпта для метрик
-            prompt_size = len(final_prompt)
-            logger.info(f"[{self.task_id}] ✅ Промпт построен: {prompt_size:,} символов (~{prompt_size // 4:,} токенов)")
-            
-            # Обновляем статус с размером промпта
-            if self.status_manager and self.task_id:
-                self.status_manager.update_status(
-                    self.task_id,
-                    message=f'Отправка промпта в AI ({prompt_size:,} символов)...',
-                    metrics={'prompt_size': prompt_size}
+        
+        excel_path = None
+        main_response = llm_results.get('main')
+        if main_response:
+            result = self._save_main_result(main_response, output_prefix)
+            if result:
+                self.results['main'] = result
+                excel_path = result.get('excel_path')
+        
+        for prompt_type in self.ADDITIONAL_TYPES:
+            response = llm_results.get(prompt_type)
+            if not response:
+                continue
+            if not excel_path:
+                excel_path = self._create_empty_workbook(output_prefix)
+            result = self._append_additional_sheet(prompt_type, response, excel_path)
+            if result:
+                self.results[prompt_type] = result
+        
+        # Обновляем размер Excel файла в основном результате (после добавления листов)
+        if 'main' in self.results and excel_path and Path(excel_path).exists():
+            self.results['main']['excel_size'] = Path(excel_path).stat().st_size
+    
+    def _select_main_template(self, converted_text: str) -> Optional[dict]:
+        """
+        Секции шаблона, подтвержденные текстом документа (tz_pruning в сценарии)
+        
+        Returns:
+            Часть шаблона или None - отправляется полный шаблон
+        """
+        if not self.scenario['prompts']['main'].get('tz_pruning'):
+            return None
+        
+        compiled = self.prompts.main_compiled()
+        selection = prune_template(converted_text, compiled.tz_json, compiled.glossary)
+        if not selection.pruned:
+            return None
+        
+        sections_total = len(selection.kept) + len(selection.dropped)
+        tokens_saved = (compiled.prompt_size(converted_text) - compiled.prompt_size(converted_text, selection.tz_json)) // 4
+        logger.info(f"[{self.task_id}] ✂️  Шаблон ТЗ: {len(selection.kept)} из {sections_total} секций "
+                    f"(~{tokens_saved:,} токенов сэкономлено)")
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                metrics={
+                    'tz_sections_kept': len(selection.kept),
+                    'tz_sections_total': sections_total,
+                    'tz_tokens_saved': tokens_saved
+                }
+            )
+        return selection.tz_json
+    
+    def _prefill_main(self, converted_text: str, tz_json: Optional[dict]) -> Optional[PrefillResult]:
+        """
+        Параметры, извлеченные из документа локально по глоссарию (prefill в сценарии)
+        
+        Returns:
+            PrefillResult (его tz_json - шаблон для ИИ без заполненных параметров) или None
+        """
+        if not self.scenario['prompts']['main'].get('prefill'):
+            return None
+        
+        compiled = self.prompts.main_compiled()
+        template = tz_json if tz_json is not None else compiled.tz_json
+        prefill = prefill_parameters(converted_text, template, compiled.glossary_synonyms,
+                                     get_matcher(compiled.tz_json, compiled.glossary_synonyms, compiled.glossary_version))
+        if not prefill.values:
+            return None
+        
+        logger.info(f"[{self.task_id}] ⚡ Локально по глоссарию заполнено параметров: {len(prefill.values)}"
+                    + (" (запрос к AI не нужен)" if prefill.complete else ""))
+        if self.status_manager and self.task_id:
+            # Частичный результат: клиенты (SSE и опрос статуса) видят значения до ответа ИИ
+            self.status_manager.update_status(
+                self.task_id,
+                message=f'Локально заполнено параметров: {len(prefill.values)}, остальные - через AI...',
+                partial_result={'source': 'prefill', 'parameters': prefill_summary(prefill.values)},
+                metrics={'prefilled_parameters': len(prefill.values)}
+            )
+        return prefill
+    
+    def _apply_main_prefill(self, response: Optional[Dict], prefill: Optional[PrefillResult]) -> Optional[Dict]:
+        """Подставляет локально заполненные параметры в ответ ИИ на основной промпт"""
+        if prefill is None:
+            return response
+        if prefill.complete:
+            response = {'json': copy.deepcopy(self.prompts.main_compiled().tz_json), 'usage': {}, 'prompt_size': 0}
+        elif response is None:
+            return None
+        response['json'] = apply_prefill(response['json'], prefill.values)
+        return response
+    
+    def _build_main_prompt(self, converted_text: str, tz_json: Optional[dict] = None) -> Optional[str]:
+        """Строит основной промпт (None - если задача отменена)"""
+        prompt_file = Path(self.scenario['prompts']['main']['file'])
+        logger.info(f"[{self.task_id}] 🔨 Построение промпта (файл: {prompt_file.name})")
+        final_prompt = self.prompts.build_main(converted_text, tz_json)
+        
+        # Сохраняем размер промпта для метрик
+        prompt_size = len(final_prompt)
+        logger.info(f"[{self.task_id}] ✅ Промпт построен: {prompt_size:,} символов (~{prompt_size // 4:,} токенов)")
+        
+        # Обновляем статус с размером промпта
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                message=f'Отправка промпта в AI ({prompt_size:,} символов)...',
+                metrics={'prompt_size': prompt_size}
+            )
+        
+        # Проверяем отмену перед отправкой
+        if self._is_cancelled():
+            logger.info(f"[{self.task_id}] ⛔ Задача отменена перед отправкой основного промпта")
+            return None
+        
+        logger.info(f"[{self.task_id}] 🚀 Отправка основного промпта в AI...")
+        return final_prompt
+    
+    def _update_main_metrics(self, prompt_size: int, usage: Dict) -> None:
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                metrics={
+                    'prompt_size': prompt_size,
+                    'tokens_used': usage.get('total_tokens', 0),
+                    'prompt_tokens': usage.get('prompt_tokens', 0),
+                    'completion_tokens': usage.get('completion_tokens', 0)
+                }
+            )
+    
+    def _handle_main_response(self, result: Dict, prompt_size: int, tz_json: Optional[dict] = None) -> Dict:
+        """Проверяет ответ ИИ на основной промпт и обновляет метрики (ошибка - в поле error)"""
+        logger.info(f"[{self.task_id}] 📥 Получен ответ от AI (success: {result.get('success')})")
+        
+        if not result['success']:
+            error_msg = result.get('error', 'Неизвестная ошибка')
+            logger.error(f"[{self.task_id}] ❌ Ошибка обработки основного промпта: {error_msg}")
+            return self._main_failed(error_msg)
+        
+        # Обновляем метрики
+        usage = result.get('usage') or {}
+        self._update_main_metrics(prompt_size, usage)
+        
+        return {
+            'json': self.prompts.decode_main_answer(result['json'], tz_json),
+            'usage': usage,
+            'prompt_size': prompt_size,
+            'error': None
+        }
+    
+    @staticmethod
+    def _main_failed(error: str) -> Dict:
+        """Ответ основного промпта (или его части), который не удалось получить"""
+        return {'json': None, 'usage': {}, 'prompt_size': 0, 'error': error}
+    
+    def _record_main_failure(self, response: Dict) -> Optional[Dict]:
+        """Ответ основного промпта; если его нет - ошибка задачи (кроме отмены) и None"""
+        if response.get('json') is not None:
+            return response
+        if not self._is_cancelled():
+            self.errors.append(f"Ошибка обработки основного промпта: {response.get('error') or 'нет ответа'}")
+        return None
+    
+    def _main_shards(self, tz_json: Optional[dict]) -> Optional[List[TemplateShard]]:
+        """Части шаблона для параллельных запросов (sharding в сценарии); None - один запрос"""
+        if not self.scenario['prompts']['main'].get('sharding'):
+            return None
+        shards = split_template(tz_json if tz_json is not None else self.prompts.main_compiled().tz_json)
+        if len(shards) < 2:
+            return None
+        
+        logger.info(f"[{self.task_id}] 🧩 Основной промпт разбит на {len(shards)} частей: "
+                    + ', '.join(f"{shard.name} ({shard.parameters} парам.)" for shard in shards))
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                message=f'Отправка основного промпта в AI ({len(shards)} частей параллельно)...'
+            )
+        return shards
+    
+    def _handle_shard_response(self, shard: TemplateShard, result: Dict, attempt: int,
+                               prompt_size: int) -> Optional[Dict]:
+        """Ответ части основного промпта (None - ошибка, часть можно повторить)"""
+        if not result.get('success'):
+            logger.warning(f"[{self.task_id}] ⚠️  Часть '{shard.name}' (попытка {attempt}): "
+                           f"{result.get('error', 'Неизвестная ошибка')}")
+            return None
+        logger.info(f"[{self.task_id}] 📥 Получен ответ для части '{shard.name}'")
+        return {
+            'json': self.prompts.decode_main_answer(result['json'], shard.tz_json),
+            'usage': result.get('usage') or {},
+            'prompt_size': prompt_size,
+            'error': None
+        }
+    
+    def _shard_failed(self, shard: TemplateShard, attempts: int, error: Optional[str] = None) -> Dict:
+        reason = error or f'нет корректного ответа за {attempts} попыток'
+        logger.error(f"[{self.task_id}] ❌ Часть '{shard.name}' не обработана: {reason}")
+        return self._main_failed(reason)
+    
+    def _request_main_shard(self, converted_text: str, shard: TemplateShard, name: str, ai_client) -> Dict:
+        """Запрос одной части основного промпта с повторами при ошибке ответа"""
+        final_prompt = self.prompts.build_main(converted_text, shard.tz_json)
+        attempts = shard_retries() + 1
+        for attempt in range(1, attempts + 1):
+            if self._is_cancelled():
+                return self._shard_failed(shard, attempt - 1, 'задача отменена')
+            result = ai_client.process_prompt(final_prompt, use_cache=self._use_cache('main'),
+                                              on_progress=self._stream_progress(name))
+            response = self._handle_shard_response(shard, result, attempt, len(final_prompt))
+            if response:
+                return response
+        return self._shard_failed(shard, attempts)
+    
+    async def _request_main_shard_async(self, converted_text: str, shard: TemplateShard, name: str,
+                                        ai_client) -> Dict:
+        """Асинхронный вариант _request_main_shard"""
+        final_prompt = self.prompts.build_main(converted_text, shard.tz_json)
+        attempts = shard_retries() + 1
+        for attempt in range(1, attempts + 1):
+            if await asyncio.to_thread(self._is_cancelled):
+                return self._shard_failed(shard, attempt - 1, 'задача отменена')
+            async with self._main_slots:
+                result = await ai_client.process_prompt(final_prompt, use_cache=self._use_cache('main'),
+                                                        on_progress=self._stream_progress(name))
+            response = self._handle_shard_response(shard, result, attempt, len(final_prompt))
+            if response:
+                return response
+        return self._shard_failed(shard, attempts)
+    
+    def _merge_main_shards(self, shards: List[TemplateShard], responses: List[Optional[Dict]],
+                           name: str = 'main') -> Dict:
+        """
+        Объединяет ответы частей основного промпта
+        
+        Подразделы необработанных частей остаются пустыми (сбой записывается в warnings),
+        основной результат создается, если обработана хотя бы одна часть; иначе - ответ с ошибкой.
+        """
+        answered, failed = [], []
+        for shard, response in zip(shards, responses):
+            if response and response.get('json') is not None:
+                answered.append((shard, response))
+            else:
+                failed.append((shard.name, (response or {}).get('error') or 'нет ответа'))
+        if not answered:
+            reasons = '; '.join(f"'{shard_name}': {error}" for shard_name, error in failed)
+            return self._main_failed(f"не обработана ни одна часть ({reasons})")
+        # Для части длинного документа указываем ее номер (main:N)
+        where = f" в части документа {name.split(':')[1]}" if ':' in name else ''
+        for shard_name, error in failed:
+            self.warnings.append(f"Часть основного промпта '{shard_name}'{where} не обработана ({error}), "
+                                 f"ее параметры не заполнены")
+        
+        usage = {
+            key: sum(response['usage'].get(key) or 0 for _, response in answered)
+            for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')
+        }
+        prompt_size = sum(response['prompt_size'] for _, response in answered)
+        self._update_main_metrics(prompt_size, usage)
+        logger.info(f"[{self.task_id}] 🧩 Объединены ответы {len(answered)} из {len(shards)} частей основного промпта")
+        
+        merged = merge_shards(
+            ((shard, response['json']) for shard, response in answered),
+            self.prompts.main_compiled().tz_json
+        )
+        return {'json': merged, 'usage': usage, 'prompt_size': prompt_size, 'error': None}
+    
+    def _main_chunks(self, converted_text: str, tz_json: Optional[dict]) -> Optional[List[str]]:
+        """Окна текста документа, если основной промпт не помещается в бюджет токенов; None - один запрос"""
+        compiled = self.prompts.main_compiled()
+        max_chars, overlap = chunk_settings()
+        prompt_size = compiled.prompt_size(converted_text, tz_json)
+        if prompt_size <= max_chars:
+            return None
+        
+        text_budget = max_chars - compiled.prompt_size('', tz_json)
+        if text_budget <= overlap:
+            logger.warning(f"[{self.task_id}] ⚠️  Промпт без текста документа не помещается в бюджет "
+                           f"{max_chars // 4:,} токенов, документ отправляется целиком")
+            return None
+        
+        chunks = split_text(converted_text, text_budget, overlap)
+        logger.info(f"[{self.task_id}] 📚 Промпт ~{prompt_size // 4:,} токенов больше бюджета "
+                    f"{max_chars // 4:,}: документ разбит на {len(chunks)} частей "
+                    f"(перекрытие {overlap:,} символов)")
+        if self.status_manager and self.task_id:
+            self.status_manager.update_status(
+                self.task_id,
+                message=f'Документ разбит на {len(chunks)} частей, обработка параллельно...',
+                metrics={'text_chunks': len(chunks)}
+            )
+        return chunks
+    
+    def _merge_main_chunks(self, chunks: List[str], responses: List[Dict]) -> Dict:
+        """
+        Объединяет ответы по частям документа
+        
+        Для каждого параметра берется значение с наибольшей уверенностью; основной
+        результат создается, если обработана хотя бы одна часть документа (сбои
+        остальных частей записываются в warnings), иначе - ответ с ошибкой.
+        """
+        answered, failed = [], []
+        for number, response in enumerate(responses, 1):
+            if response.get('json') is not None:
+                answered.append(response)
+            else:
+                failed.append((number, response.get('error') or 'нет ответа'))
+        if not answered:
+            reasons = '; '.join(f"{number}: {error}" for number, error in failed)
+            return self._main_failed(f"не обработана ни одна часть документа ({reasons})")
+        for number, error in failed:
+            self.warnings.append(f"Часть документа {number} из {len(chunks)} не обработана ({error}), "
+                                 f"параметры из нее не извлечены")
+        
+        usage = {
+            key: sum(response['usage'].get(key) or 0 for response in answered)
+            for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')
+        }
+        prompt_size = sum(response['prompt_size'] for response in answered)
+        self._update_main_metrics(prompt_size, usage)
+        logger.info(f"[{self.task_id}] 📚 Объединены ответы {len(answered)} из {len(chunks)} частей документа")
+        
+        merged = merge_chunk_answers([response['json'] for response in answered], self.prompts.main_compiled().tz_json)
+        return {'json': merged, 'usage': usage, 'prompt_size': prompt_size, 'error': None}
+    
+    def _request_main_text(self, converted_text: str, tz_json: Optional[dict],
+                           shards: Optional[List[TemplateShard]], ai_client, name: str = 'main') -> Dict:
+        """Основной промпт для текста (документа или его части): один запрос или части шаблона"""
+        if shards:
+            graph = TaskGraph(max_workers=min(len(shards), max_parallel_requests()))
+            for index, shard in enumerate(shards, 1):
+                graph.add(
+                    f'{name}:{index}',
+                    lambda deps, shard=shard, index=index: self._request_main_shard(
+                        converted_text, shard, f'{name}:{index}', ai_client
+                    )
                 )
-            
-            # Проверяем отмену перед отправкой
-            if self.status_manager and self.task_id and self.status_manager.is_cancelled(self.task_id):
-                logger.info(f"[{self.task_id}] ⛔ Задача отменена перед отправкой основного промпта")
-                return None
-            
-            # Отправляем в AI
-            logger.info(f"[{self.task_id}] 🚀 Отправка основного промпта в AI...")
-            result = ai_client.process_prompt(final_prompt)
-            logger.info(f"[{self.task_id}] 📥 Получен ответ от AI (success: {result.get('success')})")
-            
-            if not result['success']:
-                error_msg = result.get('error', 'Неизвестная ошибка')
-                logger.error(f"[{self.task_id}] ❌ Ошибка обработки основного промпта: {error_msg}")
-                self.errors.append(f"Ошибка обработки основного промпта: {error_msg}")
-                return None
-            
+            results = graph.run()
+            return self._merge_main_shards(
+                shards,
+                [results.get(f'{name}:{index}') or self._main_failed(str(graph.errors.get(f'{name}:{index}')))
+                 for index in range(1, len(shards) + 1)],
+                name
+            )
+        
+        final_prompt = self._build_main_prompt(converted_text, tz_json)
+        if final_prompt is None:
+            return self._main_failed('задача отменена')
+        result = ai_client.process_prompt(final_prompt, use_cache=self._use_cache('main'),
+                                          on_progress=self._stream_progress(name))
+        return self._handle_main_response(result, len(final_prompt), tz_json)
+    
+    async def _request_main_text_async(self, converted_text: str, tz_json: Optional[dict],
+                                       shards: Optional[List[TemplateShard]], ai_client,
+                                       name: str = 'main') -> Dict:
+        """Асинхронный вариант _request_main_text"""
+        if shards:
+            responses = await asyncio.gather(
+                *(self._request_main_shard_async(converted_text, shard, f'{name}:{index}', ai_client)
+                  for index, shard in enumerate(shards, 1)),
+                return_exceptions=True
+            )
+            responses = [
+                self._shard_failed(shard, 0, str(response)) if isinstance(response, Exception) else response
+                for shard, response in zip(shards, responses)
+            ]
+            return await asyncio.to_thread(self._merge_main_shards, shards, responses, name)
+        
+        final_prompt = await asyncio.to_thread(self._build_main_prompt, converted_text, tz_json)
+        if final_prompt is None:
+            return self._main_failed('задача отменена')
+        async with self._main_slots:
+            result = await ai_client.process_prompt(final_prompt, use_cache=self._use_cache('main'),
+                                                    on_progress=self._stream_progress(name))
+        return await asyncio.to_thread(self._handle_main_response, result, len(final_prompt), tz_json)
+    
+    def _plan_main(self, converted_text: str) -> Tuple[Optional[dict], Optional[PrefillResult],
+                                                      Optional[List[TemplateShard]], Optional[List[str]]]:
+        """
+        Шаблон, предзаполнение и разбиение основного промпта на запросы
+
+        Returns:
+            (шаблон для ИИ, предзаполнение, части шаблона, окна документа);
+            если предзаполнение полное - запросы не нужны и части/окна равны None
+        """
+        tz_json = self._select_main_template(converted_text)
+        prefill = self._prefill_main(converted_text, tz_json)
+        if prefill:
+            if prefill.complete:
+                return tz_json, prefill, None, None
+            tz_json = prefill.tz_json
+        return tz_json, prefill, self._main_shards(tz_json), self._main_chunks(converted_text, tz_json)
+    
+    def _request_main_prompt(self, converted_text: str, ai_client) -> Optional[Dict]:
+        """Строит основной промпт и отправляет его в ИИ (без сохранения результатов)"""
+        try:
+            tz_json, prefill, shards, chunks = self._plan_main(converted_text)
+            if prefill and prefill.complete:
+                return self._apply_main_prefill(None, prefill)
+            if chunks:
+                # Части документа × части шаблона: общее число запросов не больше лимита
+                graph = TaskGraph(max_workers=max(1, max_parallel_requests() // len(shards or [tz_json])))
+                for number, chunk in enumerate(chunks, 1):
+                    graph.add(
+                        f'main:{number}',
+                        lambda deps, chunk=chunk, number=number: self._request_main_text(
+                            chunk, tz_json, shards, ai_client, f'main:{number}'
+                        )
+                    )
+                results = graph.run()
+                response = self._merge_main_chunks(
+                    chunks,
+                    [results.get(f'main:{number}') or self._main_failed(str(graph.errors.get(f'main:{number}')))
+                     for number in range(1, len(chunks) + 1)]
+                )
+            else:
+                response = self._request_main_text(converted_text, tz_json, shards, ai_client)
+            return self._apply_main_prefill(self._record_main_failure(response), prefill)
+        
+        except Exception as e:
+            self.errors.append(f"Ошибка обработки основного промпта: {str(e)}")
+            return None
+    
+    async def _request_main_prompt_async(self, converted_text: str, ai_client) -> Optional[Dict]:
+        """Асинхронный вариант _request_main_prompt"""
+        try:
+            # Части документа × части шаблона: общее число одновременных запросов не больше лимита
+            self._main_slots = asyncio.Semaphore(max_parallel_requests())
+            tz_json, prefill, shards, chunks = await asyncio.to_thread(self._plan_main, converted_text)
+            if prefill and prefill.complete:
+                return self._apply_main_prefill(None, prefill)
+            if chunks:
+                responses = await asyncio.gather(
+                    *(self._request_main_text_async(chunk, tz_json, shards, ai_client, f'main:{number}')
+                      for number, chunk in enumerate(chunks, 1)),
+                    return_exceptions=True
+                )
+                response = await asyncio.to_thread(
+                    self._merge_main_chunks,
+                    chunks,
+                    [self._main_failed(str(response)) if isinstance(response, Exception) else response
+                     for response in responses]
+                )
+            else:
+                response = await self._request_main_text_async(converted_text, tz_json, shards, ai_client)
+            response = await asyncio.to_thread(self._record_main_failure, response)
+            return self._apply_main_prefill(response, prefill)
+        
+        except Exception as e:
+            self.errors.append(f"Ошибка обработки основного промпта: {str(e)}")
+            return None
+    
+    def _save_main_result(self, response: Dict, output_prefix: str) -> Optional[Dict]:
+        """Сохраняет JSON основного промпта и конвертирует его в Excel"""
+        try:
             logger.info(f"[{self.task_id}] 💾 Сохранение JSON результата...")
             # Сохраняем JSON
             json_filename = f"{output_prefix}_filled.json"
@@ -315,7 +894,7 @@ class ScenarioExecutor:
             json_path.parent.mkdir(parents=True, exist_ok=True)
             
             with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(result['json'], f, ensure_ascii=False, indent=2)
+                json.dump(response['json'], f, ensure_ascii=False, indent=2)
             logger.info(f"[{self.task_id}] ✅ JSON сохранен: {json_path.name} ({json_path.stat().st_size:,} байт)")
             
             # Конвертируем в Excel
@@ -325,7 +904,7 @@ class ScenarioExecutor:
             
             try:
                 excel_converter = JSONToExcelConverter()
-                excel_converter.convert(result['json'], str(excel_path))
+                excel_converter.convert(response['json'], str(excel_path))
                 excel_available = True
                 logger.info(f"[{self.task_id}] ✅ Excel создан: {excel_path.name} ({excel_path.stat().st_size:,} байт)")
             except Exception as e:
@@ -340,130 +919,272 @@ class ScenarioExecutor:
                 'excel_file': excel_filename if excel_available else None,
                 'excel_path': str(excel_path) if excel_available else None,
                 'excel_size': excel_path.stat().st_size if excel_available else 0,
-                'usage': result.get('usage', {}),
-                'prompt_size': prompt_size
+                'usage': response.get('usage', {}),
+                'prompt_size': response.get('prompt_size', 0),
+                'glossary_version': self.prompts.main_compiled().glossary_version
             }
         
         except Exception as e:
             self.errors.append(f"Ошибка обработки основного промпта: {str(e)}")
             return None
     
-    def _process_additional_prompt(self, prompt_type: str, converted_text: str, 
-                                   ai_client, output_prefix: str, excel_path: Optional[str] = None,
-                                   excel_lock: Optional[threading.Lock] = None) -> Optional[Dict]:
-        """Обрабатывает дополнительный промпт (CSV → Excel лист)"""
+    def _create_empty_workbook(self, output_prefix: str) -> str:
+        """Создает пустой Excel файл для листов дополнительных промптов"""
+        logger.info(f"[{self.task_id}] 📊 Создание нового Excel файла...")
+        from openpyxl import Workbook
+        excel_filename = f"{output_prefix}_filled.xlsx"
+        excel_path = self.results_folder / excel_filename
+        excel_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        wb = Workbook()
+        # Удаляем дефолтный лист если он пустой
+        if len(wb.sheetnames) == 1:
+            wb.remove(wb.active)
+        wb.save(str(excel_path))
+        logger.info(f"[{self.task_id}] ✅ Excel файл создан: {excel_path}")
+        return str(excel_path)
+    
+    def _render_additional(self, prompt_type: str, converted_text: str) -> str:
+        """Шаблон дополнительного промпта с подставленным текстом ТЗ"""
+        prompt_template = self.prompts.additional_template(prompt_type)
+        
+        # Подставляем текст ТЗ (может быть несколько плейсхолдеров)
+        final_prompt = prompt_template.replace('{текст ТЗ}', converted_text)
+        # Также обрабатываем вариант без фигурных скобок
+        final_prompt = final_prompt.replace('Текст ТЗ:', converted_text)
+        final_prompt = final_prompt.replace('Текст ТЗ\n', converted_text + '\n')
+        return final_prompt
+    
+    def _additional_chunks(self, prompt_type: str, converted_text: str) -> Optional[List[str]]:
+        """Окна текста документа, если дополнительный промпт не помещается в бюджет токенов; None - один запрос"""
+        prompt_file = self.project_root / self.scenario['prompts'][prompt_type]['file']
+        if not prompt_file.exists() or CSVToExcelAppender is None:
+            # Ошибку конфигурации запишет _build_additional_prompt
+            return None
+        
+        max_chars, overlap = chunk_settings()
+        prompt_size = len(self._render_additional(prompt_type, converted_text))
+        if prompt_size <= max_chars:
+            return None
+        
+        base_size = len(self._render_additional(prompt_type, ''))
+        # Текст ТЗ может подставляться в несколько плейсхолдеров шаблона
+        copies = max(1, round((prompt_size - base_size) / max(1, len(converted_text))))
+        text_budget = (max_chars - base_size) // copies
+        if text_budget <= overlap:
+            logger.warning(f"[{self.task_id}] ⚠️  Промпт {prompt_type} без текста документа не помещается в бюджет "
+                           f"{max_chars // 4:,} токенов, документ отправляется целиком")
+            return None
+        
+        chunks = split_text(converted_text, text_budget, overlap)
+        logger.info(f"[{self.task_id}] 📚 Промпт {prompt_type} ~{prompt_size // 4:,} токенов больше бюджета "
+                    f"{max_chars // 4:,}: документ разбит на {len(chunks)} частей "
+                    f"(перекрытие {overlap:,} символов)")
+        return chunks
+    
+    def _build_additional_prompt(self, prompt_type: str, converted_text: str) -> Optional[str]:
+        """Строит дополнительный промпт (None - если промпт недоступен или задача отменена)"""
+        logger.info(f"[{self.task_id}] 📋 Чтение конфигурации промпта {prompt_type}")
+        prompt_config = self.scenario['prompts'][prompt_type]
+        prompt_file = self.project_root / prompt_config['file']
+        
+        if not prompt_file.exists():
+            error_msg = f"Файл промпта не найден: {prompt_file}"
+            logger.error(f"[{self.task_id}] ❌ {error_msg}")
+            self.errors.append(error_msg)
+            return None
+        
+        if CSVToExcelAppender is None:
+            error_msg = f"CSVToExcelAppender не доступен для промпта {prompt_type}"
+            logger.error(f"[{self.task_id}] ❌ {error_msg}")
+            self.errors.append(error_msg)
+            return None
+        
+        logger.info(f"[{self.task_id}] 📖 Чтение шаблона промпта: {prompt_file.name}")
+        final_prompt = self._render_additional(prompt_type, converted_text)
+        
+        prompt_size = len(final_prompt)
+        logger.info(f"[{self.task_id}] ✅ Промпт {prompt_type} подготовлен: {prompt_size:,} символов (~{prompt_size // 4:,} токенов)")
+        
+        # Проверяем отмену перед отправкой
+        if self._is_cancelled():
+            logger.info(f"[{self.task_id}] ⛔ Задача отменена перед отправкой промпта {prompt_type}")
+            return None
+        
+        # Отправляем в AI (текстовый ответ, не JSON)
+        logger.info(f"[{self.task_id}] 🚀 Отправка промпта {prompt_type} в AI...")
+        return final_prompt
+    
+    def _handle_additional_response(self, prompt_type: str, result: Dict) -> Dict:
+        """Проверяет ответ ИИ на дополнительный промпт и извлекает из него CSV (ошибка - в поле error)"""
+        logger.info(f"[{self.task_id}] 📥 Получен ответ от AI для {prompt_type} (success: {result.get('success')})")
+        
+        if not result['success']:
+            error_msg = result.get('error', 'Неизвестная ошибка')
+            logger.error(f"[{self.task_id}] ❌ Ошибка обработки промпта {prompt_type}: {error_msg}")
+            return self._additional_failed(error_msg)
+        
+        logger.info(f"[{self.task_id}] 📄 Парсинг CSV из ответа для {prompt_type}...")
+        response_text = result.get('text', '')
+        logger.info(f"[{self.task_id}] 📏 Размер ответа: {len(response_text):,} символов")
+        
+        csv_text = CSVToExcelAppender().parse_csv_from_text(response_text)
+        logger.info(f"[{self.task_id}] ✅ CSV распарсен: {len(csv_text):,} символов")
+        
+        return {
+            'csv_text': csv_text,
+            'usage': result.get('usage', {}),
+            'error': None
+        }
+    
+    @staticmethod
+    def _additional_failed(error: str) -> Dict:
+        """Ответ дополнительного промпта (или его части), который не удалось получить"""
+        return {'csv_text': None, 'usage': {}, 'error': error}
+    
+    def _record_additional_failure(self, prompt_type: str, response: Optional[Dict]) -> Optional[Dict]:
+        """Ответ дополнительного промпта; если его нет - ошибка задачи (кроме отмены) и None"""
+        if response is None or response.get('csv_text') is not None:
+            return response
+        if not self._is_cancelled():
+            self.errors.append(f"Ошибка обработки промпта {prompt_type}: {response.get('error') or 'нет ответа'}")
+        return None
+    
+    def _merge_additional_chunks(self, prompt_type: str, chunks: List[str],
+                                 responses: List[Optional[Dict]]) -> Dict:
+        """
+        Объединяет CSV ответы дополнительного промпта по частям документа
+        
+        Сбои отдельных частей записываются в warnings; если не обработана ни одна
+        часть - ответ с ошибкой.
+        """
+        answered, failed = [], []
+        for number, response in enumerate(responses, 1):
+            if response and response.get('csv_text') is not None:
+                answered.append(response)
+            else:
+                failed.append((number, (response or {}).get('error') or 'нет ответа'))
+        if not answered:
+            reasons = '; '.join(f"{number}: {error}" for number, error in failed)
+            return self._additional_failed(f"не обработана ни одна часть документа ({reasons})")
+        for number, error in failed:
+            self.warnings.append(f"Промпт {prompt_type}: часть документа {number} из {len(chunks)} не обработана "
+                                 f"({error}), позиции из нее не извлечены")
+        
+        usage = {
+            key: sum((response.get('usage') or {}).get(key) or 0 for response in answered)
+            for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')
+        }
+        logger.info(f"[{self.task_id}] 📚 Промпт {prompt_type}: объединены ответы {len(answered)} из {len(chunks)} частей документа")
+        return {
+            'csv_text': merge_csv_answers([response['csv_text'] for response in answered]),
+            'usage': usage,
+            'error': None
+        }
+    
+    def _request_additional_text(self, prompt_type: str, converted_text: str, ai_client,
+                                 name: str) -> Optional[Dict]:
+        """Дополнительный промпт для текста (документа или его части); None - промпт не отправлен"""
+        final_prompt = self._build_additional_prompt(prompt_type, converted_text)
+        if final_prompt is None:
+            return None
+        result = ai_client.process_prompt_text(final_prompt, use_cache=self._use_cache(prompt_type),
+                                               on_progress=self._stream_progress(name))
+        return self._handle_additional_response(prompt_type, result)
+    
+    async def _request_additional_text_async(self, prompt_type: str, converted_text: str, ai_client,
+                                             name: str) -> Optional[Dict]:
+        """Асинхронный вариант _request_additional_text"""
+        final_prompt = await asyncio.to_thread(self._build_additional_prompt, prompt_type, converted_text)
+        if final_prompt is None:
+            return None
+        result = await ai_client.process_prompt_text(final_prompt, use_cache=self._use_cache(prompt_type),
+                                                     on_progress=self._stream_progress(name))
+        return self._handle_additional_response(prompt_type, result)
+    
+    def _request_additional_prompt(self, prompt_type: str, converted_text: str, ai_client) -> Optional[Dict]:
+        """Отправляет дополнительный промпт в ИИ (по частям, если документ длинный) и извлекает CSV из ответа"""
         try:
-            logger.info(f"[{self.task_id}] 📋 Чтение конфигурации промпта {prompt_type}")
-            prompt_config = self.scenario['prompts'][prompt_type]
-            prompt_file = self.project_root / prompt_config['file']
-            
-            if not prompt_file.exists():
-                error_msg = f"Файл промпта не найден: {prompt_file}"
-                logger.error(f"[{self.task_id}] ❌ {error_msg}")
-                self.errors.append(error_msg)
-                return None
-            
-            logger.info(f"[{self.task_id}] 📖 Чтение шаблона промпта: {prompt_file.name}")
-            # Читаем промпт
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt_template = f.read()
-            
-            # Подставляем текст ТЗ (может быть несколько плейсхолдеров)
-            final_prompt = prompt_template.replace('{текст ТЗ}', converted_text)
-            # Также обрабатываем вариант без фигурных скобок
-            final_prompt = final_prompt.replace('Текст ТЗ:', converted_text)
-            final_prompt = final_prompt.replace('Текст ТЗ\n', converted_text + '\n')
-            
-            prompt_size = len(final_prompt)
-            logger.info(f"[{self.task_id}] ✅ Промпт {prompt_type} подготовлен: {prompt_size:,} символов (~{prompt_size // 4:,} токенов)")
-            
-            # Проверяем отмену перед отправкой
-            if self.status_manager and self.task_id and self.status_manager.is_cancelled(self.task_id):
-                logger.info(f"[{self.task_id}] ⛔ Задача отменена перед отправкой промпта {prompt_type}")
-                return None
-            
-            # Отправляем в AI (текстовый ответ, не JSON)
-            logger.info(f"[{self.task_id}] 🚀 Отправка промпта {prompt_type} в AI...")
-            result = ai_client.process_prompt_text(final_prompt)
-            logger.info(f"[{self.task_id}] 📥 Получен ответ от AI для {prompt_type} (success: {result.get('success')})")
-            
-            if not result['success']:
-                error_msg = result.get('error', 'Неизвестная ошибка')
-                logger.error(f"[{self.task_id}] ❌ Ошибка обработки промпта {prompt_type}: {error_msg}")
-                self.errors.append(f"Ошибка обработки промпта {prompt_type}: {error_msg}")
-                return None
-            
-            logger.info(f"[{self.task_id}] 📄 Парсинг CSV из ответа для {prompt_type}...")
-            response_text = result.get('text', '')
-            logger.info(f"[{self.task_id}] 📏 Размер ответа: {len(response_text):,} символов")
+            chunks = self._additional_chunks(prompt_type, converted_text)
+            if not chunks:
+                response = self._request_additional_text(prompt_type, converted_text, ai_client, prompt_type)
+                return self._record_additional_failure(prompt_type, response)
             
-            # Если нет Excel файла, создаем пустой
-            if not excel_path or not Path(excel_path).exists():
-                logger.info(f"[{self.task_id}] 📊 Создание нового Excel файла...")
-                from openpyxl import Workbook
-                excel_filename = f"{output_prefix}_filled.xlsx"
-                excel_path = self.results_folder / excel_filename
-                excel_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                wb = Workbook()
-                # Удаляем дефолтный лист если он пустой
-                if len(wb.sheetnames) == 1:
-                    wb.remove(wb.active)
-                wb.save(str(excel_path))
-                excel_path = str(excel_path)
-                logger.info(f"[{self.task_id}] ✅ Excel файл создан: {excel_path}")
-            
-            # Парсим CSV из ответа
-            if CSVToExcelAppender is None:
-                error_msg = f"CSVToExcelAppender не доступен для промпта {prompt_type}"
-                logger.error(f"[{self.task_id}] ❌ {error_msg}")
-                self.errors.append(error_msg)
-                return None
-            
-            csv_appender = CSVToExcelAppender()
-            csv_text = csv_appender.parse_csv_from_text(result['text'])
-            logger.info(f"[{self.task_id}] ✅ CSV распарсен: {len(csv_text):,} символов")
+            graph = TaskGraph(max_workers=min(len(chunks), max_parallel_requests()))
+            for number, chunk in enumerate(chunks, 1):
+                graph.add(
+                    f'{prompt_type}:{number}',
+                    lambda deps, chunk=chunk, number=number: self._request_additional_text(
+                        prompt_type, chunk, ai_client, f'{prompt_type}:{number}'
+                    )
+                )
+            results = graph.run()
+            response = self._merge_additional_chunks(
+                prompt_type,
+                chunks,
+                [results.get(f'{prompt_type}:{number}')
+                 or self._additional_failed(str(graph.errors.get(f'{prompt_type}:{number}') or 'нет ответа'))
+                 for number in range(1, len(chunks) + 1)]
+            )
+            return self._record_additional_failure(prompt_type, response)
+        
+        except Exception as e:
+            self.errors.append(f"Ошибка обработки промпта {prompt_type}: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def _request_additional_prompt_async(self, prompt_type: str, converted_text: str,
+                                               ai_client) -> Optional[Dict]:
+        """Асинхронный вариант _request_additional_prompt"""
+        try:
+            chunks = await asyncio.to_thread(self._additional_chunks, prompt_type, converted_text)
+            if not chunks:
+                response = await self._request_additional_text_async(prompt_type, converted_text, ai_client, prompt_type)
+                return await asyncio.to_thread(self._record_additional_failure, prompt_type, response)
             
-            # Имена листов
-            sheet_names = {
-                'instrument_tooling': 'Инструмент+Оснастка',
-                'services': 'Услуги',
-                'spare_parts': 'ЗИП'
-            }
+            slots = asyncio.Semaphore(max_parallel_requests())
             
-            # Добавляем лист в Excel (с блокировкой для потокобезопасности)
-            logger.info(f"[{self.task_id}] 📊 Добавление листа '{sheet_names.get(prompt_type, prompt_type)}' в Excel...")
-            try:
-                if excel_lock:
-                    with excel_lock:
-                        csv_appender.add_csv_sheet(
-                            excel_path,
-                            csv_text,
-                            sheet_names.get(prompt_type, prompt_type)
-                        )
-                else:
-                    csv_appender.add_csv_sheet(
-                        excel_path,
-                        csv_text,
-                        sheet_names.get(prompt_type, prompt_type)
+            async def request_chunk(number: int, chunk: str) -> Optional[Dict]:
+                async with slots:
+                    return await self._request_additional_text_async(
+                        prompt_type, chunk, ai_client, f'{prompt_type}:{number}'
                     )
-                sheet_added = True
-                logger.info(f"[{self.task_id}] ✅ Лист '{sheet_names.get(prompt_type, prompt_type)}' успешно добавлен")
-            except Exception as e:
-                logger.error(f"[{self.task_id}] ⚠️  Ошибка добавления листа {prompt_type}: {e}")
-                import traceback
-                traceback.print_exc()
-                sheet_added = False
             
-            return {
-                'sheet_added': sheet_added,
-                'sheet_name': sheet_names.get(prompt_type, prompt_type),
-                'usage': result.get('usage', {})
-            }
+            responses = await asyncio.gather(
+                *(request_chunk(number, chunk) for number, chunk in enumerate(chunks, 1)),
+                return_exceptions=True
+            )
+            response = self._merge_additional_chunks(
+                prompt_type,
+                chunks,
+                [self._additional_failed(str(response)) if isinstance(response, Exception) else response
+                 for response in responses]
+            )
+            return await asyncio.to_thread(self._record_additional_failure, prompt_type, response)
         
         except Exception as e:
             self.errors.append(f"Ошибка обработки промпта {prompt_type}: {str(e)}")
             import traceback
             traceback.print_exc()
             return None
-
+    
+    def _append_additional_sheet(self, prompt_type: str, response: Dict, excel_path: str) -> Optional[Dict]:
+        """Добавляет CSV дополнительного промпта отдельным листом в Excel"""
+        sheet_name = self.SHEET_NAMES.get(prompt_type, prompt_type)
+        logger.info(f"[{self.task_id}] 📊 Добавление листа '{sheet_name}' в Excel...")
+        try:
+            CSVToExcelAppender().add_csv_sheet(excel_path, response['csv_text'], sheet_name)
+            sheet_added = True
+            logger.info(f"[{self.task_id}] ✅ Лист '{sheet_name}' успешно добавлен")
+        except Exception as e:
+            logger.error(f"[{self.task_id}] ⚠️  Ошибка добавления листа {prompt_type}: {e}")
+            import traceback
+            traceback.print_exc()
+            sheet_added = False
+        
+        return {
+            'sheet_added': sheet_added,
+            'sheet_name': sheet_name,
+            'usage': response.get('usage', {})
+        }
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Хранилища статусов обработки для ProcessingStatus
+
+Статус задачи - словарь (status, stage, progress, message, metrics, errors, ...).
+Обновления атомарны на уровне полей: переданные поля заменяются, metrics
+сливаются с уже сохраненными, ошибки дописываются в конец списка. Весь файл
+статуса больше не перечитывается и не перезаписывается на каждый тик прогресса.
+
+Каждое изменение статуса получает возрастающий номер события (event_id) и снимок
+попадает в журнал событий задачи (последние MAX_EVENTS_PER_TASK). По журналу SSE
+поток прогресса продолжает отдачу с Last-Event-ID после переподключения.
+
+Ожидание события: memory будит ожидающих через Condition; sqlite проверяет
+PRAGMA data_version (меняется, когда другое соединение зафиксировало запись) с
+интервалом от EVENT_POLL_INTERVAL до EVENT_POLL_MAX_INTERVAL, а строку статуса
+читает только после изменения базы.
+
+Бэкенды:
+    memory - словарь в памяти процесса под общей блокировкой (один процесс)
+    sqlite - SQLite в режиме WAL, обновление одним UPDATE c json_set
+             (несколько процессов воркеров, статус переживает перезапуск)
+
+Настройки через переменные окружения:
+    PROCESSING_STATUS_BACKEND - sqlite или memory (по умолчанию sqlite)
+    PROCESSING_STATUS_DB - файл SQLite (по умолчанию storage/status/status.sqlite3)
+"""
+
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Статусы задач, которые еще выполняются
+ACTIVE_STATUSES = ('pending', 'processing')
+
+# Сколько последних событий хранить в журнале задачи
+MAX_EVENTS_PER_TASK = 200
+
+# Интервал опроса хранилища при ожидании события (бэкенды без уведомлений):
+# начинается с EVENT_POLL_INTERVAL и удваивается до EVENT_POLL_MAX_INTERVAL
+EVENT_POLL_INTERVAL = 0.1
+EVENT_POLL_MAX_INTERVAL = 1.0
+
+
+class StatusStore:
+    """Интерфейс хранилища статусов"""
+
+    def create(self, task_id: str, status: Dict[str, Any]) -> None:
+        """Создает (или заменяет) статус задачи"""
+        raise NotImplementedError
+
+    def update(self, task_id: str, fields: Dict[str, Any],
+               metrics: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Атомарно обновляет поля статуса
+
+        Args:
+            task_id: ID задачи
+            fields: Заменяемые поля верхнего уровня
+            metrics: Метрики, сливаемые с сохраненными
+
+        Returns:
+            False, если статуса нет
+        """
+        raise NotImplementedError
+
+    def append_error(self, task_id: str, error: str) -> bool:
+        """Дописывает ошибку в список errors"""
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Копия статуса (с полем event_id) или None"""
+        raise NotImplementedError
+
+    def latest_event_id(self, task_id: str) -> Optional[int]:
+        """Номер последнего события задачи или None, если статуса нет"""
+        raise NotImplementedError
+
+    def events_since(self, task_id: str, last_event_id: int, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        """События задачи с номером больше last_event_id: [(event_id, снимок статуса), ...]"""
+        raise NotImplementedError
+
+    def wait_for_event(self, task_id: str, last_event_id: int, timeout: float) -> bool:
+        """
+        Ждет событие с номером больше last_event_id
+
+        Returns:
+            True - есть новое событие или статус удален, False - истек таймаут
+        """
+        deadline = time.monotonic() + timeout
+        interval = EVENT_POLL_INTERVAL
+        while True:
+            latest = self.latest_event_id(task_id)
+            if latest is None or latest > last_event_id:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, EVENT_POLL_MAX_INTERVAL)
+
+    def delete(self, task_id: str) -> None:
+        raise NotImplementedError
+
+    def cleanup(self, max_age_seconds: float, active_max_age_seconds: float) -> int:
+        """
+        Удаляет статусы, не обновлявшиеся дольше max_age_seconds
+        (активные - дольше active_max_age_seconds)
+
+        Returns:
+            Количество удаленных статусов
+        """
+        raise NotImplementedError
+
+
+def _elapsed(status: Dict[str, Any], started: float, now: float) -> None:
+    metrics = status.get('metrics')
+    if isinstance(metrics, dict):
+        metrics['time_elapsed'] = now - started
+
+
+class _MemoryEntry:
+    """Статус задачи в памяти и журнал его событий"""
+
+    def __init__(self, status: Dict[str, Any]):
+        self.started = self.updated = time.time()
+        self.status = status
+        self.event_id = 0
+        self.events = deque(maxlen=MAX_EVENTS_PER_TASK)
+
+
+class MemoryStatusStore(StatusStore):
+    """Статусы в памяти процесса"""
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._entries: Dict[str, _MemoryEntry] = {}
+
+    def _commit(self, entry: _MemoryEntry):
+        """Фиксирует изменение: событие в журнал и уведомление ожидающих (под блокировкой)"""
+        entry.updated = time.time()
+        entry.event_id += 1
+        entry.events.append((entry.event_id, copy.deepcopy(entry.status)))
+        self._changed.notify_all()
+
+    def create(self, task_id: str, status: Dict[str, Any]) -> None:
+        with self._changed:
+            entry = _MemoryEntry(copy.deepcopy(status))
+            # Номера событий продолжают предыдущий статус с тем же task_id
+            previous = self._entries.get(task_id)
+            if previous is not None:
+                entry.event_id = previous.event_id
+            self._entries[task_id] = entry
+            self._commit(entry)
+
+    def update(self, task_id: str, fields: Dict[str, Any],
+               metrics: Optional[Dict[str, Any]] = None) -> bool:
+        fields = copy.deepcopy(fields)
+        with self._changed:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return False
+            status = entry.status
+            status.update(fields)
+            if metrics:
+                if not isinstance(status.get('metrics'), dict):
+                    status['metrics'] = {}
+                status['metrics'].update(copy.deepcopy(metrics))
+            _elapsed(status, entry.started, time.time())
+            self._commit(entry)
+            return True
+
+    def append_error(self, task_id: str, error: str) -> bool:
+        with self._changed:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return False
+            entry.status.setdefault('errors', []).append(error)
+            self._commit(entry)
+            return True
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._changed:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            return {**copy.deepcopy(entry.status), 'event_id': entry.event_id}
+
+    def latest_event_id(self, task_id: str) -> Optional[int]:
+        with self._changed:
+            entry = self._entries.get(task_id)
+            return entry.event_id if entry else None
+
+    def events_since(self, task_id: str, last_event_id: int, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._changed:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return []
+            events = [(event_id, status) for event_id, status in entry.events if event_id > last_event_id]
+        return [(event_id, {**copy.deepcopy(status), 'event_id': event_id}) for event_id, status in events[:limit]]
+
+    def wait_for_event(self, task_id: str, last_event_id: int, timeout: float) -> bool:
+        def ready():
+            entry = self._entries.get(task_id)
+            return entry is None or entry.event_id > last_event_id
+
+        with self._changed:
+            return self._changed.wait_for(ready, timeout)
+
+    def delete(self, task_id: str) -> None:
+        with self._changed:
+            self._entries.pop(task_id, None)
+            self._changed.notify_all()
+
+    def cleanup(self, max_age_seconds: float, active_max_age_seconds: float) -> int:
+        now = time.time()
+        with self._changed:
+            expired = [
+                task_id for task_id, entry in self._entries.items()
+                if now - entry.updated > max_age_seconds
+                and (entry.status.get('status') not in ACTIVE_STATUSES or now - entry.updated > active_max_age_seconds)
+            ]
+            for task_id in expired:
+                del self._entries[task_id]
+            if expired:
+                self._changed.notify_all()
+        return len(expired)
+
+
+class SQLiteStatusStore(StatusStore):
+    """Статусы в SQLite (WAL): общие для всех процессов на машине"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение SQLite для текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS statuses ('
+                'task_id TEXT PRIMARY KEY, status TEXT, started REAL, updated REAL, '
+                'event_id INTEGER NOT NULL DEFAULT 0, data TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS statuses_updated ON statuses (updated)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS status_events ('
+                'task_id TEXT, event_id INTEGER, data TEXT, PRIMARY KEY (task_id, event_id))'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, task_id: str, sql: str, params) -> bool:
+        """Изменение статуса и запись события в журнал одной транзакцией"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            changed = conn.execute(sql, params).rowcount > 0
+            if changed:
+                conn.execute(
+                    'INSERT OR REPLACE INTO status_events (task_id, event_id, data) '
+                    'SELECT task_id, event_id, data FROM statuses WHERE task_id = ?',
+                    (task_id,)
+                )
+                conn.execute(
+                    'DELETE FROM status_events WHERE task_id = ? AND event_id <= '
+                    '(SELECT event_id FROM statuses WHERE task_id = ?) - ?',
+                    (task_id, task_id, MAX_EVENTS_PER_TASK)
+                )
+            conn.execute('COMMIT')
+            return changed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def create(self, task_id: str, status: Dict[str, Any]) -> None:
+        now = time.time()
+        # Номера событий продолжают предыдущий статус с тем же task_id, чтобы Last-Event-ID не путался
+        self._write(
+            task_id,
+            'INSERT INTO statuses (task_id, status, started, updated, event_id, data) VALUES (?, ?, ?, ?, 1, ?) '
+            'ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, started = excluded.started, '
+            'updated = excluded.updated, event_id = statuses.event_id + 1, data = excluded.data',
+            (task_id, status.get('status'), now, now, json.dumps(status, ensure_ascii=False))
+        )
+
+    def update(self, task_id: str, fields: Dict[str, Any],
+               metrics: Optional[Dict[str, Any]] = None) -> bool:
+        # Как у MemoryStatusStore: поля верхнего уровня заменяются целиком (json_patch слил бы
+        # вложенные словари и удалил null), сливаются только metrics - по ключам
+        expression = 'data'
+        params: List[Any] = []
+        if metrics:
+            expression = ("CASE WHEN json_type(data, '$.metrics') = 'object' THEN data "
+                          "ELSE json_set(data, '$.metrics', json('{}')) END")
+        for prefix, values in (('$', fields), ('$.metrics', metrics or {})):
+            if not values:
+                continue
+            expression = f"json_set({expression}, {', '.join('?, json(?)' for _ in values)})"
+            for key, value in values.items():
+                params += [f'{prefix}."{key}"', json.dumps(value, ensure_ascii=False)]
+
+        now = time.time()
+        return self._write(
+            task_id,
+            f"UPDATE statuses SET data = json_set({expression}, '$.metrics.time_elapsed', ? - started), "
+            f"status = COALESCE(?, status), updated = ?, event_id = event_id + 1 WHERE task_id = ?",
+            params + [now, fields.get('status'), now, task_id]
+        )
+
+    def append_error(self, task_id: str, error: str) -> bool:
+        return self._write(
+            task_id,
+            "UPDATE statuses SET data = json_insert("
+            "CASE WHEN json_type(data, '$.errors') = 'array' THEN data ELSE json_set(data, '$.errors', json('[]')) END, "
+            "'$.errors[#]', ?), updated = ?, event_id = event_id + 1 WHERE task_id = ?",
+            (error, time.time(), task_id)
+        )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            'SELECT data, event_id FROM statuses WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return {**json.loads(row[0]), 'event_id': row[1]} if row else None
+
+    def latest_event_id(self, task_id: str) -> Optional[int]:
+        row = self._connect().execute('SELECT event_id FROM statuses WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def events_since(self, task_id: str, last_event_id: int, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self._connect().execute(
+            'SELECT event_id, data FROM status_events WHERE task_id = ? AND event_id > ? ORDER BY event_id LIMIT ?',
+            (task_id, last_event_id, limit)
+        ).fetchall()
+        return [(event_id, {**json.loads(data), 'event_id': event_id}) for event_id, data in rows]
+
+    def wait_for_event(self, task_id: str, last_event_id: int, timeout: float) -> bool:
+        # data_version - счетчик в памяти соединения, его проверка не читает таблицы;
+        # статус перечитывается, только если другое соединение что-то записало
+        conn = self._connect()
+        deadline = time.monotonic() + timeout
+        interval = EVENT_POLL_INTERVAL
+        version = None
+        while True:
+            current = conn.execute('PRAGMA data_version').fetchone()[0]
+            if current != version:
+                version = current
+                latest = self.latest_event_id(task_id)
+                if latest is None or latest > last_event_id:
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, EVENT_POLL_MAX_INTERVAL)
+
+    def delete(self, task_id: str) -> None:
+        conn = self._connect()
+        conn.execute('DELETE FROM statuses WHERE task_id = ?', (task_id,))
+        conn.execute('DELETE FROM status_events WHERE task_id = ?', (task_id,))
+
+    def cleanup(self, max_age_seconds: float, active_max_age_seconds: float) -> int:
+        now = time.time()
+        placeholders = ', '.join('?' for _ in ACTIVE_STATUSES)
+        conn = self._connect()
+        cursor = conn.execute(
+            f'DELETE FROM statuses WHERE updated < ? '
+            f'AND (status IS NULL OR status NOT IN ({placeholders}) OR updated < ?)',
+            (now - max_age_seconds, *ACTIVE_STATUSES, now - active_max_age_seconds)
+        )
+        if cursor.rowcount:
+            conn.execute('DELETE FROM status_events WHERE task_id NOT IN (SELECT task_id FROM statuses)')
+        return cursor.rowcount
+
+
+_stores: Dict[str, StatusStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_status_store(status_dir: Optional[Path] = None) -> StatusStore:
+    """
+    Возвращает хранилище статусов процесса (общее для всех экземпляров ProcessingStatus)
+
+    Args:
+        status_dir: Папка статусов (для файла SQLite по умолчанию)
+    """
+    backend = os.environ.get('PROCESSING_STATUS_BACKEND', 'sqlite').lower()
+    if backend == 'memory':
+        key = 'memory'
+    else:
+        if backend != 'sqlite':
+            logger.warning(f"⚠️  Неизвестный PROCESSING_STATUS_BACKEND={backend}, используется sqlite")
+        if status_dir is None:
+            status_dir = Path(__file__).parent.parent / 'storage' / 'status'
+        key = os.environ.get('PROCESSING_STATUS_DB') or str(Path(status_dir) / 'status.sqlite3')
+
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = MemoryStatusStore() if key == 'memory' else SQLiteStatusStore(key)
+            _stores[key] = store
+        return store
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Модуль для выполнения графа задач с зависимостями
+Задача запускается, как только завершены все ее зависимости
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """Граф задач: независимые задачи выполняются параллельно, зависимые - после своих зависимостей"""
+
+    def __init__(self, max_workers: Optional[int] = None, on_task_done: Optional[Callable[[str, Any], None]] = None):
+        """
+        Args:
+            max_workers: Максимальное количество потоков (по умолчанию - по числу задач)
+            on_task_done: Callback (имя задачи, результат), вызывается после завершения каждой задачи
+        """
+        self.max_workers = max_workers
+        self.on_task_done = on_task_done
+        self._tasks: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._deps: Dict[str, tuple] = {}
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], depends_on: Iterable[str] = ()) -> 'TaskGraph':
+        """
+        Добавляет задачу в граф
+
+        Args:
+            name: Уникальное имя задачи
+            func: Функция, принимающая словарь {имя зависимости: результат}.
+                  Для упавших зависимостей передается None
+            depends_on: Имена задач, которые должны завершиться раньше
+        """
+        if name in self._tasks:
+            raise ValueError(f"Задача уже добавлена: {name}")
+        self._tasks[name] = func
+        self._deps[name] = tuple(depends_on)
+        return self
+
+    def _validate(self):
+        """Проверяет, что все зависимости существуют и нет циклов"""
+        for name, deps in self._deps.items():
+            for dep in deps:
+                if dep not in self._tasks:
+                    raise ValueError(f"Задача {name} зависит от неизвестной задачи: {dep}")
+
+        visited, in_stack = set(), set()
+
+        def visit(node: str):
+            if node in in_stack:
+                raise ValueError(f"Циклическая зависимость в графе задач: {node}")
+            if node in visited:
+                return
+            in_stack.add(node)
+            for dep in self._deps[node]:
+                visit(dep)
+            in_stack.discard(node)
+            visited.add(node)
+
+        for name in self._tasks:
+            visit(name)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Выполняет граф задач
+
+        Returns:
+            Словарь {имя задачи: результат}. Исключения задач собираются в self.errors
+        """
+        self._validate()
+        if not self._tasks:
+            return self.results
+
+        pending = dict(self._deps)
+        done = set()
+        max_workers = self.max_workers or len(self._tasks)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+
+            def submit_ready():
+                for name, deps in list(pending.items()):
+                    if all(dep in done for dep in deps):
+                        dep_results = {dep: self.results.get(dep) for dep in deps}
+                        running[executor.submit(self._tasks[name], dep_results)] = name
+                        del pending[name]
+
+            submit_ready()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Задача {name} завершилась с ошибкой: {e}")
+                        self.errors[name] = e
+                        self.results[name] = None
+                    done.add(name)
+                    if self.on_task_done:
+                        try:
+                            self.on_task_done(name, self.results[name])
+                        except Exception as e:
+                            logger.warning(f"⚠️  Ошибка в on_task_done для {name}: {e}")
+                submit_ready()
+
+        return self.results
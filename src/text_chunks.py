@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Обработка очень длинных документов частями
+
+Если основной промпт с полным текстом документа не помещается в бюджет токенов,
+текст делится на перекрывающиеся окна по границам строк (перекрытие не дает
+потерять параметр, попавший на границу окна). Каждое окно обрабатывается
+отдельным запросом с тем же шаблоном, а ответы объединяются по параметрам:
+выбирается значение с наибольшей "уверенностью", при равной - с указанным
+источником, затем из более раннего окна. Другие найденные значения параметра
+дописываются в "комментарий", чтобы расхождения в ТЗ были видны.
+
+Дополнительные промпты (таблицы CSV) делятся на окна так же; их ответы
+склеиваются построчно, а строки, уже полученные из предыдущих окон (заголовок,
+позиции из перекрытия), пропускаются.
+
+Настройки через переменные окружения:
+    MAIN_PROMPT_MAX_TOKENS - бюджет основного промпта, токенов (по умолчанию 100000;
+        оценка ~4 символа на токен, как в AI клиентах)
+    MAIN_CHUNK_OVERLAP_CHARS - перекрытие соседних окон, символов (по умолчанию 2000)
+"""
+
+import copy
+import os
+from typing import Dict, List, Optional, Tuple
+
+from tz_compact import iter_parameters
+
+CHARS_PER_TOKEN = 4
+CONFIDENCE_RANK = {'высокая': 3, 'средняя': 2, 'низкая': 1}
+
+
+def chunk_settings() -> Tuple[int, int]:
+    """(бюджет промпта в символах, перекрытие окон в символах)"""
+    max_tokens = int(os.environ.get('MAIN_PROMPT_MAX_TOKENS', 100000))
+    overlap = int(os.environ.get('MAIN_CHUNK_OVERLAP_CHARS', 2000))
+    return max_tokens * CHARS_PER_TOKEN, overlap
+
+
+def split_text(text: str, max_chars: int, overlap_chars: int = 0) -> List[str]:
+    """
+    Делит текст на окна не длиннее max_chars по границам строк
+
+    Соседние окна перекрываются примерно на overlap_chars (целыми строками);
+    строка длиннее окна режется по символам.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    overlap_chars = min(overlap_chars, max_chars // 2)
+
+    lines: List[str] = []
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            lines.append(line[:max_chars])
+            line = line[max_chars:]
+        lines.append(line)
+
+    chunks: List[str] = []
+    start = 0
+    while start < len(lines):
+        end, size = start, 0
+        while end < len(lines) and size + len(lines[end]) <= max_chars:
+            size += len(lines[end])
+            end += 1
+        chunks.append(''.join(lines[start:end]))
+        if end >= len(lines):
+            break
+
+        # Следующее окно начинается с последних строк текущего (перекрытие)
+        next_start, tail = end, 0
+        while next_start - 1 > start and tail + len(lines[next_start - 1]) <= overlap_chars:
+            next_start -= 1
+            tail += len(lines[next_start])
+        start = next_start
+    return chunks
+
+
+def _rank(parameter: Dict) -> Tuple[int, int]:
+    confidence = str(parameter.get('уверенность') or '').strip().lower()
+    return CONFIDENCE_RANK.get(confidence, 0), 1 if parameter.get('источник') else 0
+
+
+def _lookup(tree: Optional[Dict], path: Tuple[str, ...]) -> Optional[Dict]:
+    node = tree
+    for key in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node if isinstance(node, dict) else None
+
+
+def merge_chunk_answers(answers: List[Optional[Dict]], tz_json: Dict) -> Dict:
+    """
+    Объединяет ответы по окнам документа в одну структуру шаблона
+
+    Args:
+        answers: Ответы окон в порядке текста (None - окно не обработано)
+        tz_json: Полный шаблон
+
+    Returns:
+        Шаблон, где каждый параметр взят из лучшего ответа окна
+    """
+    result = copy.deepcopy(tz_json)
+    for path, _ in iter_parameters(tz_json):
+        candidates = [parameter for parameter in (_lookup(answer, path) for answer in answers) if parameter]
+        found = [parameter for parameter in candidates if parameter.get('значение') not in (None, '')]
+        target = _lookup(result, path)
+
+        if not found:
+            # Значение не найдено ни в одном окне - берем пояснение из первого ответа
+            if candidates:
+                target.update({key: value for key, value in candidates[0].items() if key != 'единица'})
+            continue
+
+        # max возвращает первый из равных - при равной оценке выигрывает более раннее окно
+        best = max(found, key=_rank)
+        target.update({key: value for key, value in best.items() if key != 'единица'})
+
+        others = []
+        for parameter in found:
+            value = str(parameter.get('значение'))
+            if value != str(best.get('значение')) and value not in others:
+                others.append(value)
+        if others:
+            note = f"Другие значения в ТЗ: {'; '.join(others)}"
+            target['комментарий'] = f"{target['комментарий']}. {note}" if target.get('комментарий') else note
+    return result
+
+
+def _row_key(line: str) -> str:
+    return ' '.join(line.lower().split())
+
+
+def merge_csv_answers(answers: List[str]) -> str:
+    """
+    Склеивает CSV ответы окон документа в одну таблицу
+
+    Заголовок берется из первого ответа; строки, уже встречавшиеся в предыдущих
+    ответах (без учета регистра и пробелов), не повторяются.
+    """
+    merged: List[str] = []
+    seen = set()
+    for answer in answers:
+        lines = [line for line in (answer or '').splitlines() if line.strip()]
+        merged.extend(line for line in lines if _row_key(line) not in seen)
+        seen.update(_row_key(line) for line in lines)
+    return '\n'.join(merged)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Компактное представление шаблона TZ.json в промпте
+
+В TZ.json каждый параметр повторяет поля "значение", "единица", "источник",
+"уверенность", "комментарий", а в промпт шаблон вставляется с indent=2 - это
+заметная доля входных токенов основного промпта. В компактном виде шаблон - список
+параметров с номерами, сгруппированный по секциям:
+
+    ## Технические характеристики > Рабочая зона
+    1. Макс. диаметр над станиной, мм
+    2. Макс. диаметр над суппортом, мм
+
+ИИ отвечает только по найденным параметрам: {"1": ["значение", "источник",
+"уверенность", "комментарий"], ...}. decode_answer разворачивает такой ответ в
+полную вложенную структуру TZ.json, которую ожидает JSONToExcelConverter.
+
+Включается в сценарии: "prompts": {"main": {"tz_encoding": "compact", ...}}
+"""
+
+import copy
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+VALUE_FIELD = 'значение'
+UNIT_FIELD = 'единица'
+# Поля ответа по параметру в порядке компактного ответа
+ANSWER_FIELDS = ('значение', 'источник', 'уверенность', 'комментарий')
+NOT_FOUND_COMMENT = 'Не указано в ТЗ'
+
+ENCODINGS = ('json', 'compact')
+
+ANSWER_FORMAT = """Шаблон передан в компактном виде: номер параметра, название и единица измерения,
+параметры сгруппированы по секциям ("Секция > Подсекция").
+
+Формат ответа (заменяет требование вернуть заполненный JSON-шаблон):
+верни один JSON-объект, где ключ - номер параметра строкой, а значение - массив
+[значение, источник, уверенность, комментарий] с теми же правилами заполнения полей.
+Включай только параметры, найденные в ТЗ; отсутствующие параметры не указывай.
+Пример: {"1": ["500", "таблица 1, строка 3", "высокая", null], "7": ["от 3500 до 5000", "раздел 2", "средняя", null]}"""
+
+
+def is_parameter(node: Any) -> bool:
+    """Лист шаблона - параметр с полем "значение\""""
+    return isinstance(node, dict) and VALUE_FIELD in node
+
+
+def iter_parameters(tz_json: Dict) -> Iterator[Tuple[Tuple[str, ...], Dict]]:
+    """(путь секций и параметра, параметр) в порядке шаблона"""
+    def walk(node: Dict, path: Tuple[str, ...]):
+        for key, value in node.items():
+            if is_parameter(value):
+                yield path + (key,), value
+            elif isinstance(value, dict):
+                yield from walk(value, path + (key,))
+
+    yield from walk(tz_json, ())
+
+
+def encode_template(tz_json: Dict) -> str:
+    """Компактный список параметров шаблона (номера с 1 в порядке шаблона)"""
+    lines: List[str] = []
+    section: Optional[Tuple[str, ...]] = None
+    for number, (path, parameter) in enumerate(iter_parameters(tz_json), 1):
+        if path[:-1] != section:
+            section = path[:-1]
+            if lines:
+                lines.append('')
+            lines.append(f"## {' > '.join(section)}")
+        unit = parameter.get(UNIT_FIELD)
+        lines.append(f"{number}. {path[-1]}, {unit}" if unit else f"{number}. {path[-1]}")
+    return '\n'.join(lines)
+
+
+def encode_for_prompt(tz_json: Dict) -> str:
+    """Компактный шаблон с описанием формата ответа для подстановки в промпт"""
+    return f"{encode_template(tz_json)}\n\n{ANSWER_FORMAT}"
+
+
+def is_compact_answer(answer: Any) -> bool:
+    """Ответ в компактном формате: объект с номерами параметров в качестве ключей (пустой - ничего не найдено)"""
+    return isinstance(answer, dict) and all(str(key).strip().isdigit() for key in answer)
+
+
+def _answer_fields(item: Any) -> Dict[str, Any]:
+    """Поля параметра из элемента ответа (массив или объект с именами полей)"""
+    if isinstance(item, dict):
+        return {field: item.get(field) for field in ANSWER_FIELDS}
+    if isinstance(item, (list, tuple)):
+        return {field: item[index] if index < len(item) else None for index, field in enumerate(ANSWER_FIELDS)}
+    # Одно значение без источника
+    return {VALUE_FIELD: item, 'источник': None, 'уверенность': None, 'комментарий': None}
+
+
+def decode_answer(answer: Dict, tz_json: Dict) -> Dict:
+    """
+    Разворачивает компактный ответ ИИ в полную структуру TZ.json
+
+    Args:
+        answer: {"<номер параметра>": [значение, источник, уверенность, комментарий]}
+        tz_json: Шаблон, по которому строился промпт
+
+    Returns:
+        Копия шаблона с заполненными параметрами; ненайденные параметры получают
+        комментарий "Не указано в ТЗ". Ответ не в компактном формате возвращается как есть.
+    """
+    if not is_compact_answer(answer):
+        return answer
+
+    items = {int(str(key).strip()): value for key, value in answer.items()}
+    result = copy.deepcopy(tz_json)
+    for number, (path, _) in enumerate(iter_parameters(tz_json), 1):
+        parameter = result
+        for key in path:
+            parameter = parameter[key]
+        if number in items:
+            parameter.update(_answer_fields(items[number]))
+        elif parameter.get(VALUE_FIELD) is None and not parameter.get('комментарий'):
+            parameter['комментарий'] = NOT_FOUND_COMMENT
+    return result
+
+
+def count_tokens(text: str) -> Tuple[int, str]:
+    """(число токенов, способ подсчета): tiktoken, если установлен, иначе ~4 символа на токен"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding('o200k_base').encode(text)), 'tiktoken o200k_base'
+    except ImportError:
+        return len(text) // 4, '~4 символа на токен'
+
+
+def token_report(tz_json: Dict) -> Dict[str, Dict[str, Any]]:
+    """
+    Сравнение размера шаблона в промпте для разных представлений
+
+    Returns:
+        {'json': {'chars', 'tokens', 'method'}, 'json_minified': {...}, 'compact': {...}}
+    """
+    variants = {
+        'json': json.dumps(tz_json, ensure_ascii=False, indent=2),
+        'json_minified': json.dumps(tz_json, ensure_ascii=False, separators=(',', ':')),
+        'compact': encode_for_prompt(tz_json),
+    }
+    report = {}
+    for name, text in variants.items():
+        tokens, method = count_tokens(text)
+        report[name] = {'chars': len(text), 'tokens': tokens, 'method': method}
+    return report
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Отбор секций шаблона TZ.json по содержимому документа
+
+Перед основным промптом по тексту документа строится локальный индекс (фрагменты
+по ~60 терминов, BM25). Для каждой секции шаблона ("Технические характеристики >
+Люнет", "Комплектация > Система ЧПУ", ...) ищутся ее название, названия параметров
+и синонимы match из глоссария. Секции без подтверждения в тексте не отправляются
+в ИИ (вместе с их частью глоссария), а в результате заполняются пустыми
+параметрами из шаблона (backfill).
+
+Термин - слово в нижнем регистре, обрезанное до 5 символов (грубая замена стемминга
+для русских словоформ). Оценка фразы - лучший BM25 по фрагментам, нормированный на
+оценку фрагмента, содержащего все термины фразы: 1.0 - все термины встретились рядом.
+
+Включается в сценарии: "prompts": {"main": {"tz_pruning": true, ...}}
+
+Настройки через переменные окружения:
+    TZ_PRUNING_MIN_SCORE - минимальная нормированная оценка секции (по умолчанию 0.75)
+"""
+
+import copy
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Глубина секций, которые могут быть отброшены: (раздел, подраздел)
+SECTION_DEPTH = 2
+STEM_LENGTH = 5
+PASSAGE_TERMS = 60
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+WORD_RE = re.compile(r'[a-zа-я0-9]+')
+STOP_WORDS = {
+    'по', 'на', 'до', 'от', 'из', 'для', 'при', 'или', 'не', 'без', 'под', 'над', 'за', 'во',
+    'со', 'то', 'как', 'что', 'это', 'все', 'его', 'ее', 'их', 'так', 'же', 'шт', 'мм', 'макс',
+    'мин', 'тип', 'наличие', 'количество', 'кол', 'вид',
+}
+
+SectionPath = Tuple[str, ...]
+
+
+def terms(text: str) -> List[str]:
+    """Термины текста: слова без стоп-слов, обрезанные до STEM_LENGTH символов"""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [word[:STEM_LENGTH] for word in words if len(word) > 1 and word not in STOP_WORDS]
+
+
+class DocumentIndex:
+    """Инвертированный индекс фрагментов документа для оценки BM25"""
+
+    def __init__(self, text: str, passage_terms: int = PASSAGE_TERMS):
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+
+        passage: List[str] = []
+        for line in text.splitlines():
+            passage.extend(terms(line))
+            if len(passage) >= passage_terms:
+                self._add(passage)
+                passage = []
+        if passage or not self.lengths:
+            self._add(passage)
+
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) or 1.0
+
+    def _add(self, passage: List[str]) -> None:
+        index = len(self.lengths)
+        self.lengths.append(len(passage))
+        for term, count in Counter(passage).items():
+            self.postings[term].append((index, count))
+
+    def idf(self, term: str) -> float:
+        count = len(self.postings.get(term, ()))
+        passages = len(self.lengths)
+        return math.log(1 + (passages - count + 0.5) / (count + 0.5))
+
+    def phrase_score(self, phrase: str) -> float:
+        """
+        Нормированная оценка фразы: лучший BM25 фрагмента / BM25 идеального фрагмента
+
+        Returns:
+            0.0 - ни один термин не найден; ~1.0 - все термины фразы в одном фрагменте
+        """
+        query = set(terms(phrase))
+        if not query:
+            return 0.0
+
+        scores: Dict[int, float] = defaultdict(float)
+        ideal = 0.0
+        for term in query:
+            idf = self.idf(term)
+            ideal += idf
+            for passage, count in self.postings.get(term, ()):
+                norm = 1 - BM25_B + BM25_B * self.lengths[passage] / self.avg_length
+                scores[passage] += idf * count * (BM25_K1 + 1) / (count + BM25_K1 * norm)
+        if not scores or ideal <= 0:
+            return 0.0
+        return max(scores.values()) / ideal
+
+
+def _is_parameter(node) -> bool:
+    return isinstance(node, dict) and ('значение' in node or 'match' in node or 'unit' in node)
+
+
+def iter_sections(tree: Dict, depth: int = SECTION_DEPTH) -> Iterator[Tuple[SectionPath, Dict]]:
+    """(путь секции, секция) на заданной глубине шаблона или глоссария"""
+    def walk(node: Dict, path: SectionPath):
+        for key, value in node.items():
+            if not isinstance(value, dict) or _is_parameter(value):
+                continue
+            if len(path) + 1 == depth:
+                yield path + (key,), value
+            else:
+                yield from walk(value, path + (key,))
+
+    yield from walk(tree, ())
+
+
+def _get(tree: Dict, path: Iterable[str]) -> Optional[Dict]:
+    node = tree
+    for key in path:
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return node
+
+
+def _section_phrases(section_path: SectionPath, section: Dict, glossary: Optional[Dict]) -> Iterator[str]:
+    """Название секции, названия ее параметров и синонимы из глоссария"""
+    yield section_path[-1]
+    glossary_section = _get(glossary, section_path) if glossary else None
+    for name in section:
+        yield name
+        entry = glossary_section.get(name) if isinstance(glossary_section, dict) else None
+        if isinstance(entry, dict):
+            for synonym in entry.get('match') or []:
+                if isinstance(synonym, str):
+                    yield synonym
+
+
+def slice_tree(tree: Dict, sections: Iterable[SectionPath]) -> Dict:
+    """Часть шаблона или глоссария только с указанными секциями (порядок ключей сохраняется)"""
+    wanted = set(sections)
+    result: Dict = {}
+    for path, section in iter_sections(tree, max((len(path) for path in wanted), default=SECTION_DEPTH)):
+        if path in wanted:
+            node = result
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = section
+    return result
+
+
+def backfill(answer: Dict, tz_json: Dict) -> Dict:
+    """
+    Полная структура шаблона: параметры из ответа ИИ, остальное - пустые параметры шаблона
+
+    Ключи, которых нет в шаблоне, отбрасываются: структура результата всегда совпадает с TZ.json.
+    """
+    if not isinstance(answer, dict):
+        return copy.deepcopy(tz_json)
+
+    result = {}
+    for key, template in tz_json.items():
+        value = answer.get(key)
+        if isinstance(template, dict) and not _is_parameter(template):
+            result[key] = backfill(value, template) if isinstance(value, dict) else copy.deepcopy(template)
+        elif isinstance(template, dict) and isinstance(value, dict):
+            result[key] = {**template, **value}
+        else:
+            result[key] = copy.deepcopy(template) if value is None else value
+    return result
+
+
+class PruneResult:
+    """Результат отбора секций для документа"""
+
+    def __init__(self, tz_json: Dict, kept: List[SectionPath], dropped: List[SectionPath],
+                 scores: Dict[SectionPath, float]):
+        self.tz_json = tz_json
+        self.kept = kept
+        self.dropped = dropped
+        self.scores = scores
+
+    @property
+    def pruned(self) -> bool:
+        return bool(self.dropped)
+
+
+def prune_template(converted_text: str, tz_json: Dict, glossary: Optional[Dict] = None,
+                   min_score: Optional[float] = None) -> PruneResult:
+    """
+    Отбирает секции шаблона, подтвержденные текстом документа
+
+    Args:
+        converted_text: Текст документа
+        tz_json: Полный шаблон TZ.json
+        glossary: Глоссарий (синонимы match), той же структуры, что шаблон
+        min_score: Порог нормированной оценки секции (по умолчанию TZ_PRUNING_MIN_SCORE)
+
+    Returns:
+        PruneResult; если ни одна секция не подтверждена (например, текст не извлечен),
+        шаблон возвращается целиком
+    """
+    if min_score is None:
+        min_score = float(os.environ.get('TZ_PRUNING_MIN_SCORE', 0.75))
+
+    index = DocumentIndex(converted_text)
+    kept: List[SectionPath] = []
+    dropped: List[SectionPath] = []
+    scores: Dict[SectionPath, float] = {}
+    for path, section in iter_sections(tz_json):
+        score = 0.0
+        for phrase in _section_phrases(path, section, glossary):
+            score = max(score, index.phrase_score(phrase))
+            if score >= min_score:
+                break
+        scores[path] = score
+        (kept if score >= min_score else dropped).append(path)
+
+    if not kept:
+        return PruneResult(tz_json, kept + dropped, [], scores)
+    return PruneResult(slice_tree(tz_json, kept), kept, dropped, scores)
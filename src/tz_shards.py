@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Разбиение шаблона TZ.json на части для параллельных запросов основного промпта
+
+Каждый раздел верхнего уровня ("Технические характеристики", "Комплектация") -
+отдельная часть; раздел, в котором больше max_parameters параметров, делится на
+группы подряд идущих подразделов примерно равного размера. Части отправляются
+в ИИ параллельно (каждая со своей частью глоссария), ответы объединяются
+в полную структуру шаблона в порядке TZ.json, поэтому результат не зависит
+от порядка получения ответов.
+
+Включается в сценарии: "prompts": {"main": {"sharding": true, ...}}
+
+Настройки через переменные окружения:
+    MAIN_SHARD_MAX_PARAMETERS - максимум параметров в одной части (по умолчанию 150)
+    MAIN_SHARD_RETRIES - повторы части с ошибкой ответа (по умолчанию 1)
+    MAIN_MAX_PARALLEL_REQUESTS - максимум одновременных запросов основного промпта одной
+        задачи: части шаблона × части длинного документа (по умолчанию 8)
+"""
+
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tz_compact import iter_parameters
+from tz_relevance import SectionPath, backfill, iter_sections, slice_tree
+
+
+class TemplateShard:
+    """Часть шаблона: подразделы одного раздела верхнего уровня"""
+
+    def __init__(self, name: str, sections: List[SectionPath], tz_json: Dict):
+        self.name = name
+        self.sections = sections
+        self.tz_json = tz_json
+
+    @property
+    def parameters(self) -> int:
+        return sum(1 for _ in iter_parameters(self.tz_json))
+
+
+def shard_retries() -> int:
+    """Число повторов части при ошибке ответа ИИ"""
+    return int(os.environ.get('MAIN_SHARD_RETRIES', 1))
+
+
+def max_parallel_requests() -> int:
+    """Максимум одновременных запросов основного промпта одной задачи"""
+    return max(1, int(os.environ.get('MAIN_MAX_PARALLEL_REQUESTS', 8)))
+
+
+def _groups(sections: List[Tuple[SectionPath, int]], max_parameters: int) -> List[List[SectionPath]]:
+    """Подразделы раздела, сгруппированные подряд в части примерно равного размера"""
+    total = sum(count for _, count in sections)
+    parts = max(1, math.ceil(total / max(1, max_parameters)))
+    target = total / parts
+
+    groups: List[List[SectionPath]] = [[]]
+    size = 0
+    for path, count in sections:
+        if groups[-1] and size + count / 2 > target and len(groups) < parts:
+            groups.append([])
+            size = 0
+        groups[-1].append(path)
+        size += count
+    return groups
+
+
+def split_template(tz_json: Dict, max_parameters: Optional[int] = None) -> List[TemplateShard]:
+    """
+    Части шаблона в порядке TZ.json
+
+    Args:
+        tz_json: Шаблон (полный или отобранный для документа)
+        max_parameters: Максимум параметров в части (по умолчанию MAIN_SHARD_MAX_PARAMETERS)
+    """
+    if max_parameters is None:
+        max_parameters = int(os.environ.get('MAIN_SHARD_MAX_PARAMETERS', 150))
+
+    by_top: Dict[str, List[Tuple[SectionPath, int]]] = {}
+    for path, section in iter_sections(tz_json):
+        by_top.setdefault(path[0], []).append((path, sum(1 for _ in iter_parameters(section))))
+
+    shards = []
+    for top, sections in by_top.items():
+        groups = _groups(sections, max_parameters)
+        for number, paths in enumerate(groups, 1):
+            name = top if len(groups) == 1 else f"{top} ({number}/{len(groups)})"
+            shards.append(TemplateShard(name, paths, slice_tree(tz_json, paths)))
+    return shards
+
+
+def merge_shards(answers: Iterable[Tuple[TemplateShard, Dict]], tz_json: Dict) -> Dict:
+    """
+    Объединяет ответы частей в полную структуру шаблона
+
+    Из ответа части берутся только ее подразделы; подразделы частей без ответа
+    заполняются пустыми параметрами шаблона.
+    """
+    merged: Dict = {}
+    for shard, answer in answers:
+        if not isinstance(answer, dict):
+            continue
+        for path in shard.sections:
+            node = answer
+            for key in path:
+                node = node.get(key) if isinstance(node, dict) else None
+            if isinstance(node, dict):
+                target = merged
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = node
+    return backfill(merged, tz_json)
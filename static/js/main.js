@@ -15,8 +15,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressSteps = document.getElementById('progressSteps');
     const usageInfo = document.getElementById('usageInfo');
     
-    // Глобальная переменная для интервала polling
-    let statusPollInterval = null;
+    // Текущая подписка на статус задачи (SSE или long-polling)
+    let statusEventSource = null;
+    let statusUpdatesGeneration = 0;
     let currentTaskId = null; // Текущий task_id
     
     // Управление боковой панелью на мобильных
@@ -196,10 +197,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     cancelBtn.style.display = 'none';
                     
                     // Останавливаем polling
-                    if (statusPollInterval) {
-                        clearInterval(statusPollInterval);
-                        statusPollInterval = null;
-                    }
+                    stopStatusUpdates();
                 } else {
                     console.error('❌ Ошибка остановки обработки:', response.status);
                     if (typeof toast !== 'undefined') {
@@ -257,10 +255,7 @@ document.addEventListener('DOMContentLoaded', function() {
         localStorage.setItem('taskStartTime', Date.now().toString());
         
         // Очищаем предыдущий интервал если есть
-        if (statusPollInterval) {
-            clearInterval(statusPollInterval);
-            statusPollInterval = null;
-        }
+        stopStatusUpdates();
         console.log('🆔 Task ID сгенерирован:', taskId);
         
         // Создаем FormData
@@ -278,6 +273,10 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('ai_provider', aiProvider);
         console.log('🤖 AI провайдер выбран:', aiProvider);
         
+        // Без кэша - все промпты отправляются в ИИ заново
+        const useCache = !document.getElementById('noCache').checked;
+        formData.append('use_cache', useCache ? 'true' : 'false');
+        
         // Загружаем информацию о сценарии для показа правильных шагов (не блокируем отправку)
         loadScenarioSteps(scenarioId).catch(err => {
             console.warn('⚠️ Не удалось загрузить информацию о сценарии:', err);
@@ -294,11 +293,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 file_size: file.size,
                 task_id: taskId,
                 scenario_id: scenarioId,
-                ai_provider: aiProvider
+                ai_provider: aiProvider,
+                use_cache: useCache
             });
             
-            // Запускаем запрос (без таймаута на клиенте, так как обработка может быть долгой)
-            // Таймауты настроены на сервере (nginx: 1200s, gunicorn: 2400s)
+            // Сервер сохраняет файл и ставит задачу в очередь, ответ приходит сразу
+            // Прогресс и результат обработки получаем через polling статуса
             let response;
             try {
                 response = await fetch('/upload', {
@@ -349,12 +349,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
-            // Останавливаем polling после получения результата
-            if (statusPollInterval) {
-                clearInterval(statusPollInterval);
-                statusPollInterval = null;
-                console.log('✅ Polling остановлен после получения ответа от /upload');
+            // Задача поставлена в очередь - результат придет через polling статуса
+            if (response.ok && data.queued) {
+                console.log('📥 Задача в очереди, ожидаем завершения через polling:', data.task_id);
+                return;
             }
+
+            // Останавливаем polling после получения результата
+            stopStatusUpdates();
             
             // Очищаем сохраненный task_id при успехе
             if (response.ok && data.success) {
@@ -413,14 +415,22 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    function stopStatusUpdates() {
+        // Закрываем поток событий и останавливаем long-polling (если был запущен)
+        statusUpdatesGeneration += 1;
+        if (statusEventSource) {
+            statusEventSource.close();
+            statusEventSource = null;
+        }
+    }
+    
     function startStatusPolling(taskId) {
-        console.log('🔄 Запуск polling для task_id:', taskId);
+        console.log('🔄 Подписка на статус task_id:', taskId);
         
-        // Очищаем предыдущий интервал если есть (используем глобальную переменную)
-        if (statusPollInterval) {
-            clearInterval(statusPollInterval);
-            statusPollInterval = null;
-        }
+        // Останавливаем предыдущую подписку если есть
+        stopStatusUpdates();
+        const generation = statusUpdatesGeneration;
+        let lastEventId = 0;
         
         // Показываем блок метрик
         const metricsBox = document.getElementById('metricsBox');
@@ -440,112 +450,146 @@ document.addEventListener('DOMContentLoaded', function() {
             cancelBtn.style.display = 'inline-block';
         }
         
-        // Функция для обновления статуса
-        const updateStatus = async () => {
-            try {
-                // Polling запрос (без таймаута на клиенте)
+        // Обработка очередного статуса. Возвращает true, если обработка завершена
+        const handleStatus = (status) => {
+            console.log('📊 Статус обновлен:', status.stage, status.message, status.progress + '%');
+            updateProgressFromStatus(status);
+            
+            if (status.status !== 'completed' && status.status !== 'error' && status.status !== 'cancelled') {
+                return false;
+            }
+            
+            // Обработка завершена или ошибка - отписываемся от статуса
+            console.log('✅ Обработка завершена, останавливаем обновления статуса');
+            stopStatusUpdates();
+            
+            // Очищаем сохраненный task_id
+            localStorage.removeItem('currentTaskId');
+            localStorage.removeItem('taskStartTime');
+            currentTaskId = null;
+            
+            // Скрываем кнопку остановки
+            const cancelBtn = document.getElementById('cancelBtn');
+            if (cancelBtn) {
+                cancelBtn.style.display = 'none';
+            }
+            
+            // Восстанавливаем кнопку
+            submitBtn.disabled = false;
+            loader.style.display = 'none';
+            const btnText = document.querySelector('.btn-text');
+            if (btnText) {
+                btnText.textContent = 'Обработать с помощью ИИ';
+            }
+            
+            if (status.status === 'error') {
+                showError(status.message || 'Произошла ошибка при обработке');
+            } else if (status.status === 'cancelled') {
+                showError('Обработка отменена пользователем');
+            } else if (status.status === 'completed' && status.document) {
+                // Если есть данные документа, показываем успех с кнопками скачивания
+                const doc = status.document;
+                const successData = {
+                    success: true,
+                    message: 'Обработка завершена успешно',
+                    task_id: taskId,
+                    results: {
+                        main: {
+                            json_file: doc.json_file,
+                            json_size: doc.json_size || 0,
+                            json_url: doc.json_url,
+                            excel_file: doc.excel_file,
+                            excel_size: doc.excel_size || 0,
+                            excel_url: doc.excel_url,
+                            sheets: []
+                        }
+                    },
+                    metrics: status.metrics || {}
+                };
+                showSuccess(successData);
+            } else if (status.status === 'completed') {
+                // Если нет данных документа, просто показываем сообщение
+                showError('Обработка завершена, но данные документа не найдены. Проверьте "Мои документы".');
+            }
+            return true;
+        };
+        
+        const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+        
+        // Запасной вариант: long-polling (сервер отвечает, как только статус изменится)
+        const longPoll = async () => {
+            console.log('🔁 Статус через long-polling');
+            while (generation === statusUpdatesGeneration) {
                 let response;
                 try {
-                    response = await fetch(`/api/status/${taskId}`);
+                    response = await fetch(`/api/status/${taskId}/poll?since=${lastEventId}`);
                 } catch (fetchError) {
                     console.warn('⚠️ Ошибка polling запроса:', fetchError);
-                    return; // Пропускаем этот запрос, следующий попробует снова
+                    await sleep(2000);
+                    continue;
+                }
+                if (generation !== statusUpdatesGeneration) {
+                    return;
                 }
                 
                 if (response.ok) {
                     const status = await response.json();
-                    console.log('📊 Статус обновлен:', status.stage, status.message, status.progress + '%');
-                    updateProgressFromStatus(status);
-                    
-                    // Если обработка завершена или ошибка, останавливаем polling
-                    if (status.status === 'completed' || status.status === 'error' || status.status === 'cancelled') {
-                        console.log('✅ Обработка завершена, останавливаем polling');
-                        if (statusPollInterval) {
-                            clearInterval(statusPollInterval);
-                            statusPollInterval = null;
-                        }
-                        
-                        // Очищаем сохраненный task_id
-                        localStorage.removeItem('currentTaskId');
-                        localStorage.removeItem('taskStartTime');
-                        currentTaskId = null;
-                        
-                        // Скрываем кнопку остановки
-                        const cancelBtn = document.getElementById('cancelBtn');
-                        if (cancelBtn) {
-                            cancelBtn.style.display = 'none';
-                        }
-                        
-                        // Восстанавливаем кнопку
-                        submitBtn.disabled = false;
-                        loader.style.display = 'none';
-                        const btnText = document.querySelector('.btn-text');
-                        if (btnText) {
-                            btnText.textContent = 'Обработать с помощью ИИ';
-                        }
-                        
-                        if (status.status === 'error') {
-                            showError(status.message || 'Произошла ошибка при обработке');
-                        } else if (status.status === 'cancelled') {
-                            showError('Обработка отменена пользователем');
-                        } else if (status.status === 'completed' && status.document) {
-                            // Если есть данные документа, показываем успех с кнопками скачивания
-                            const doc = status.document;
-                            const successData = {
-                                success: true,
-                                message: 'Обработка завершена успешно',
-                                task_id: taskId,
-                                results: {
-                                    main: {
-                                        json_file: doc.json_file,
-                                        json_size: doc.json_size || 0,
-                                        json_url: doc.json_url,
-                                        excel_file: doc.excel_file,
-                                        excel_size: doc.excel_size || 0,
-                                        excel_url: doc.excel_url,
-                                        sheets: []
-                                    }
-                                },
-                                metrics: status.metrics || {}
-                            };
-                            showSuccess(successData);
-                        } else if (status.status === 'completed') {
-                            // Если нет данных документа, просто показываем сообщение
-                            showError('Обработка завершена, но данные документа не найдены. Проверьте "Мои документы".');
-                        }
+                    lastEventId = status.event_id || lastEventId;
+                    if (handleStatus(status)) {
+                        return;
                     }
-                } else if (response.status === 404) {
-                    // Если задача не найдена, но мы уже видели статус "processing" или "completed",
-                    // значит задача завершилась и статус был удален
-                    // Проверяем, не завершилась ли обработка (если прошло больше 30 секунд с начала)
-                    const taskStartTime = localStorage.getItem('taskStartTime');
-                    if (taskStartTime) {
-                        const elapsed = (Date.now() - parseInt(taskStartTime)) / 1000;
-                        if (elapsed > 30) {
-                            // Задача, вероятно, завершилась, но статус удален
-                            // Пытаемся получить результат через основной endpoint
-                            console.log('⏳ Задача не найдена, но прошло достаточно времени. Проверяем результаты...');
-                            // Не останавливаем polling сразу, продолжаем попытки еще немного
-                        } else {
-                            console.log('⏳ Задача еще не создана на сервере, ожидание...');
-                        }
-                    } else {
-                        console.log('⏳ Задача еще не создана на сервере, ожидание...');
+                    // Задача появилась на сервере - возвращаемся к потоку событий
+                    if (window.EventSource && sseOpenAttempts < 3) {
+                        openEventSource();
+                        return;
                     }
+                } else if (response.status === 404) {
+                    // Задача еще не создана на сервере или статус уже удален
+                    console.log('⏳ Задача не найдена на сервере, ожидание...');
+                    await sleep(1000);
                 } else {
                     console.warn('⚠️ Ошибка получения статуса:', response.status, response.statusText);
+                    await sleep(2000);
                 }
-            } catch (error) {
-                console.warn('⚠️ Ошибка получения статуса:', error);
             }
         };
         
-        // Обновляем сразу
-        updateStatus();
+        // Основной вариант: Server-Sent Events. При обрыве EventSource переподключается сам
+        // и передает Last-Event-ID, сервер досылает пропущенные события из журнала задачи
+        let sseOpenAttempts = 0;
+        const openEventSource = () => {
+            sseOpenAttempts += 1;
+            const source = new EventSource(`/api/status/${taskId}/events?last_event_id=${lastEventId}`);
+            statusEventSource = source;
+            source.addEventListener('status', (event) => {
+                lastEventId = parseInt(event.lastEventId, 10) || lastEventId;
+                try {
+                    handleStatus(JSON.parse(event.data));
+                } catch (error) {
+                    console.warn('⚠️ Ошибка обработки события статуса:', error);
+                }
+            });
+            source.addEventListener('gone', () => {
+                // Статус удален на сервере - дальше опрашиваем через long-polling
+                source.close();
+                statusEventSource = null;
+                longPoll();
+            });
+            source.onerror = () => {
+                // CLOSED - сервер отказал (404 до создания задачи, 503 - лимит потоков, ошибка прокси): переходим на long-polling
+                if (source.readyState === EventSource.CLOSED && statusEventSource === source) {
+                    statusEventSource = null;
+                    longPoll();
+                }
+            };
+            console.log('✅ Подписка на события статуса (SSE) запущена');
+        };
         
-        // Затем каждые 1 секунду для более быстрого обновления
-        statusPollInterval = setInterval(updateStatus, 1000);
-        console.log('✅ Polling запущен, интервал: 1 секунда');
+        if (window.EventSource) {
+            openEventSource();
+        } else {
+            longPoll();
+        }
     }
     
     function updateProgressFromStatus(status) {
@@ -583,12 +627,12 @@ document.addEventListener('DOMContentLoaded', function() {
         // Обновляем метрики
         updateMetrics(status.metrics || {});
         
+        // Частичный результат (параметры, заполненные по глоссарию до ответа ИИ)
+        updatePartialResult(status.partial_result);
+        
         // Если обработка завершена, останавливаем polling
         if (status.status === 'completed' || status.status === 'error') {
-            if (statusPollInterval) {
-                clearInterval(statusPollInterval);
-                statusPollInterval = null;
-            }
+            stopStatusUpdates();
             
             if (status.status === 'completed') {
                 completeAllProgressSteps();
@@ -631,6 +675,13 @@ document.addEventListener('DOMContentLoaded', function() {
             </div>`;
         }
         
+        if (metrics.received_tokens && !metrics.completion_tokens) {
+            html += `<div class="metric-item">
+                <span class="metric-label">Получено токенов ответа</span>
+                <span class="metric-value">${metrics.received_tokens.toLocaleString()}</span>
+            </div>`;
+        }
+        
         if (metrics.time_elapsed) {
             const minutes = Math.floor(metrics.time_elapsed / 60);
             const seconds = Math.floor(metrics.time_elapsed % 60);
@@ -643,6 +694,39 @@ document.addEventListener('DOMContentLoaded', function() {
         metricsContainer.innerHTML = html;
     }
 
+    function escapeHtml(value) {
+        return String(value)
+            .replace(/&/g, '&amp;')
+            .replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;');
+    }
+    
+    function updatePartialResult(partial) {
+        const container = document.getElementById('partialResultContainer');
+        if (!container) return;
+        
+        const parameters = (partial && partial.parameters) || [];
+        if (parameters.length === 0) {
+            container.style.display = 'none';
+            container.innerHTML = '';
+            return;
+        }
+        
+        let html = `<div class="metrics-title" style="margin-top: 16px;">
+            <span>Заполнено по глоссарию до ответа ИИ (${parameters.length})</span>
+        </div>`;
+        parameters.forEach(parameter => {
+            const name = String(parameter['параметр'] || '').split(' > ').pop();
+            html += `<div class="metric-item" title="${escapeHtml(parameter['источник'] || '')}">
+                <span class="metric-label">${escapeHtml(name)}</span>
+                <span class="metric-value">${escapeHtml(parameter['значение'])}</span>
+            </div>`;
+        });
+        container.innerHTML = html;
+        container.style.display = 'block';
+    }
+    
     function resetProgressSteps() {
         const stepIds = ['conversion', 'main', 'instrument_tooling', 'services', 'spare_parts'];
         stepIds.forEach(stepId => {